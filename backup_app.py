@@ -1,223 +1,45 @@
 import os
-import shutil
-import logging
-from datetime import datetime, timedelta
 import tkinter as tk
 from tkinter import filedialog, scrolledtext, ttk
 from threading import Thread
-import time
-import json
-import sqlite3
+from datetime import datetime, timedelta
 from tkinter import messagebox
-import pystray
-from pystray import MenuItem as item
-from PIL import Image, ImageDraw
-import winreg as reg
-
-# Configuração do logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-CONFIG_FILE = "backup_config.json"
-DB_FILE = "backup_history.db"
-
-# Funções de configuração
-def carregar_configuracao():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
-    return {}
-
-def salvar_configuracao(config):
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(config, f, indent=4)
-
-# Funções de histórico
-def inicializar_banco():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS historico (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            data TEXT,
-            origem TEXT,
-            destino TEXT,
-            status TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def adicionar_entrada_historico(origem, destino, status):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO historico (data, origem, destino, status)
-        VALUES (?, ?, ?, ?)
-    ''', (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), origem, destino, status))
-    conn.commit()
-    conn.close()
-
-def obter_historico():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM historico ORDER BY data DESC')
-    historico = cursor.fetchall()
-    conn.close()
-    return historico
-
-def excluir_historico():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM historico')
-    conn.commit()
-    conn.close()
-
-# Inicializar o banco de dados
-inicializar_banco()
-
-# Funções de backup
-def calcular_tamanho_total(origem):
-    total_size = 0
-    for dirpath, _, filenames in os.walk(origem):
-        for filename in filenames:
-            try:
-                total_size += os.path.getsize(os.path.join(dirpath, filename))
-            except (FileNotFoundError, PermissionError) as e:
-                logging.warning(f"Erro ao acessar '{filename}': {e}. Ignorando...")
-    return total_size
-
-def verificar_espaco_suficiente(origem, destino):
-    total_size = calcular_tamanho_total(origem)
-    free_space = shutil.disk_usage(destino).free
-    logging.info(f"Tamanho total do backup: {total_size / (1024 * 1024):.2f} MB")
-    logging.info(f"Espaço livre no destino: {free_space / (1024 * 1024):.2f} MB")
-    if free_space < total_size:
-        logging.error(f"Espaço insuficiente para o backup. Necessário: {total_size / (1024 * 1024):.2f} MB, disponível: {free_space / (1024 * 1024):.2f} MB.")
-        return False
-    return True
-
-def remover_backups_antigos(destino, dias_retencao):
-    limite_data = datetime.now() - timedelta(days=dias_retencao)
-    for root, dirs, files in os.walk(destino, topdown=False):
-        for file_name in files:
-            file_path = os.path.join(root, file_name)
-            try:
-                file_data = datetime.fromtimestamp(os.path.getmtime(file_path))
-                if file_data < limite_data:
-                    os.remove(file_path)
-                    logging.info(f"Arquivo antigo removido: {file_path}")
-            except Exception as e:
-                logging.warning(f"Erro ao remover arquivo '{file_path}': {e}")
-        for dir_name in dirs:
-            dir_path = os.path.join(root, dir_name)
-            try:
-                backup_data = datetime.fromtimestamp(os.path.getmtime(dir_path))
-                if backup_data < limite_data:
-                    shutil.rmtree(dir_path)
-                    logging.info(f"Backup antigo removido: {dir_path}")
-            except Exception as e:
-                logging.warning(f"Erro ao remover diretório '{dir_path}': {e}")
-
-def backup_incremental(origem, destino, progress_callback):
-    total_items = sum(len(files) for _, _, files in os.walk(origem))
-    if total_items == 0:
-        progress_callback(100)
-        return
-    items_copiados = 0
-    for dirpath, _, filenames in os.walk(origem):
-        for filename in filenames:
-            src_path = os.path.join(dirpath, filename)
-            rel_path = os.path.relpath(src_path, origem)
-            dest_path = os.path.join(destino, rel_path)
-            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-
-            if not os.path.exists(dest_path) or os.path.getmtime(src_path) > os.path.getmtime(dest_path):
-                copiar_item(src_path, dest_path)
-                items_copiados += 1
-                progresso = (items_copiados / total_items) * 100
-                progress_callback(progresso)
-    progress_callback(100)  # Garantir que a barra de progresso atinja 100%
-
-def copiar_item(src_path, dest_path):
-    try:
-        shutil.copy2(src_path, dest_path)
-        logging.info(f"Arquivo copiado: {src_path}")
-    except FileNotFoundError as e:
-        logging.warning(f"Arquivo não encontrado '{src_path}': {e}. Ignorando...")
-    except PermissionError as e:
-        logging.warning(f"Erro de permissão ao acessar '{src_path}': {e}. Ignorando...")
-    except Exception as e:
-        logging.error(f"Erro inesperado ao copiar '{src_path}': {e}")
-
-def backup_diario(origem, destino, progress_callback, log_callback, historico_callback, dias_retencao):
-    if not os.path.exists(origem):
-        log_callback(f"Erro: O caminho de origem '{origem}' não foi encontrado.")
-        adicionar_entrada_historico(origem, destino, "Erro: Caminho de origem não encontrado")
-        return
-
-    data_atual = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    backup_path = os.path.join(destino, f"backup_{data_atual}")
-    os.makedirs(backup_path, exist_ok=True)
-
-    # Verifica se há espaço suficiente e backups antigos para remover
-    if not verificar_espaco_suficiente(origem, backup_path):
-        log_callback("Espaço insuficiente para o backup.")
-        adicionar_entrada_historico(origem, destino, "Erro: Espaço insuficiente")
-        return
-    remover_backups_antigos(destino, dias_retencao)
-
-    log_callback(f"Iniciando o backup incremental diário para a data: {data_atual}")
-    backup_incremental(origem, backup_path, progress_callback)
-    log_callback("Backup diário concluído com sucesso!")
-    historico_callback(f"Backup realizado em {data_atual} para {backup_path}")
-    adicionar_entrada_historico(origem, destino, "Sucesso")
-
-def agendar_backup(horario, funcao_backup, *args):
-    def verificar_horario():
-        while True:
-            agora = datetime.now().strftime("%H:%M")
-            if agora == horario:
-                funcao_backup(*args)
-                time.sleep(60)  # Evita múltiplas execuções no mesmo minuto
-            time.sleep(1)
-
-    agendamento_thread = Thread(target=verificar_horario)
-    agendamento_thread.daemon = True
-    agendamento_thread.start()
-
-def backup_completo(origem, destino, progress_callback):
-    total_items = sum(len(files) for _, _, files in os.walk(origem))
-    if total_items == 0:
-        progress_callback(100)
-        return
-    items_copiados = 0
-    for dirpath, _, filenames in os.walk(origem):
-        for filename in filenames:
-            src_path = os.path.join(dirpath, filename)
-            rel_path = os.path.relpath(src_path, origem)
-            dest_path = os.path.join(destino, rel_path)
-            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-            copiar_item(src_path, dest_path)
-            items_copiados += 1
-            progresso = (items_copiados / total_items) * 100
-            progress_callback(progresso)
-    progress_callback(100)  # Garantir que a barra de progresso atinja 100%
-
-def agendar_backup_completo(intervalo_dias, funcao_backup, *args):
-    def verificar_intervalo():
-        while True:
-            ultimo_backup = datetime.now() - timedelta(days=intervalo_dias)
-            if datetime.now() >= ultimo_backup + timedelta(days=intervalo_dias):
-                funcao_backup(*args)
-                time.sleep(60 * 60 * 24)  # Verifica uma vez por dia
-            time.sleep(60 * 60)  # Verifica uma vez por hora
-
-    agendamento_thread = Thread(target=verificar_intervalo)
-    agendamento_thread.daemon = True
-    agendamento_thread.start()
+
+from backup_engine import (
+    configurar_logging,
+    carregar_configuracao,
+    salvar_configuracao,
+    obter_historico,
+    excluir_historico,
+    backup_diario,
+    executar_backup_completo,
+    agendar_backup,
+    agendar_backup_completo,
+    executar_com_trava,
+    configurar_observacao,
+    restaurar,
+    sincronizar_catalogo,
+    buscar_catalogo,
+    listar_versoes,
+    BUSCA_PREFIXO,
+    BUSCA_GLOB,
+    BUSCA_TEXTO,
+    LIMITE_BUSCA_CATALOGO,
+    executar_jobs,
+    agendar_jobs,
+    CanalEventos,
+    MedidorVazao,
+    formatar_bytes,
+)
+
+# pystray, PIL e winreg só são importados quando a bandeja ou o registro do Windows são usados
+
+TAMANHO_PAGINA_HISTORICO = 200
+INTERVALO_EVENTOS_MS = 100  # Frequência com que a interface drena o canal de eventos (10 quadros/s)
 
 # Funções para rodar em segundo plano
 def create_image():
+    from PIL import Image, ImageDraw
     # Generate an image and draw a pattern
     width = 64
     height = 64
@@ -247,6 +69,8 @@ def show_window(icon, item):
     app.root.deiconify()
 
 def hide_window(app):
+    import pystray
+    from pystray import MenuItem as item
     app.root.withdraw()
     image = create_image()
     menu = (item('Show', show_window), item('Quit', quit_program))
@@ -254,6 +78,7 @@ def hide_window(app):
     icon.run()
 
 def add_to_startup():
+    import winreg as reg
     pth = os.path.dirname(os.path.realpath(__file__))
     s_name = "APP_Backup"
     address = os.path.join(pth, "backup_app.exe")
@@ -278,6 +103,8 @@ class BackupApp:
         self.horario_var = tk.StringVar(value=self.config.get("horario", "02:00"))
         self.dias_retencao_var = tk.IntVar(value=self.config.get("dias_retencao", 7))
         self.progress_var = tk.DoubleVar()
+        self.canal_eventos = CanalEventos()
+        self.medidor_vazao = MedidorVazao()
 
         # Paleta de cores Material Design
         self.cores = {
@@ -315,6 +142,7 @@ class BackupApp:
         right_frame = self.criar_coluna_direita(content_frame)
         right_frame.pack(side="right", fill="both", expand=True, padx=(10, 0))
 
+        self.root.after(INTERVALO_EVENTOS_MS, self.processar_eventos)  # Drena o canal de eventos do motor
         self.agendar_backup_automatico()  # Agendar backup automático ao iniciar a aplicação
         add_to_startup()  # Adicionar ao registro para iniciar com o sistema operacional
 
@@ -445,6 +273,9 @@ class BackupApp:
         for text, command in [
             ("Iniciar Backup Incremental", self.iniciar_backup),
             ("Iniciar Backup Completo", self.iniciar_backup_completo),
+            ("Restaurar Backup", self.iniciar_restauracao),
+            ("Executar Todos os Jobs", self.iniciar_jobs),
+            ("Catálogo de Arquivos", self.abrir_catalogo),
             ("Histórico de Backups", self.abrir_historico)
         ]:
             btn = ttk.Button(actions_frame,
@@ -503,10 +334,15 @@ class BackupApp:
         self.log_area.configure(state="disabled")
 
     def agendar_backup_automatico(self):
-        agendar_backup(self.horario_var.get(), backup_diario, self.origem_var.get(), self.destino_var.get(), self.atualizar_progresso, self.atualizar_log, self.atualizar_hist, self.dias_retencao_var.get())
+        if self.config.get("jobs"):
+            # Jobs definidos no JSON: cada um é agendado no seu horário e o par da tela fica para execuções manuais
+            agendar_jobs(self.canal_eventos.progresso, self.canal_eventos.log, self.canal_eventos.historico)
+            return
+        configurar_observacao(self.origem_var.get())
+        agendar_backup(self.horario_var.get(), backup_diario, self.origem_var.get(), self.destino_var.get(), self.canal_eventos.progresso, self.canal_eventos.log, self.canal_eventos.historico, self.dias_retencao_var.get(), chave_trava=self.destino_var.get())
 
     def agendar_backup_completo_automatico(self, intervalo_dias):
-        agendar_backup_completo(intervalo_dias, backup_completo, self.origem_var.get(), self.destino_var.get(), self.atualizar_progresso)
+        agendar_backup_completo(intervalo_dias, executar_backup_completo, self.origem_var.get(), self.destino_var.get(), self.canal_eventos.progresso, self.canal_eventos.log, chave_trava=self.destino_var.get())
 
     def selecionar_pasta_origem(self, config_window):
         origem = filedialog.askdirectory(title="Selecione a pasta de origem")
@@ -525,60 +361,90 @@ class BackupApp:
         self.log_area.insert(tk.END, texto + "\n")
         self.log_area.yview(tk.END)
         self.log_area.configure(state="disabled")
-        messagebox.showinfo("Log de Backup", texto)
 
     def atualizar_hist(self, texto):
         # Remover a referência ao atributo 'hist_area'
         pass
 
-    def atualizar_progresso(self, progresso):
+    def atualizar_progresso(self, progresso, bytes_processados=None, bytes_totais=None):
         self.progress_var.set(progresso)
-        self.progress_label.config(text=f"Progresso: {progresso:.2f}%")
-        self.root.update_idletasks()
+        texto = f"Progresso: {progresso:.2f}%"
+        if bytes_processados is not None and bytes_totais:
+            vazao, eta = self.medidor_vazao.registrar(bytes_processados, bytes_totais)
+            texto += f" - {formatar_bytes(bytes_processados)} de {formatar_bytes(bytes_totais)}"
+            if vazao:
+                texto += f" - {formatar_bytes(vazao)}/s"
+            if eta is not None:
+                texto += f" - restante: {timedelta(seconds=int(eta))}"
+        self.progress_label.config(text=texto)
+
+    def processar_eventos(self):
+        # Executa na thread da interface: aplica o último progresso e junta os logs pendentes
+        progresso, logs, historicos = self.canal_eventos.drenar()
+        if progresso is not None:
+            self.atualizar_progresso(*progresso)
+        for texto in historicos:
+            self.atualizar_hist(texto)
+        if logs:
+            self.atualizar_log("\n".join(logs))
+        self.root.after(INTERVALO_EVENTOS_MS, self.processar_eventos)
 
-    def iniciar_backup(self):
+    def reiniciar_progresso(self):
         self.progress_var.set(0)
         self.progress_label.config(text="Progresso: 0%")
         self.progress_bar.config(style="TProgressbar")
-        self.root.update_idletasks()
+        self.medidor_vazao.reiniciar()
+
+    def iniciar_backup(self):
+        self.reiniciar_progresso()
 
         origem = self.origem_var.get()
         destino = self.destino_var.get()
         dias_retencao = self.dias_retencao_var.get()
 
-        def progress_callback(progresso):
-            self.atualizar_progresso(progresso)
-
-        def log_callback(texto):
-            self.atualizar_log(texto)
-
-        def historico_callback(texto):
-            self.atualizar_hist(texto)
-
-        # Iniciar backup manualmente
-        backup_thread = Thread(target=backup_diario, args=(origem, destino, progress_callback, log_callback, historico_callback, dias_retencao))
+        # Iniciar backup manualmente; o motor publica no canal de eventos e nunca toca no Tk
+        backup_thread = Thread(target=executar_com_trava, args=(destino, backup_diario, origem, destino, self.canal_eventos.progresso, self.canal_eventos.log, self.canal_eventos.historico, dias_retencao))
         backup_thread.start()
 
     def iniciar_backup_completo(self):
-        self.progress_var.set(0)
-        self.progress_label.config(text="Progresso: 0%")
-        self.progress_bar.config(style="TProgressbar")
-        self.root.update_idletasks()
+        self.reiniciar_progresso()
 
         origem = self.origem_var.get()
         destino = self.destino_var.get()
 
-        def progress_callback(progresso):
-            self.atualizar_progresso(progresso)
-
-        def log_callback(texto):
-            self.atualizar_log(texto)
-
         # Iniciar backup completo manualmente
-        backup_thread = Thread(target=backup_completo, args=(origem, destino, progress_callback))
+        # A entrada no histórico é gravada pelo próprio motor, com as métricas, ao final da execução
+        backup_thread = Thread(target=executar_com_trava, args=(destino, executar_backup_completo, origem, destino, self.canal_eventos.progresso, self.canal_eventos.log))
         backup_thread.start()
-        log_callback("Backup completo iniciado com sucesso!")  # Adicionar callback de log aqui
-        adicionar_entrada_historico(origem, destino, "Sucesso")  # Adicionar entrada no histórico
+        self.canal_eventos.log("Backup completo iniciado com sucesso!")  # Adicionar callback de log aqui
+
+    def iniciar_restauracao(self):
+        # Restaura a versão mais recente de todos os arquivos da origem/destino configurados para uma pasta escolhida
+        alvo = filedialog.askdirectory(title="Pasta onde os arquivos serão restaurados")
+        if not alvo:
+            return
+        self.reiniciar_progresso()
+        origem = self.origem_var.get()
+        destino = self.destino_var.get()
+
+        def executar():
+            resultado = restaurar(alvo, origem, destino, progress_callback=self.canal_eventos.progresso)
+            self.canal_eventos.log(f"Restauração concluída: {resultado['restaurados']} arquivo(s) restaurado(s), "
+                                   f"{resultado['inalterados']} já atualizado(s), {resultado['erros']} erro(s).")
+
+        Thread(target=executar_com_trava, args=(destino, executar)).start()
+        self.canal_eventos.log(f"Restauração iniciada para: {alvo}")
+
+    def iniciar_jobs(self):
+        # Todos os jobs da configuração em paralelo, respeitando o limite de tarefas por disco
+        self.reiniciar_progresso()
+
+        def executar():
+            resultado = executar_jobs(None, self.canal_eventos.progresso, self.canal_eventos.log, self.canal_eventos.historico)
+            self.canal_eventos.log(f"Jobs concluídos: {resultado['status']} ({len(resultado['tarefas'])} tarefa(s)).")
+
+        Thread(target=executar_com_trava, args=("jobs", executar)).start()
+        self.canal_eventos.log("Execução dos jobs iniciada.")
 
     def abrir_configuracoes(self):
         config_window = tk.Toplevel(self.root)
@@ -644,23 +510,79 @@ class BackupApp:
         frame = ttk.Frame(history_window, padding="20 20 20 20", style="TFrame")
         frame.pack(fill="both", expand=True)
 
-        columns = ("data", "origem", "destino", "status")
-        tree = ttk.Treeview(frame, columns=columns, show="headings")
+        # Filtros aplicados no banco; as páginas são carregadas conforme a rolagem chega ao fim
+        filtros_frame = ttk.Frame(frame)
+        filtros_frame.pack(fill="x", pady=(0, 10))
+        filtro_var = tk.StringVar()
+        status_var = tk.StringVar()
+        ttk.Label(filtros_frame, text="Origem/Destino:").pack(side="left")
+        filtro_entry = ttk.Entry(filtros_frame, textvariable=filtro_var, width=40)
+        filtro_entry.pack(side="left", padx=5)
+        ttk.Label(filtros_frame, text="Status:").pack(side="left")
+        ttk.Combobox(filtros_frame, textvariable=status_var, width=15, state="readonly",
+                     values=("", "Sucesso", "Erro", "Parcial", "Em andamento")).pack(side="left", padx=5)
+
+        columns = ("data", "origem", "destino", "status", "arquivos", "dados", "duracao", "erros")
+        tree_frame = ttk.Frame(frame)
+        tree_frame.pack(fill="both", expand=True)
+        tree = ttk.Treeview(tree_frame, columns=columns, show="headings")
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
         tree.heading("data", text="Data")
         tree.heading("origem", text="Origem")
         tree.heading("destino", text="Destino")
         tree.heading("status", text="Status")
-
-        for row in obter_historico():
-            tree.insert("", tk.END, values=row[1:])
-
-        tree.pack(fill="both", expand=True)
+        tree.heading("arquivos", text="Arquivos")
+        tree.heading("dados", text="Dados")
+        tree.heading("duracao", text="Duração")
+        tree.heading("erros", text="Erros")
+
+        paginacao = {"apos": None, "fim": False, "carregando": False}
+
+        def carregar_pagina():
+            paginacao["carregando"] = False
+            if paginacao["fim"]:
+                return
+            linhas = obter_historico(TAMANHO_PAGINA_HISTORICO, paginacao["apos"], filtro_var.get(), status_var.get())
+            for execucao_id, data, origem, destino, status, arquivos, bytes_copiados, duracao, erros in linhas:
+                tree.insert("", tk.END, values=(
+                    data, origem, destino, status,
+                    "" if arquivos is None else arquivos,
+                    "" if bytes_copiados is None else formatar_bytes(bytes_copiados),
+                    "" if duracao is None else str(timedelta(seconds=int(duracao))),
+                    "" if erros is None else erros))
+            if linhas:
+                paginacao["apos"] = (linhas[-1][1], linhas[-1][0])
+            paginacao["fim"] = len(linhas) < TAMANHO_PAGINA_HISTORICO
+
+        def recarregar(*_):
+            tree.delete(*tree.get_children())
+            paginacao.update(apos=None, fim=False)
+            carregar_pagina()
+
+        def rolagem(primeiro, ultimo):
+            scrollbar.set(primeiro, ultimo)
+            if float(ultimo) > 0.9 and not paginacao["fim"] and not paginacao["carregando"]:
+                paginacao["carregando"] = True
+                history_window.after_idle(carregar_pagina)
+
+        tree.configure(yscrollcommand=rolagem)
+        ttk.Button(filtros_frame, text="Filtrar", command=recarregar).pack(side="left", padx=5)
+        filtro_entry.bind("<Return>", recarregar)
+        status_var.trace_add("write", recarregar)
+        carregar_pagina()
+
+        tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
 
         # Ajustar as colunas ao conteúdo
-        tree.column("data", width=100, anchor=tk.W)
-        tree.column("origem", width=400, anchor=tk.W)
-        tree.column("destino", width=400, anchor=tk.W)
-        tree.column("status", width=50, anchor=tk.W)
+        tree.column("data", width=130, anchor=tk.W)
+        tree.column("origem", width=250, anchor=tk.W)
+        tree.column("destino", width=250, anchor=tk.W)
+        tree.column("status", width=120, anchor=tk.W)
+        tree.column("arquivos", width=70, anchor=tk.E)
+        tree.column("dados", width=80, anchor=tk.E)
+        tree.column("duracao", width=70, anchor=tk.E)
+        tree.column("erros", width=50, anchor=tk.E)
 
         ttk.Button(frame, text="Excluir Registros", command=self.excluir_historico).pack(pady=10)
 
@@ -668,19 +590,180 @@ class BackupApp:
         excluir_historico()
         self.atualizar_log("Histórico de backups excluído com sucesso!")
 
+    def abrir_catalogo(self):
+        # Busca arquivos em todos os snapshots; ao selecionar um caminho, lista todas as versões dele
+        catalogo_window = tk.Toplevel(self.root)
+        catalogo_window.title("Catálogo de Arquivos")
+        catalogo_window.geometry("1100x700")
+        catalogo_window.config(bg=self.cores['background'])
+
+        frame = ttk.Frame(catalogo_window, padding="20 20 20 20", style="TFrame")
+        frame.pack(fill="both", expand=True)
+
+        busca_frame = ttk.Frame(frame)
+        busca_frame.pack(fill="x", pady=(0, 10))
+        modos = {"Prefixo": BUSCA_PREFIXO, "Glob": BUSCA_GLOB, "Texto": BUSCA_TEXTO}
+        termo_var = tk.StringVar()
+        modo_var = tk.StringVar(value="Prefixo")
+        situacao_var = tk.StringVar(value="Atualizando o catálogo...")
+        ttk.Label(busca_frame, text="Buscar:").pack(side="left")
+        termo_entry = ttk.Entry(busca_frame, textvariable=termo_var, width=50)
+        termo_entry.pack(side="left", padx=5)
+        ttk.Combobox(busca_frame, textvariable=modo_var, width=10, state="readonly", values=tuple(modos)).pack(side="left", padx=5)
+
+        # Caminhos encontrados (versão mais recente de cada um)
+        resultados_frame = ttk.Frame(frame)
+        resultados_frame.pack(fill="both", expand=True)
+        resultados_tree = ttk.Treeview(resultados_frame, columns=("caminho", "tamanho", "modificado", "versoes", "ultimo"),
+                                       show="headings", selectmode="browse")
+        resultados_scrollbar = ttk.Scrollbar(resultados_frame, orient="vertical", command=resultados_tree.yview)
+        resultados_tree.configure(yscrollcommand=resultados_scrollbar.set)
+        for coluna, titulo, largura, ancora in (("caminho", "Caminho", 520, tk.W), ("tamanho", "Tamanho", 90, tk.E),
+                                                ("modificado", "Modificado", 140, tk.W), ("versoes", "Versões", 70, tk.E),
+                                                ("ultimo", "Último Backup", 140, tk.W)):
+            resultados_tree.heading(coluna, text=titulo)
+            resultados_tree.column(coluna, width=largura, anchor=ancora)
+        resultados_tree.pack(side="left", fill="both", expand=True)
+        resultados_scrollbar.pack(side="right", fill="y")
+
+        # Versões do caminho selecionado, da mais recente para a mais antiga
+        ttk.Label(frame, text="Versões do arquivo selecionado:").pack(anchor="w", pady=(10, 5))
+        versoes_frame = ttk.Frame(frame)
+        versoes_frame.pack(fill="both", expand=True)
+        versoes_tree = ttk.Treeview(versoes_frame, columns=("tamanho", "modificado", "desde", "ate", "snapshot"),
+                                    show="headings", selectmode="browse")
+        for coluna, titulo, largura, ancora in (("tamanho", "Tamanho", 90, tk.E), ("modificado", "Modificado", 140, tk.W),
+                                                ("desde", "Desde", 140, tk.W), ("ate", "Até", 140, tk.W),
+                                                ("snapshot", "Snapshot", 450, tk.W)):
+            versoes_tree.heading(coluna, text=titulo)
+            versoes_tree.column(coluna, width=largura, anchor=ancora)
+        versoes_tree.pack(fill="both", expand=True)
+
+        encontrados = {}  # item da árvore -> VersaoCatalogo
+        versoes = {}
+
+        def formatar_mtime(mtime):
+            return datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S") if mtime is not None else ""
+
+        # As consultas rodam fora da thread do Tk, que assim não trava esperando o banco enquanto a
+        # sincronização grava o catálogo; o resultado só é entregue se ainda for a consulta mais recente
+        consultas = {"buscar": 0, "versoes": 0}
+
+        def consultar(tipo, funcao, entregar):
+            consultas[tipo] += 1
+            geracao = consultas[tipo]
+            resultado = {}
+
+            def executar():
+                try:
+                    resultado["valor"] = funcao()
+                except Exception as e:
+                    resultado["erro"] = e
+
+            trabalho = Thread(target=executar, daemon=True)
+            trabalho.start()
+
+            def aguardar():
+                if consultas[tipo] != geracao or not catalogo_window.winfo_exists():
+                    return
+                if trabalho.is_alive():
+                    catalogo_window.after(50, aguardar)
+                elif "erro" in resultado:
+                    situacao_var.set(f"Erro na consulta: {resultado['erro']}")
+                else:
+                    entregar(resultado["valor"])
+
+            aguardar()
+
+        def buscar(*_):
+            resultados_tree.delete(*resultados_tree.get_children())
+            versoes_tree.delete(*versoes_tree.get_children())
+            encontrados.clear()
+            versoes.clear()
+            consultas["versoes"] += 1  # Descarta versões pedidas para um resultado anterior
+            situacao_var.set("Buscando...")
+            termo, modo = termo_var.get(), modos[modo_var.get()]
+
+            def mostrar(resultado):
+                for versao in resultado:
+                    item = resultados_tree.insert("", tk.END, values=(
+                        versao.rel_path, formatar_bytes(versao.tamanho), formatar_mtime(versao.mtime), versao.versoes, versao.ate))
+                    encontrados[item] = versao
+                situacao_var.set(f"{len(resultado)} arquivo(s) encontrado(s)" +
+                                 (" (refine a busca para ver os demais)" if len(resultado) >= LIMITE_BUSCA_CATALOGO else ""))
+
+            consultar("buscar", lambda: buscar_catalogo(termo, modo, limite=LIMITE_BUSCA_CATALOGO), mostrar)
+
+        def mostrar_versoes(_evento=None):
+            versoes_tree.delete(*versoes_tree.get_children())
+            versoes.clear()
+            selecao = resultados_tree.selection()
+            if not selecao:
+                consultas["versoes"] += 1
+                return
+            rel_path = encontrados[selecao[0]].rel_path
+
+            def mostrar(resultado):
+                for versao in resultado:
+                    item = versoes_tree.insert("", tk.END, values=(
+                        formatar_bytes(versao.tamanho), formatar_mtime(versao.mtime), versao.desde, versao.ate, versao.caminho_snapshot))
+                    versoes[item] = versao
+
+            consultar("versoes", lambda: listar_versoes(rel_path), mostrar)
+
+        def restaurar_versao():
+            selecao = versoes_tree.selection()
+            if not selecao:
+                messagebox.showinfo("Catálogo de Arquivos", "Selecione uma versão para restaurar.", parent=catalogo_window)
+                return
+            versao = versoes[selecao[0]]
+            alvo = filedialog.askdirectory(title="Pasta onde o arquivo será restaurado", parent=catalogo_window)
+            if not alvo:
+                return
+            self.reiniciar_progresso()
+
+            def executar():
+                resultado = restaurar(alvo, snapshot_id=versao.ultimo_snapshot, padroes=[versao.rel_path.replace(os.sep, "/")],
+                                      progress_callback=self.canal_eventos.progresso)
+                self.canal_eventos.log(f"Restauração de '{versao.rel_path}' ({versao.ate}): {resultado['status']}.")
+
+            Thread(target=executar_com_trava, args=(versao.destino, executar)).start()
+            self.canal_eventos.log(f"Restaurando '{versao.rel_path}' para: {alvo}")
+
+        # Snapshots ainda fora do catálogo (o de uma execução recente, ou todos num banco antigo) são
+        # catalogados em segundo plano; as buscas feitas enquanto isso veem o que já entrou
+        sincronizacao = Thread(target=sincronizar_catalogo, daemon=True)
+        sincronizacao.start()
+
+        def aguardar_sincronizacao():
+            if sincronizacao.is_alive():
+                catalogo_window.after(200, aguardar_sincronizacao)
+            else:
+                situacao_var.set("Catálogo atualizado.")
+
+        aguardar_sincronizacao()
+        ttk.Button(busca_frame, text="Buscar", command=buscar).pack(side="left", padx=5)
+        ttk.Label(busca_frame, textvariable=situacao_var).pack(side="left", padx=10)
+        termo_entry.bind("<Return>", buscar)
+        resultados_tree.bind("<<TreeviewSelect>>", mostrar_versoes)
+        ttk.Button(frame, text="Restaurar Versão Selecionada", command=restaurar_versao).pack(pady=10)
+
     def salvar_configuracoes(self):
-        config = {
+        config = dict(self.config)  # Preserva chaves avançadas (ex.: workers_copia) editadas no JSON
+        config.update({
             "origem": self.origem_var.get(),
             "destino": self.destino_var.get(),
             "horario": self.horario_var.get(),
             "dias_retencao": self.dias_retencao_var.get()
-        }
+        })
         salvar_configuracao(config)
+        self.config = config
         self.atualizar_log("Configurações salvas com sucesso!")
         self.agendar_backup_automatico()  # Atualizar agendamento após salvar configurações
 
 # Executando a aplicação
 if __name__ == "__main__":
+    configurar_logging()
     root = tk.Tk()
     global app
     app = BackupApp(root)  # Define app instance here
@@ -0,0 +1,4348 @@
+import os
+import shutil
+import logging
+from datetime import date, datetime, timedelta
+from threading import Thread, Lock, RLock, Condition, get_ident, local
+from contextlib import contextmanager, nullcontext
+import heapq
+import bisect
+import fnmatch
+import errno
+import stat
+import struct
+import sys
+import queue
+import hashlib
+import random
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import time
+import json
+import marshal
+import re
+import sqlite3
+from collections import namedtuple
+
+# Motor de backup sem dependências de interface: importável por scripts e executável em servidores
+# sem interface gráfica via "python -m backup_engine". Módulos pesados e opcionais (tarfile, lzma,
+# zstandard) são carregados apenas pelos modos que os usam.
+
+try:
+    import fcntl  # Clonagem copy-on-write (FICLONE) em Linux
+except ImportError:
+    fcntl = None
+
+_zstandard = None
+
+def carregar_zstandard():
+    # Opcional: compressão zstd no modo arquivo. Retorna None se o pacote não estiver instalado.
+    global _zstandard
+    if _zstandard is None:
+        try:
+            import zstandard
+            _zstandard = zstandard
+        except ImportError:
+            _zstandard = False
+    return _zstandard or None
+
+# Configuração do logging
+def configurar_logging():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CONFIG_FILE = "backup_config.json"
+DB_FILE = "backup_history.db"
+TAMANHO_LOTE_DIARIO = 1000  # Registros do diário por arquivo gravados por executemany
+
+# Telemetria por execução (latências por arquivo só com "metricas_detalhadas" na configuração)
+FAIXAS_TAMANHO = [(4 * 1024, "4K"), (64 * 1024, "64K"), (1024 * 1024, "1M"), (16 * 1024 * 1024, "16M"),
+                  (256 * 1024 * 1024, "256M"), (float("inf"), "maior")]
+LIMITES_LATENCIA = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, 300]  # Segundos, no estilo dos buckets do Prometheus
+TOP_LENTOS = 20
+
+# Observação de alterações na origem (opcional, "observar_alteracoes" na configuração)
+INTERVALO_POLLING_OBSERVADOR = 300  # Segundos entre varreduras do modo polling (sem inotify)
+RECONCILIAR_A_CADA_HORAS = 24       # Varredura completa periódica mesmo com o observador ativo
+TAMANHO_LOTE_ALTERACOES = 500
+
+# Pipeline de cópia
+WORKERS_COPIA_PADRAO = 4
+LIMITE_ARQUIVO_GRANDE = 64 * 1024 * 1024  # Arquivos a partir deste tamanho vão para a fila de grandes
+TAMANHO_FILA_COPIA = 1000
+
+# Comparação em fluxo entre a varredura e o manifesto anterior (memória constante em árvores enormes)
+TAMANHO_PAGINA_MANIFESTO = 10000  # Linhas do manifesto lidas por consulta
+LIMITE_ORDENACAO_MEMORIA = 200000  # Acima disso a ordenação continua em runs ordenados em arquivos temporários
+TAMANHO_BLOCO_LISTA = 1000  # Itens por registro marshal nas listas em disco
+TAMANHO_BLOCO_EM_DISCO = struct.Struct("<I")
+DIFERENCA_NOVO = "novo"
+DIFERENCA_ALTERADO = "alterado"
+DIFERENCA_INALTERADO = "inalterado"
+DIFERENCA_REMOVIDO = "removido"
+
+# Catálogo de versões (busca de arquivos em todos os snapshots)
+BUSCA_PREFIXO = "prefixo"  # Início do caminho relativo: "docs/rel"
+BUSCA_GLOB = "glob"        # Os mesmos padrões de "incluir": "*.xlsx", "docs/**/2024-*"
+BUSCA_TEXTO = "texto"      # Palavras do nome, em qualquer ordem e sem acentos: "relatorio final"
+MODOS_BUSCA = (BUSCA_PREFIXO, BUSCA_GLOB, BUSCA_TEXTO)
+LIMITE_BUSCA_CATALOGO = 500
+LIMITE_ORDENACAO_BUSCA = 20000  # Versões acima das quais a busca por nome percorre as pastas em ordem em vez de ordenar
+FIM_FAIXA = "\U0010ffff"  # Maior caractere: prefixo <= texto < prefixo + FIM_FAIXA é uma faixa de índice
+
+# Modos de destino do backup diário
+MODO_PASTA = "pasta"                # Snapshots como pastas espelhadas (backup_<data>)
+MODO_REPOSITORIO = "repositorio"    # Repositório de chunks deduplicados
+MODO_ARQUIVO = "arquivo"            # Um único contêiner tar com membros compactados
+PASTA_REPOSITORIO = "repositorio"
+
+# Chunking por conteúdo (gear hash, no estilo do FastCDC)
+CHUNK_MINIMO = 256 * 1024
+CHUNK_MEDIO = 1024 * 1024
+CHUNK_MAXIMO = 4 * 1024 * 1024
+
+# Agendador
+ESPERA_MAXIMA_AGENDADOR = 300  # Reavalia o relógio ao menos a cada 5 min (detecta suspensão/ajuste de hora)
+TOLERANCIA_ATRASO = 120  # Execuções atrasadas além disso são consideradas perdidas (máquina suspensa)
+RECUPERAR_EXECUTAR = "executar"  # Executa uma vez assim que possível
+RECUPERAR_PULAR = "pular"        # Ignora e aguarda o próximo horário
+
+# Jobs (vários pares origem/destino nomeados, executados em paralelo)
+JOB_PADRAO = "padrao"  # Nome do job montado a partir das chaves antigas "origem"/"destino"
+JOBS_SIMULTANEOS = 4
+LIMITE_POR_DISPOSITIVO = 1  # Tarefas simultâneas lendo ou gravando no mesmo disco físico
+PREFIXO_AGENDAMENTO_JOB = "job:"
+
+# Ações registradas no diário por arquivo (processar() retorna uma delas, ou algo falso em caso de erro)
+ACAO_COPIADO = "copiado"
+ACAO_DELTA = "delta"
+ACAO_VINCULADO = "vinculado"
+ACAO_INALTERADO = "inalterado"
+ACAO_ARMAZENADO = "armazenado"
+ACAO_REAPROVEITADO = "reaproveitado"
+ACAO_COMPACTADO = "compactado"
+ACAO_EMPACOTADO = "empacotado"
+ACAO_IGNORADO = "ignorado"
+ACAO_ERRO = "erro"
+ACOES_COM_ESCRITA = {ACAO_COPIADO, ACAO_DELTA, ACAO_ARMAZENADO, ACAO_COMPACTADO, ACAO_EMPACOTADO}
+
+# Controle de espaço no destino
+RESERVA_ESPACO = 512 * 1024 * 1024  # Espaço livre mínimo mantido no destino durante a cópia
+INTERVALO_VIGIA_ESPACO = 2
+TEMPO_MAXIMO_PAUSA_ESPACO = 600  # Tempo pausado aguardando espaço (ex.: retenção em segundo plano) antes de parar
+TAMANHO_CLUSTER = 4096
+
+# Execuções retomáveis: arquivos gravados em temporários e diário de checkpoint no banco
+SUFIXO_INCOMPLETO = ".incompleto"  # Pasta do snapshot até a execução terminar (não casa PADRAO_SNAPSHOT)
+SUFIXO_TEMPORARIO = ".easybackup-tmp"
+TAMANHO_LOTE_CHECKPOINT = 500
+INTERVALO_CHECKPOINT = 2  # Segundos máximos entre dois lotes do checkpoint
+
+# Pacotes de arquivos pequenos nos modos em pasta ("empacotar_pequenos" na configuração)
+PASTA_PACOTES = ".pacotes"
+ARQUIVO_INDICE_PACOTES = "indice.bin"
+LIMITE_PACOTE = 16 * 1024  # Arquivos abaixo deste tamanho vão para os pacotes
+TAMANHO_PACOTE = 64 * 1024 * 1024  # Cada worker abre um pacote novo quando o atual passa deste tamanho
+APROVEITAMENTO_MINIMO_PACOTE = 0.5  # Pacotes anteriores com menos dados vivos que isso não são vinculados
+MAGICO_INDICE_PACOTES = b"EBPK"
+VERSAO_INDICE_PACOTES = 1
+CABECALHO_INDICE_PACOTES = struct.Struct("<4sHIQQ")  # Mágico, versão, pacotes, registros, início dos caminhos
+# Registro de tamanho fixo: caminho (deslocamento e tamanho na área de caminhos), pacote, deslocamento, tamanho, mtime, hash
+REGISTRO_INDICE_PACOTES = struct.Struct("<QHIQId32s")
+
+# Retenção por snapshot
+# Execuções no mesmo segundo recebem um sufixo de sequência (backup_<data>_2) em vez de reaproveitar o nome
+PADRAO_SNAPSHOT = re.compile(r"^backup_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})(?:_(\d+))?(\.tar|\.json)?$")
+TENTATIVAS_NOME_SNAPSHOT = 100
+WORKERS_REMOCAO = 8
+
+# Cópia delta por blocos para arquivos grandes
+LIMITE_DELTA = 256 * 1024 * 1024  # Arquivos a partir deste tamanho são atualizados bloco a bloco
+BLOCO_DELTA = 1024 * 1024
+TAMANHO_ASSINATURA = 16
+FICLONE = 0x40049409
+
+# Integridade: hash de cada arquivo calculado na mesma leitura da cópia e gravado no manifesto
+TAMANHO_HASH_ARQUIVO = 32  # blake2b-256, o mesmo hash de arquivo do repositório de chunks
+BLOCO_VERIFICACAO = 1024 * 1024
+
+# Backend de cópia: o método mais rápido suportado por par origem/destino ("metodo_copia" fixa um deles)
+METODOS_COPIA = ["clone", "copy_file_range", "sendfile", "buffer"]
+TAMANHO_BUFFER_COPIA = 8 * 1024 * 1024
+TRECHO_COPIA_KERNEL = 1024 * 1024 * 1024  # copy_file_range/sendfile copiam no máximo isso por chamada
+ERROS_METODO_INDISPONIVEL = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL,
+                             errno.ENOTTY, errno.EPERM, errno.EBADF}
+
+# Limite de E/S (bytes/s e arquivos/s) com perfis por horário ("perfis_io" na configuração)
+INTERVALO_REVISAO_IO = 1  # Segundos entre reavaliações do perfil e da taxa adaptativa
+TRECHO_LIMITADO = 1024 * 1024  # Com limite ativo, a cópia avança em trechos deste tamanho
+LATENCIA_ALVO_MS = 20
+FATOR_RECUO_ADAPTATIVO = 0.7  # A taxa cai 30% por segundo com a latência acima do alvo...
+FATOR_AUMENTO_ADAPTATIVO = 1.1  # ...e sobe 10% por segundo abaixo dele
+VAZAO_MINIMA_ADAPTATIVA = 1024 * 1024
+
+# Contêiner compactado (modo arquivo)
+EXTENSOES_COMPACTADAS = {
+    ".zip", ".7z", ".rar", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".lz4", ".cab", ".msi",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".mp3", ".aac", ".ogg", ".flac",
+    ".mp4", ".mkv", ".avi", ".mov", ".wmv", ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".pdf", ".jar", ".apk",
+}
+AMOSTRA_COMPRESSAO = 64 * 1024
+RAZAO_INCOMPRESSIVEL = 0.9  # Amostras que não encolhem ao menos 10% são gravadas sem compressão
+BLOCO_COMPRESSAO = 1024 * 1024
+LIMITE_MEMORIA_MEMBRO = 4 * 1024 * 1024  # Acima disso o membro compactado vai para um arquivo temporário
+CABECALHO_COMPRESSAO = "EASYBACKUP.compressao"
+CABECALHO_HASH = "EASYBACKUP.hash"
+BLOCO_TAR = 512
+
+# Funções de configuração
+def carregar_configuracao():
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, "r") as f:
+            return json.load(f)
+    return {}
+
+def salvar_configuracao(config):
+    with open(CONFIG_FILE, "w") as f:
+        json.dump(config, f, indent=4)
+
+# Funções de histórico
+class BancoHistorico:
+    # Uma única conexão em modo WAL mantida aberta e compartilhada entre threads; o acesso é
+    # serializado por um lock, e cada bloco "with banco.transacao()" vira uma transação.
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.conn = None
+        self.lock = RLock()
+
+    def conexao(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.caminho, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            inicializar_banco()  # Esquema criado na primeira conexão, não na importação do módulo
+        return self.conn
+
+    @contextmanager
+    def transacao(self):
+        with self.lock:
+            conn = self.conexao()
+            cursor = conn.cursor()
+            try:
+                yield cursor
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def configurar(self, caminho):
+        with self.lock:
+            self.fechar()
+            self.caminho = caminho
+
+    def fechar(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+banco = BancoHistorico(DB_FILE)
+
+COLUNAS_METRICAS = [
+    ("arquivos_escaneados", "INTEGER"),
+    ("arquivos_copiados", "INTEGER"),
+    ("bytes_copiados", "INTEGER"),
+    ("duracao", "REAL"),
+    ("vazao", "REAL"),
+    ("erros", "INTEGER"),
+    ("telemetria", "TEXT"),  # JSON: fases, histogramas de latência e arquivos/pastas mais lentos
+]
+
+def inicializar_banco():
+    with banco.transacao() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS historico (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data TEXT,
+                origem TEXT,
+                destino TEXT,
+                status TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data TEXT,
+                origem TEXT,
+                destino TEXT,
+                caminho TEXT,
+                status TEXT
+            )
+        ''')
+        # Manifesto compacto: o caminho de cada pasta é gravado uma vez (pastas) e cada arquivo guarda só
+        # o nome, com o hash em 32 bytes; sem rowid, a chave primária é a própria tabela
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pastas (
+                id INTEGER PRIMARY KEY,
+                caminho TEXT UNIQUE
+            )
+        ''')
+        manifesto_antigo = "caminho" in {linha[1] for linha in cursor.execute('PRAGMA table_info(manifesto)').fetchall()}
+        if manifesto_antigo:
+            cursor.execute('ALTER TABLE manifesto RENAME TO manifesto_antigo')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS manifesto (
+                snapshot_id INTEGER,
+                pasta INTEGER,
+                nome TEXT,
+                tamanho INTEGER,
+                mtime REAL,
+                hash BLOB,
+                PRIMARY KEY (snapshot_id, pasta, nome)
+            ) WITHOUT ROWID
+        ''')
+        if manifesto_antigo:
+            migrar_manifesto_antigo(cursor)
+        # Catálogo de versões: cada versão de um arquivo (mesmo tamanho e mtime) é uma linha com o primeiro e
+        # o último snapshot da série (origem/destino) em que aparece, em vez de uma linha por snapshot. A
+        # chave segue a ordem (pasta, nome) do manifesto; catalogo_nomes guarda cada nome distinto uma vez,
+        # para a busca por glob e para catalogo_busca, que indexa as palavras dos nomes.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS catalogo_nomes (
+                id INTEGER PRIMARY KEY,
+                nome TEXT UNIQUE
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS versoes (
+                pasta INTEGER,
+                nome TEXT,
+                primeiro_snapshot INTEGER,
+                ultimo_snapshot INTEGER,
+                tamanho INTEGER,
+                mtime REAL,
+                hash BLOB,
+                PRIMARY KEY (pasta, nome, primeiro_snapshot)
+            ) WITHOUT ROWID
+        ''')
+        criar_busca_textual(cursor)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS assinaturas (
+                caminho TEXT PRIMARY KEY,
+                tamanho INTEGER,
+                mtime REAL,
+                tamanho_bloco INTEGER,
+                assinaturas BLOB
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS diario_arquivos (
+                execucao_id INTEGER,
+                caminho TEXT,
+                acao TEXT,
+                tamanho INTEGER
+            )
+        ''')
+        # Bancos antigos: as métricas por execução entram como colunas novas do histórico
+        colunas = {linha[1] for linha in cursor.execute('PRAGMA table_info(historico)').fetchall()}
+        for coluna, tipo in COLUNAS_METRICAS:
+            if coluna not in colunas:
+                cursor.execute(f'ALTER TABLE historico ADD COLUMN {coluna} {tipo}')
+        # catalogado = 1 quando o manifesto do snapshot já entrou no catálogo de versões
+        if "catalogado" not in {linha[1] for linha in cursor.execute('PRAGMA table_info(snapshots)').fetchall()}:
+            cursor.execute('ALTER TABLE snapshots ADD COLUMN catalogado INTEGER')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS caminhos_alterados (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                origem TEXT,
+                caminho TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS checkpoint (
+                snapshot_id INTEGER,
+                caminho TEXT,
+                tamanho INTEGER,
+                mtime REAL,
+                hash TEXT,
+                PRIMARY KEY (snapshot_id, caminho)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_historico_data ON historico (data, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_historico_status ON historico (status, data)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_diario_execucao ON diario_arquivos (execucao_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_snapshots_origem_destino ON snapshots (origem, destino, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_alterados_origem ON caminhos_alterados (origem, seq)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_versoes_ultimo ON versoes (ultimo_snapshot, pasta, nome)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_versoes_primeiro ON versoes (primeiro_snapshot)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_versoes_nome ON versoes (nome)')
+
+def valores_metricas(metricas):
+    # Estruturas (telemetria) são gravadas como JSON
+    metricas = metricas or {}
+    return [json.dumps(metricas[coluna]) if isinstance(metricas.get(coluna), dict) else metricas.get(coluna)
+            for coluna, _ in COLUNAS_METRICAS]
+
+def adicionar_entrada_historico(origem, destino, status, metricas=None):
+    with banco.transacao() as cursor:
+        cursor.execute(f'''
+            INSERT INTO historico (data, origem, destino, status, {", ".join(coluna for coluna, _ in COLUNAS_METRICAS)})
+            VALUES (?, ?, ?, ?, {", ".join("?" for _ in COLUNAS_METRICAS)})
+        ''', (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), origem, destino, status, *valores_metricas(metricas)))
+        return cursor.lastrowid
+
+def atualizar_entrada_historico(execucao_id, status, metricas=None):
+    with banco.transacao() as cursor:
+        cursor.execute(f'''
+            UPDATE historico SET status = ?, {", ".join(f"{coluna} = ?" for coluna, _ in COLUNAS_METRICAS)}
+            WHERE id = ?
+        ''', (status, *valores_metricas(metricas), execucao_id))
+
+def obter_telemetria(execucao_id):
+    with banco.transacao() as cursor:
+        linha = cursor.execute('SELECT telemetria FROM historico WHERE id = ?', (execucao_id,)).fetchone()
+    return json.loads(linha[0]) if linha and linha[0] else None
+
+def obter_historico(limite=None, apos=None, filtro=None, status=None):
+    # Paginação por chave (data, id): cada página custa o mesmo, não importa quantos anos de histórico
+    condicoes = []
+    parametros = []
+    if apos:
+        condicoes.append('(data, id) < (?, ?)')
+        parametros.extend(apos)
+    if filtro:
+        condicoes.append('(origem LIKE ? OR destino LIKE ?)')
+        parametros.extend([f"%{filtro}%", f"%{filtro}%"])
+    if status:
+        condicoes.append('status LIKE ?')
+        parametros.append(f"{status}%")
+    sql = 'SELECT id, data, origem, destino, status, arquivos_copiados, bytes_copiados, duracao, erros FROM historico'
+    if condicoes:
+        sql += ' WHERE ' + ' AND '.join(condicoes)
+    sql += ' ORDER BY data DESC, id DESC'
+    if limite:
+        sql += ' LIMIT ?'
+        parametros.append(limite)
+    with banco.transacao() as cursor:
+        cursor.execute(sql, parametros)
+        historico = cursor.fetchall()
+    return historico
+
+def obter_diario_execucao(execucao_id):
+    with banco.transacao() as cursor:
+        cursor.execute('SELECT caminho, acao, tamanho FROM diario_arquivos WHERE execucao_id = ?', (execucao_id,))
+        return cursor.fetchall()
+
+def gravar_diario(registros):
+    with banco.transacao() as cursor:
+        cursor.executemany('''
+            INSERT INTO diario_arquivos (execucao_id, caminho, acao, tamanho)
+            VALUES (?, ?, ?, ?)
+        ''', registros)
+
+def excluir_historico():
+    with banco.transacao() as cursor:
+        cursor.execute('DELETE FROM historico')
+        cursor.execute('DELETE FROM diario_arquivos')
+
+# Conjunto de caminhos alterados (observador): cada destino consome a partir da sua própria marca (seq)
+def registrar_caminhos_alterados(origem, caminhos):
+    with banco.transacao() as cursor:
+        cursor.executemany('INSERT INTO caminhos_alterados (origem, caminho) VALUES (?, ?)',
+                           [(origem, caminho) for caminho in caminhos])
+
+def obter_marca_alteracoes(origem):
+    with banco.transacao() as cursor:
+        linha = cursor.execute('SELECT MAX(seq) FROM caminhos_alterados WHERE origem = ?', (origem,)).fetchone()
+    return linha[0] or 0
+
+def obter_caminhos_alterados(origem, apos, ate):
+    with banco.transacao() as cursor:
+        cursor.execute('SELECT DISTINCT caminho FROM caminhos_alterados WHERE origem = ? AND seq > ? AND seq <= ?',
+                       (origem, apos, ate))
+        return [linha[0] for linha in cursor]
+
+def descartar_caminhos_alterados(origem, ate):
+    with banco.transacao() as cursor:
+        cursor.execute('DELETE FROM caminhos_alterados WHERE origem = ? AND seq <= ?', (origem, ate))
+
+# Funções de snapshots e manifesto
+RegistroManifesto = namedtuple("RegistroManifesto", ["pasta", "nome", "tamanho", "mtime", "hash"])
+
+def registrar_snapshot(origem, destino, caminho, status):
+    with banco.transacao() as cursor:
+        cursor.execute('''
+            INSERT INTO snapshots (data, origem, destino, caminho, status)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), origem, destino, caminho, status))
+        snapshot_id = cursor.lastrowid
+    return snapshot_id
+
+def atualizar_status_snapshot(snapshot_id, status):
+    with banco.transacao() as cursor:
+        cursor.execute('UPDATE snapshots SET status = ? WHERE id = ?', (status, snapshot_id))
+
+def atualizar_caminho_snapshot(snapshot_id, caminho):
+    with banco.transacao() as cursor:
+        cursor.execute('UPDATE snapshots SET caminho = ? WHERE id = ?', (caminho, snapshot_id))
+
+def obter_ultimo_snapshot(origem, destino):
+    # Último snapshot concluído desta origem/destino que ainda existe em disco
+    with banco.transacao() as cursor:
+        cursor.execute('''
+            SELECT id, caminho FROM snapshots
+            WHERE origem = ? AND destino = ? AND status = 'Sucesso'
+            ORDER BY id DESC
+        ''', (origem, destino))
+        snapshots = cursor.fetchall()
+    for snapshot_id, caminho in snapshots:
+        if caminho and os.path.exists(caminho):
+            return snapshot_id, caminho
+    return None
+
+def carregar_manifesto(snapshot_id):
+    # O manifesto inteiro como {rel_path: (tamanho, mtime, hash)}; para árvores grandes, iterar_manifesto
+    with banco.transacao() as cursor:
+        cursor.execute('''
+            SELECT p.caminho, m.nome, m.tamanho, m.mtime, m.hash FROM manifesto m
+            JOIN pastas p ON p.id = m.pasta WHERE m.snapshot_id = ?
+        ''', (snapshot_id,))
+        manifesto = {os.path.join(pasta, nome): (tamanho, mtime, hash_arquivo.hex() if hash_arquivo else None)
+                     for pasta, nome, tamanho, mtime, hash_arquivo in cursor}
+    return manifesto
+
+def obter_tamanho_manifesto(snapshot_id):
+    with banco.transacao() as cursor:
+        return cursor.execute('SELECT COALESCE(SUM(tamanho), 0) FROM manifesto WHERE snapshot_id = ?',
+                              (snapshot_id,)).fetchone()[0]
+
+def iterar_manifesto(snapshot_id, tamanho_pagina=TAMANHO_PAGINA_MANIFESTO):
+    # Manifesto em fluxo, na ordem (pasta, nome) da varredura ordenada, em páginas por chave: memória
+    # constante e o banco livre entre uma página e outra. O CROSS JOIN fixa o laço externo nas pastas
+    # (índice do caminho) e o interno na chave primária do manifesto, já ordenada pelo nome dentro de
+    # cada pasta: nenhuma página ordena em uma árvore temporária.
+    consulta = '''
+        SELECT p.caminho, m.nome, m.tamanho, m.mtime, m.hash FROM pastas p CROSS JOIN manifesto m
+        WHERE {} AND m.snapshot_id = ? AND m.pasta = p.id
+        ORDER BY p.caminho LIMIT ?
+    '''
+    ultimo = ("", "")
+    while True:
+        with banco.transacao() as cursor:
+            # O resto da última pasta lida e, se a página não encher, as pastas seguintes
+            linhas = cursor.execute(consulta.format("p.caminho = ? AND m.nome > ?"),
+                                    (*ultimo, snapshot_id, tamanho_pagina)).fetchall()
+            if len(linhas) < tamanho_pagina:
+                linhas += cursor.execute(consulta.format("p.caminho > ?"),
+                                         (ultimo[0], snapshot_id, tamanho_pagina - len(linhas))).fetchall()
+        for pasta, nome, tamanho, mtime, hash_arquivo in linhas:
+            yield RegistroManifesto(pasta, nome, tamanho, mtime, hash_arquivo.hex() if hash_arquivo else None)
+        if len(linhas) < tamanho_pagina:
+            return
+        ultimo = linhas[-1][:2]
+
+def obter_id_pasta(cursor, pasta, ids_pastas):
+    pasta_id = ids_pastas.get(pasta)
+    if pasta_id is None:
+        cursor.execute('INSERT OR IGNORE INTO pastas (caminho) VALUES (?)', (pasta,))
+        pasta_id = ids_pastas[pasta] = cursor.execute('SELECT id FROM pastas WHERE caminho = ?', (pasta,)).fetchone()[0]
+    return pasta_id
+
+def gravar_linhas_manifesto(cursor, linhas, ids_pastas):
+    # linhas: (snapshot_id, rel_path, tamanho, mtime, hash em hexadecimal), gravadas em lotes; ids_pastas
+    # guarda as pastas já internadas (uma entrada por pasta, não por arquivo)
+    def inserir(lote):
+        cursor.executemany('''
+            INSERT OR REPLACE INTO manifesto (snapshot_id, pasta, nome, tamanho, mtime, hash)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', lote)
+
+    lote = []
+    for snapshot_id, rel_path, tamanho, mtime, hash_arquivo in linhas:
+        pasta, nome = os.path.split(rel_path)
+        lote.append((snapshot_id, obter_id_pasta(cursor, pasta, ids_pastas), nome, tamanho, mtime,
+                     bytes.fromhex(hash_arquivo) if hash_arquivo else None))
+        if len(lote) >= TAMANHO_LOTE_DIARIO:
+            inserir(lote)
+            lote = []
+    if lote:
+        inserir(lote)
+
+def registro_manifesto(snapshot_id, entrada):
+    # Aceita uma EntradaArquivo ou um par (EntradaArquivo, hash) quando o hash já é conhecido
+    hash_arquivo = None
+    if not isinstance(entrada, EntradaArquivo):
+        entrada, hash_arquivo = entrada
+    return (snapshot_id, entrada.rel_path, entrada.tamanho, entrada.mtime, hash_arquivo)
+
+def salvar_manifesto(snapshot_id, entradas):
+    with banco.transacao() as cursor:
+        gravar_linhas_manifesto(cursor, (registro_manifesto(snapshot_id, entrada) for entrada in entradas), {})
+
+def migrar_manifesto_antigo(cursor):
+    # Copia o manifesto antigo (caminho completo em cada linha, hash em hexadecimal) para o formato compacto
+    logging.info("Convertendo o manifesto para o formato compacto...")
+    linhas = cursor.connection.execute('SELECT snapshot_id, caminho, tamanho, mtime, hash FROM manifesto_antigo')
+    gravar_linhas_manifesto(cursor, linhas, {})
+    cursor.execute('DROP TABLE manifesto_antigo')
+
+# Assinaturas de blocos das cópias grandes, indexadas pelo caminho da cópia no destino
+def salvar_assinaturas(caminho, assinaturas):
+    st = os.stat(caminho)
+    with banco.transacao() as cursor:
+        cursor.execute('''
+            INSERT OR REPLACE INTO assinaturas (caminho, tamanho, mtime, tamanho_bloco, assinaturas)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (caminho, st.st_size, st.st_mtime, BLOCO_DELTA, assinaturas))
+
+def obter_assinaturas(caminho):
+    # Só vale se a cópia em disco ainda for exatamente a que gerou as assinaturas
+    try:
+        st = os.stat(caminho)
+    except FileNotFoundError:
+        return None
+    with banco.transacao() as cursor:
+        cursor.execute('SELECT tamanho, mtime, tamanho_bloco, assinaturas FROM assinaturas WHERE caminho = ?', (caminho,))
+        linha = cursor.fetchone()
+    if linha and linha[0] == st.st_size and linha[1] == st.st_mtime and linha[2] == BLOCO_DELTA:
+        return linha[3]
+    return None
+
+def vincular_assinaturas(caminho_origem, caminho_destino):
+    with banco.transacao() as cursor:
+        cursor.execute('''
+            INSERT OR REPLACE INTO assinaturas (caminho, tamanho, mtime, tamanho_bloco, assinaturas)
+            SELECT ?, tamanho, mtime, tamanho_bloco, assinaturas FROM assinaturas WHERE caminho = ?
+        ''', (caminho_destino, caminho_origem))
+
+def limpar_assinaturas_orfas():
+    with banco.transacao() as cursor:
+        cursor.execute('SELECT caminho FROM assinaturas')
+        orfas = [(caminho,) for caminho, in cursor.fetchall() if not os.path.exists(caminho)]
+        cursor.executemany('DELETE FROM assinaturas WHERE caminho = ?', orfas)
+
+def obter_snapshot(snapshot_id=None, caminho=None):
+    # Retorna (id, origem, destino, caminho, status) pelo id ou pelo caminho do snapshot
+    with banco.transacao() as cursor:
+        if snapshot_id is not None:
+            cursor.execute('SELECT id, origem, destino, caminho, status FROM snapshots WHERE id = ?', (snapshot_id,))
+        else:
+            cursor.execute('SELECT id, origem, destino, caminho, status FROM snapshots WHERE caminho = ? ORDER BY id DESC',
+                           (caminho,))
+        return cursor.fetchone()
+
+def listar_snapshots_catalogo(origem, destino, ate=None):
+    # Snapshots utilizáveis (concluídos ou parciais) do mais novo ao mais antigo, opcionalmente até uma data
+    with banco.transacao() as cursor:
+        cursor.execute('''
+            SELECT id, data, caminho, status FROM snapshots
+            WHERE origem = ? AND destino = ? AND (status = 'Sucesso' OR status LIKE 'Parcial%')
+              AND (? IS NULL OR data <= ?)
+            ORDER BY data DESC, id DESC
+        ''', (origem, destino, ate, ate))
+        return cursor.fetchall()
+
+def obter_snapshot_interrompido(origem, destino):
+    # Snapshot em pasta que ficou "Em andamento" (processo encerrado no meio) ou que falhou com erro. Execuções
+    # no mesmo processo e destino são impedidas por executar_com_trava, então o registro não é de uma execução viva.
+    with banco.transacao() as cursor:
+        cursor.execute('''
+            SELECT id, caminho FROM snapshots
+            WHERE origem = ? AND destino = ? AND status IN ('Em andamento', 'Falhou')
+            ORDER BY id DESC
+        ''', (origem, destino))
+        snapshots = cursor.fetchall()
+    for snapshot_id, caminho in snapshots:
+        if caminho and caminho.endswith(SUFIXO_INCOMPLETO) and os.path.isdir(caminho):
+            return snapshot_id, caminho
+    return None
+
+def concluir_snapshot_pasta(snapshot_id, caminho_incompleto, destino, data, status):
+    # A pasta só recebe o nome definitivo (backup_<data>) depois do manifesto gravado; até lá ela não
+    # aparece para a retenção, o status ou a restauração como um snapshot válido. Se a renomeação falhar
+    # (ex.: um arquivo aberto no Windows), o erro sobe e o snapshot fica "Falhou", retomável pelo checkpoint.
+    try:
+        caminho_final = publicar_snapshot(caminho_incompleto, destino, data)
+    except OSError as e:
+        raise RuntimeError(f"Não foi possível dar o nome definitivo ao snapshot '{caminho_incompleto}': {e}") from e
+    with banco.transacao() as cursor:
+        cursor.execute('UPDATE snapshots SET caminho = ?, status = ?, data = ? WHERE id = ?',
+                       (caminho_final, status, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), snapshot_id))
+        prefixo = caminho_incompleto + os.sep
+        cursor.execute('''
+            UPDATE assinaturas SET caminho = ? || substr(caminho, ?)
+            WHERE substr(caminho, 1, ?) = ?
+        ''', (caminho_final + os.sep, len(prefixo) + 1, len(prefixo), prefixo))
+        cursor.execute('DELETE FROM checkpoint WHERE snapshot_id = ?', (snapshot_id,))
+    return caminho_final
+
+def descartar_snapshot_interrompido(snapshot_id, caminho):
+    with banco.transacao() as cursor:
+        cursor.execute("UPDATE snapshots SET status = 'Interrompido' WHERE id = ?", (snapshot_id,))
+        cursor.execute('DELETE FROM checkpoint WHERE snapshot_id = ?', (snapshot_id,))
+    Thread(target=shutil.rmtree, args=(caminho, True)).start()
+
+def gravar_checkpoint(registros):
+    with banco.transacao() as cursor:
+        cursor.executemany('''
+            INSERT OR REPLACE INTO checkpoint (snapshot_id, caminho, tamanho, mtime, hash)
+            VALUES (?, ?, ?, ?, ?)
+        ''', registros)
+
+def carregar_checkpoint(snapshot_id):
+    with banco.transacao() as cursor:
+        cursor.execute('SELECT caminho, tamanho, mtime, hash FROM checkpoint WHERE snapshot_id = ?', (snapshot_id,))
+        return {caminho: (tamanho, mtime, hash_arquivo) for caminho, tamanho, mtime, hash_arquivo in cursor.fetchall()}
+
+def obter_caminhos_snapshots_em_andamento():
+    with banco.transacao() as cursor:
+        cursor.execute("SELECT caminho FROM snapshots WHERE status = 'Em andamento'")
+        caminhos = {caminho for caminho, in cursor.fetchall() if caminho}
+    return caminhos
+
+def obter_caminhos_snapshots_sem_sucesso():
+    # Snapshots parciais ou com falha; caminhos sem registro (backups completos, bancos antigos) contam como concluídos
+    with banco.transacao() as cursor:
+        cursor.execute("SELECT caminho, status FROM snapshots WHERE caminho IS NOT NULL ORDER BY id")
+        status = dict(cursor.fetchall())
+    return {caminho for caminho, situacao in status.items() if not (situacao or "").startswith("Sucesso")}
+
+def remover_snapshot_catalogo(caminho):
+    with banco.transacao() as cursor:
+        cursor.execute('SELECT id FROM snapshots WHERE caminho = ?', (caminho,))
+        ids = cursor.fetchall()
+        cursor.executemany('DELETE FROM manifesto WHERE snapshot_id = ?', ids)
+        cursor.execute("UPDATE snapshots SET status = 'Removido' WHERE caminho = ?", (caminho,))
+        for snapshot_id, in ids:
+            descatalogar_snapshot(cursor, snapshot_id)
+
+def calcular_bytes_exclusivos_snapshot(caminho, caminhos_mantidos):
+    with banco.transacao() as cursor:
+        marcadores = ", ".join("?" * len(caminhos_mantidos))
+        cursor.execute(f'''
+            SELECT COALESCE(SUM(m.tamanho), 0) FROM manifesto m
+            JOIN snapshots s ON s.id = m.snapshot_id
+            WHERE s.caminho = ? AND NOT EXISTS (
+                SELECT 1 FROM manifesto k JOIN snapshots sk ON sk.id = k.snapshot_id
+                WHERE sk.caminho IN ({marcadores}) AND k.pasta = m.pasta AND k.nome = m.nome
+                  AND k.tamanho = m.tamanho AND k.mtime = m.mtime
+            )
+        ''', (caminho, *caminhos_mantidos))
+        liberados = cursor.fetchone()[0]
+    return liberados
+
+# Catálogo de versões: todas as versões de cada arquivo em todos os snapshots, indexadas por caminho e por nome
+# versoes: quantas versões o caminho tem no catálogo, preenchido só pela busca
+VersaoCatalogo = namedtuple("VersaoCatalogo", ["rel_path", "tamanho", "mtime", "hash", "origem", "destino",
+                                               "primeiro_snapshot", "desde", "ultimo_snapshot", "ate",
+                                               "caminho_snapshot", "versoes"], defaults=(None,))
+
+# {juncao} é "CROSS JOIN" quando a condição percorre as pastas em ordem de caminho: as linhas já saem na
+# ordem do ORDER BY e o LIMIT encerra a consulta cedo. O p.id no GROUP BY/ORDER BY não muda o resultado
+# (caminho é único), mas é o que deixa o SQLite usar a ordem do índice em vez de uma árvore temporária.
+CONSULTA_CATALOGO = '''
+    SELECT p.caminho, v.nome, v.tamanho, v.mtime, v.hash, s.origem, s.destino, v.primeiro_snapshot, sp.data,
+           {ultimo}, s.data, s.caminho, {versoes}
+    FROM pastas p {juncao} versoes v JOIN snapshots s ON s.id = v.ultimo_snapshot
+    JOIN snapshots sp ON sp.id = v.primeiro_snapshot
+    WHERE v.pasta = p.id AND ({condicao}) AND (:origem IS NULL OR s.origem = :origem)
+      AND (:destino IS NULL OR s.destino = :destino)
+'''
+
+def criar_busca_textual(cursor):
+    # FTS5 vem no SQLite das distribuições do Python, mas pode faltar em builds mínimos: sem ele a busca
+    # por texto usa LIKE sobre os nomes distintos. Criado depois dos nomes, o índice é reconstruído.
+    if busca_textual_disponivel(cursor):
+        return
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE catalogo_busca USING fts5(
+                nome, content='catalogo_nomes', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        logging.info(f"Busca por texto no catálogo sem FTS5 ({e}); usando LIKE.")
+        return
+    cursor.execute("INSERT INTO catalogo_busca (catalogo_busca) VALUES ('rebuild')")
+
+def busca_textual_disponivel(cursor):
+    return cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'catalogo_busca'").fetchone() is not None
+
+def snapshot_vizinho_catalogado(cursor, origem, destino, snapshot_id, anterior=True):
+    # Snapshot catalogado e ainda existente da mesma série imediatamente antes (ou depois) de snapshot_id
+    cursor.execute(f'''
+        SELECT {"MAX" if anterior else "MIN"}(id) FROM snapshots
+        WHERE origem = ? AND destino = ? AND catalogado = 1 AND status != 'Removido' AND id {"<" if anterior else ">"} ?
+    ''', (origem, destino, snapshot_id))
+    return cursor.fetchone()[0]
+
+def catalogar_snapshot(cursor, snapshot_id, origem, destino):
+    # As versões que continuam iguais desde o snapshot anterior da série só têm o intervalo estendido; o
+    # resto do manifesto entra como versões novas. Tudo em SQL, sem trazer o manifesto para a memória.
+    anterior = snapshot_vizinho_catalogado(cursor, origem, destino, snapshot_id)
+    ultimo_nome = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM catalogo_nomes').fetchone()[0]
+    cursor.execute('INSERT OR IGNORE INTO catalogo_nomes (nome) SELECT nome FROM manifesto WHERE snapshot_id = ?',
+                   (snapshot_id,))
+    if busca_textual_disponivel(cursor):
+        cursor.execute('INSERT INTO catalogo_busca (rowid, nome) SELECT id, nome FROM catalogo_nomes WHERE id > ?',
+                       (ultimo_nome,))
+    if anterior is not None:
+        cursor.execute('''
+            UPDATE versoes SET ultimo_snapshot = :snapshot
+            WHERE ultimo_snapshot = :anterior AND EXISTS (
+                SELECT 1 FROM manifesto m
+                WHERE m.snapshot_id = :snapshot AND m.pasta = versoes.pasta AND m.nome = versoes.nome
+                  AND m.tamanho = versoes.tamanho AND m.mtime = versoes.mtime
+            )
+        ''', {"snapshot": snapshot_id, "anterior": anterior})
+    cursor.execute('''
+        INSERT INTO versoes (pasta, nome, primeiro_snapshot, ultimo_snapshot, tamanho, mtime, hash)
+        SELECT m.pasta, m.nome, :snapshot, :snapshot, m.tamanho, m.mtime, m.hash FROM manifesto m
+        WHERE m.snapshot_id = :snapshot AND NOT EXISTS (
+            SELECT 1 FROM versoes v WHERE v.ultimo_snapshot = :snapshot AND v.pasta = m.pasta AND v.nome = m.nome
+        )
+    ''', {"snapshot": snapshot_id})
+    cursor.execute('UPDATE snapshots SET catalogado = 1 WHERE id = ?', (snapshot_id,))
+
+def descatalogar_snapshot(cursor, snapshot_id):
+    # Snapshot removido (já marcado como 'Removido'): as versões que começavam nele passam a começar no
+    # próximo snapshot da série, as que terminavam nele passam a terminar no anterior, e as que só
+    # existiam nele saem do catálogo
+    cursor.execute('SELECT origem, destino FROM snapshots WHERE id = ? AND catalogado = 1', (snapshot_id,))
+    serie = cursor.fetchone()
+    if serie is None:
+        return
+    proximo = snapshot_vizinho_catalogado(cursor, *serie, snapshot_id, anterior=False)
+    if proximo is not None:
+        cursor.execute('UPDATE versoes SET primeiro_snapshot = ? WHERE primeiro_snapshot = ? AND ultimo_snapshot >= ?',
+                       (proximo, snapshot_id, proximo))
+    anterior = snapshot_vizinho_catalogado(cursor, *serie, snapshot_id)
+    if anterior is not None:
+        cursor.execute('UPDATE versoes SET ultimo_snapshot = ? WHERE ultimo_snapshot = ? AND primeiro_snapshot < ?',
+                       (anterior, snapshot_id, snapshot_id))
+    cursor.execute('DELETE FROM versoes WHERE primeiro_snapshot = ?', (snapshot_id,))
+    cursor.execute('UPDATE snapshots SET catalogado = NULL WHERE id = ?', (snapshot_id,))
+
+def sincronizar_catalogo():
+    # Cataloga, em ordem, os snapshots utilizáveis que ainda não estão no catálogo: o da última execução ou,
+    # num banco antigo, o histórico inteiro. Uma transação por snapshot, para que as consultas feitas
+    # enquanto isso esperem no máximo um snapshot.
+    with banco.transacao() as cursor:
+        cursor.execute('''
+            SELECT id, origem, destino FROM snapshots
+            WHERE catalogado IS NULL AND (status = 'Sucesso' OR status LIKE 'Parcial%')
+            ORDER BY id
+        ''')
+        pendentes = cursor.fetchall()
+    if len(pendentes) > 1:
+        logging.info(f"Catalogando {len(pendentes)} snapshot(s)...")
+    for snapshot_id, origem, destino in pendentes:
+        with banco.transacao() as cursor:
+            catalogar_snapshot(cursor, snapshot_id, origem, destino)
+    return len(pendentes)
+
+def versao_catalogo(linha):
+    pasta, nome, tamanho, mtime, hash_arquivo, *resto = linha
+    return VersaoCatalogo(os.path.join(pasta, nome), tamanho, mtime, hash_arquivo.hex() if hash_arquivo else None, *resto)
+
+def condicoes_prefixo(prefixo, parametros):
+    # Duas faixas de índice, nesta ordem de caminho: os nomes da pasta do termo que começam com o resto
+    # dele e as pastas cujo caminho começa com o termo inteiro (com tudo o que está abaixo delas)
+    prefixo = prefixo.replace("/", os.sep).lstrip(os.sep)
+    pasta, _, nome = prefixo.rpartition(os.sep)
+    parametros.update(pasta=pasta, nome=nome, nome_fim=nome + FIM_FAIXA, prefixo=prefixo, prefixo_fim=prefixo + FIM_FAIXA)
+    return ["p.caminho = :pasta AND v.nome >= :nome AND v.nome < :nome_fim",
+            "p.caminho >= :prefixo AND p.caminho < :prefixo_fim AND p.caminho != :pasta"]
+
+def buscar_catalogo(termo, modo=BUSCA_PREFIXO, origem=None, destino=None, limite=LIMITE_BUSCA_CATALOGO):
+    # Caminhos do catálogo que casam com o termo, em ordem de caminho, cada um com a versão mais recente e o
+    # número de versões. origem/destino restringem a uma série. Ver BUSCA_* para os modos.
+    parametros = {"origem": origem, "destino": destino}
+    selecao = None  # Nomes distintos escolhidos por glob ou texto
+    with banco.transacao() as cursor:
+        if modo == BUSCA_PREFIXO:
+            condicoes = condicoes_prefixo(termo, parametros)
+        elif modo == BUSCA_GLOB:
+            # Os padrões de "incluir": sem "/" valem para o nome, com "/" para o caminho. O trecho literal do
+            # começo do padrão vira uma faixa de índice; a expressão confere o resto em Python.
+            padrao = termo.replace(os.sep, "/")
+            expressao, ancorado, _ = traduzir_padrao(padrao)
+            expressao = re.compile(expressao, re.IGNORECASE if os.name == "nt" else 0)
+            literal = "" if os.name == "nt" else re.match(r"[^*?\[]*", padrao.strip("/")).group()
+            cursor.connection.create_function(
+                "casa_glob", 2, lambda pasta, nome: expressao.fullmatch(
+                    f"{pasta.replace(os.sep, '/')}/{nome}" if pasta else nome) is not None, deterministic=True)
+            if ancorado:
+                condicoes = [f"{condicao} AND casa_glob(p.caminho, v.nome)"
+                             for condicao in condicoes_prefixo(literal, parametros)]
+            else:
+                parametros.update(nome=literal, nome_fim=literal + FIM_FAIXA)
+                selecao = "SELECT nome FROM catalogo_nomes WHERE nome >= :nome AND nome < :nome_fim AND casa_glob(NULL, nome)"
+        elif modo == BUSCA_TEXTO:
+            palavras = re.findall(r"\w+", termo)
+            if not palavras:
+                return []
+            if busca_textual_disponivel(cursor):
+                parametros["consulta"] = " ".join(f'"{palavra}"*' for palavra in palavras)
+                selecao = '''SELECT nome FROM catalogo_nomes
+                             WHERE id IN (SELECT rowid FROM catalogo_busca WHERE catalogo_busca MATCH :consulta)'''
+            else:
+                parametros.update((f"palavra{i}", f"%{palavra}%") for i, palavra in enumerate(palavras))
+                selecao = "SELECT nome FROM catalogo_nomes WHERE " + " AND ".join(
+                    f"nome LIKE :palavra{i}" for i in range(len(palavras)))
+        else:
+            raise ValueError(f"Modo de busca desconhecido: {modo}")
+        em_ordem = True
+        if selecao:
+            # Com poucas versões desses nomes, o índice por nome as acha e a ordenação fica no fim. Com muitas,
+            # as pastas são percorridas em ordem (a faixa em p.caminho escolhe o índice) e o LIMIT encerra
+            # cedo; o "+" impede que o IN vire uma busca de cada nome em cada pasta.
+            cursor.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM versoes WHERE nome IN ({selecao}) LIMIT :maximo)",
+                           dict(parametros, maximo=LIMITE_ORDENACAO_BUSCA))
+            em_ordem = cursor.fetchone()[0] >= LIMITE_ORDENACAO_BUSCA
+            condicoes = [f"p.caminho >= '' AND +v.nome IN ({selecao})" if em_ordem else f"v.nome IN ({selecao})"]
+        versoes = []
+        for condicao in condicoes:
+            if len(versoes) >= limite:
+                break
+            cursor.execute(CONSULTA_CATALOGO.format(ultimo="MAX(v.ultimo_snapshot)", versoes="COUNT(*)",
+                                                    juncao="CROSS JOIN" if em_ordem else "JOIN", condicao=condicao)
+                           + " GROUP BY p.caminho, p.id, v.nome ORDER BY p.caminho, p.id, v.nome LIMIT :limite",
+                           dict(parametros, limite=limite - len(versoes)))
+            versoes += [versao_catalogo(linha) for linha in cursor.fetchall()]
+    return versoes
+
+def listar_versoes(rel_path, origem=None, destino=None):
+    # Todas as versões de um caminho, da mais recente para a mais antiga, com o intervalo de snapshots em
+    # que cada uma aparece; para restaurar uma delas, use o ultimo_snapshot (ou qualquer um do intervalo)
+    pasta, nome = os.path.split(rel_path.replace("/", os.sep).strip(os.sep))
+    with banco.transacao() as cursor:
+        cursor.execute(CONSULTA_CATALOGO.format(ultimo="v.ultimo_snapshot", versoes="NULL", juncao="JOIN",
+                                                condicao="p.caminho = :pasta AND v.nome = :nome")
+                       + " ORDER BY v.ultimo_snapshot DESC",
+                       {"pasta": pasta, "nome": nome, "origem": origem, "destino": destino})
+        return [versao_catalogo(linha) for linha in cursor.fetchall()]
+
+# Filtros de inclusão/exclusão
+def traduzir_padrao(padrao):
+    # Padrão no estilo do .gitignore -> (regex, ancorado, só pastas). Sem "/" no meio o padrão vale para
+    # o nome em qualquer nível; com "/" vale para o caminho a partir da origem. "*" não atravessa pastas,
+    # "**/" casa zero ou mais pastas e um "/" no fim restringe o padrão a pastas.
+    so_diretorio = padrao.endswith("/")
+    padrao = padrao.rstrip("/")
+    ancorado = "/" in padrao
+    padrao = padrao.lstrip("/")
+    partes = []
+    i = 0
+    while i < len(padrao):
+        if padrao.startswith("**/", i):
+            partes.append("(?:.*/)?")
+            i += 3
+        elif padrao.startswith("**", i):
+            partes.append(".*")
+            i += 2
+        elif padrao[i] == "*":
+            partes.append("[^/]*")
+            i += 1
+        elif padrao[i] == "?":
+            partes.append("[^/]")
+            i += 1
+        elif padrao[i] == "[" and "]" in padrao[i + 2:]:
+            fim = padrao.index("]", i + 2)
+            classe = padrao[i + 1:fim].replace("\\", "\\\\")
+            partes.append("[" + ("^" + classe[1:] if classe.startswith("!") else classe) + "]")
+            i = fim + 1
+        else:
+            partes.append(re.escape(padrao[i]))
+            i += 1
+    return "".join(partes), ancorado, so_diretorio
+
+class FiltroArquivos:
+    # Regras compiladas uma única vez por execução. Os globs viram uma regex combinada por tipo (nome ou
+    # caminho, qualquer entrada ou só pastas), com um grupo nomeado por regra para saber qual delas
+    # excluiu; nomes exatos (Thumbs.db, node_modules) são resolvidos por um dict. Pastas excluídas são
+    # podadas na varredura e nunca chegam a ser listadas. Padrões com "!" reincluem o que casam.
+    def __init__(self, excluir=(), incluir=(), maior_que_mb=None, mais_antigo_que_dias=None):
+        flags = re.IGNORECASE if os.name == "nt" else 0
+        self.normalizar = str.lower if os.name == "nt" else (lambda nome: nome)
+        self.rotulos = {}
+        self.nomes = ({}, {})  # (qualquer entrada, só pastas): nome exato -> regra
+        globs = {}  # (ancorado, só pastas) -> [(grupo, regex)]
+        negacoes = {}
+        self.regex = []
+        for indice, regra in enumerate(excluir):
+            if regra.startswith("re:"):
+                self.regex.append((re.compile(regra[3:], flags), regra))
+                continue
+            negar = regra.startswith("!")
+            expressao, ancorado, so_diretorio = traduzir_padrao(regra[1:] if negar else regra)
+            if negar:
+                negacoes.setdefault(ancorado, []).append(expressao)
+            elif not ancorado and re.escape(regra.rstrip("/")) == expressao:
+                self.nomes[so_diretorio][self.normalizar(regra.rstrip("/"))] = regra
+            else:
+                grupo = f"r{indice}"
+                self.rotulos[grupo] = regra
+                globs.setdefault((ancorado, so_diretorio), []).append(f"(?P<{grupo}>{expressao})")
+        self.globs = {chave: re.compile("|".join(expressoes), flags) for chave, expressoes in globs.items()}
+        self.negacoes = {ancorado: re.compile("|".join(expressoes), flags) for ancorado, expressoes in negacoes.items()}
+        self.incluir = None
+        if incluir:
+            traduzidos = [traduzir_padrao(padrao) for padrao in incluir]
+            self.incluir = (re.compile("|".join(e for e, ancorado, _ in traduzidos if not ancorado) or "(?!)", flags),
+                            re.compile("|".join(e for e, ancorado, _ in traduzidos if ancorado) or "(?!)", flags))
+        self.maior_que = maior_que_mb * 1024 * 1024 if maior_que_mb else None
+        self.mtime_minimo = time.time() - mais_antigo_que_dias * 86400 if mais_antigo_que_dias else None
+        self.regra_tamanho = f"maior que {maior_que_mb} MB"
+        self.regra_idade = f"mais antigo que {mais_antigo_que_dias} dia(s)"
+        self.estatisticas = {}  # regra -> [arquivos, bytes, pastas podadas]
+        self.pastas_excluidas = {}  # Cache para excluir_entrada: pasta relativa -> regra (ou None)
+        self.lock = Lock()
+
+    def _contar(self, regra, arquivos=0, tamanho=0, pastas=0):
+        with self.lock:
+            estatistica = self.estatisticas.setdefault(regra, [0, 0, 0])
+            estatistica[0] += arquivos
+            estatistica[1] += tamanho
+            estatistica[2] += pastas
+
+    def _regra(self, rel_posix, nome, diretorio):
+        nome = self.normalizar(nome)
+        regra = self.nomes[False].get(nome) or (diretorio and self.nomes[True].get(nome))
+        if not regra:
+            for (ancorado, so_diretorio), expressao in self.globs.items():
+                if so_diretorio and not diretorio:
+                    continue
+                correspondencia = expressao.fullmatch(rel_posix if ancorado else nome)
+                if correspondencia:
+                    regra = self.rotulos[correspondencia.lastgroup]
+                    break
+        if not regra:
+            alvo = rel_posix + "/" if diretorio else rel_posix
+            regra = next((rotulo for expressao, rotulo in self.regex if expressao.search(alvo)), None)
+        if regra and self.negacoes:
+            negacao_nome, negacao_caminho = self.negacoes.get(False), self.negacoes.get(True)
+            if (negacao_nome and negacao_nome.fullmatch(nome)) or (negacao_caminho and negacao_caminho.fullmatch(rel_posix)):
+                return None
+        return regra
+
+    def podar_diretorio(self, rel_path, nome):
+        regra = self._regra(rel_path.replace(os.sep, "/"), nome, True)
+        if regra:
+            self._contar(regra, pastas=1)
+        return bool(regra)
+
+    def excluir_arquivo(self, rel_path, nome, tamanho, mtime):
+        rel_posix = rel_path.replace(os.sep, "/")
+        regra = self._regra(rel_posix, nome, False)
+        if not regra and self.incluir and not (self.incluir[0].fullmatch(self.normalizar(nome))
+                                               or self.incluir[1].fullmatch(rel_posix)):
+            regra = "incluir"  # Fora de todos os padrões de inclusão
+        if not regra and self.maior_que is not None and tamanho > self.maior_que:
+            regra = self.regra_tamanho
+        if not regra and self.mtime_minimo is not None and mtime < self.mtime_minimo:
+            regra = self.regra_idade
+        if regra:
+            self._contar(regra, arquivos=1, tamanho=tamanho)
+        return bool(regra)
+
+    def pasta_excluida(self, rel_dir):
+        # Regra que exclui a pasta ou alguma pasta acima dela; resultados guardados por pasta
+        if not rel_dir:
+            return None
+        if rel_dir not in self.pastas_excluidas:
+            self.pastas_excluidas[rel_dir] = self.pasta_excluida(os.path.dirname(rel_dir)) or \
+                self._regra(rel_dir.replace(os.sep, "/"), os.path.basename(rel_dir), True)
+        return self.pastas_excluidas[rel_dir]
+
+    def excluir_entrada(self, entrada):
+        # Para entradas que não vieram da varredura (manifesto anterior, caminhos do observador)
+        regra = self.pasta_excluida(os.path.dirname(entrada.rel_path))
+        if regra:
+            self._contar(regra, arquivos=1, tamanho=entrada.tamanho)
+            return True
+        return self.excluir_arquivo(entrada.rel_path, os.path.basename(entrada.rel_path), entrada.tamanho, entrada.mtime)
+
+    def resumo(self):
+        with self.lock:
+            return {regra: {"arquivos": arquivos, "bytes": tamanho, "pastas": pastas}
+                    for regra, (arquivos, tamanho, pastas) in self.estatisticas.items()}
+
+def compilar_filtro(config=None):
+    # None quando não há regras: a varredura não paga nada pelos filtros
+    config = carregar_configuracao() if config is None else config
+    excluir, incluir = config.get("excluir") or [], config.get("incluir") or []
+    maior_que_mb, mais_antigo_que_dias = config.get("excluir_maior_que_mb"), config.get("excluir_mais_antigos_que_dias")
+    if not (excluir or incluir or maior_que_mb or mais_antigo_que_dias):
+        return None
+    return FiltroArquivos(excluir, incluir, maior_que_mb, mais_antigo_que_dias)
+
+# Funções de backup
+# anterior: (tamanho, mtime, hash) do mesmo caminho no snapshot anterior, quando a entrada vem de comparar_varredura
+EntradaArquivo = namedtuple("EntradaArquivo", ["caminho", "rel_path", "tamanho", "mtime", "modo", "anterior"],
+                            defaults=(None,))
+
+def ler_pasta(dirpath, rel_dir, filtro=None):
+    # Lista uma pasta com os.scandir, reaproveitando o stat de cada entrada: produz as EntradaArquivo e,
+    # para cada subpasta que o filtro não poda, o par (rel_path, caminho)
+    try:
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not (filtro and filtro.podar_diretorio(rel_path, entry.name)):
+                            yield rel_path, entry.path
+                        continue
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except (FileNotFoundError, PermissionError) as e:
+                    logging.warning(f"Erro ao acessar '{entry.path}': {e}. Ignorando...")
+                    continue
+                if filtro and filtro.excluir_arquivo(rel_path, entry.name, st.st_size, st.st_mtime):
+                    continue
+                yield EntradaArquivo(entry.path, rel_path, st.st_size, st.st_mtime, st.st_mode)
+    except (FileNotFoundError, PermissionError, NotADirectoryError) as e:
+        logging.warning(f"Erro ao acessar '{dirpath}': {e}. Ignorando...")
+
+def escanear_arvore(origem, filtro=None, rel_base=""):
+    # Percorre a árvore uma única vez, sem ordem definida. Pastas excluídas pelo filtro não entram
+    # na pilha; rel_base prefixa os caminhos de uma subárvore.
+    pilha = [(rel_base, origem)]
+    while pilha:
+        rel_dir, dirpath = pilha.pop()
+        for item in ler_pasta(dirpath, rel_dir, filtro):
+            if isinstance(item, EntradaArquivo):
+                yield item
+            else:
+                pilha.append(item)
+
+def separar_subpastas(itens, subpastas):
+    for item in itens:
+        if isinstance(item, EntradaArquivo):
+            yield item
+        else:
+            subpastas.append(item)
+
+def escanear_ordenado(origem, filtro=None):
+    # A mesma varredura na ordem (pasta, nome) de iterar_manifesto. As pastas saem de um heap pelo caminho
+    # relativo: toda pasta ainda não listada descende de uma pendente, que é menor que ela, então saem em
+    # ordem. Os arquivos de cada pasta são ordenados pelo nome, em disco se a pasta for enorme.
+    pendentes = [("", origem)]
+    while pendentes:
+        rel_dir, dirpath = heapq.heappop(pendentes)
+        subpastas = []
+        yield from ordenar_com_despejo(separar_subpastas(ler_pasta(dirpath, rel_dir, filtro), subpastas),
+                                       chave=lambda entrada: entrada.rel_path)
+        for subpasta in subpastas:
+            heapq.heappush(pendentes, subpasta)
+
+class ListaEmDisco:
+    # Lista de EntradaArquivo (ou de pares (EntradaArquivo, hash)) gravada com marshal em um arquivo
+    # temporário, para árvores com milhões de arquivos. Pode ser percorrida várias vezes, e append é
+    # seguro entre threads (os workers do pipeline acrescentam as entradas salvas). Os itens vão para
+    # o arquivo em blocos de TAMANHO_BLOCO_LISTA com o tamanho na frente, lidos com um único read e
+    # marshal.loads: marshal.load direto do arquivo faz uma leitura por campo.
+    def __init__(self, itens=(), pares=False):
+        import tempfile
+        fd, self.caminho = tempfile.mkstemp(prefix="easybackup-", suffix=".lista")
+        self.arquivo = os.fdopen(fd, "wb")
+        self.pares = pares
+        self.total = 0
+        self.blocos = 0
+        self.bloco = []
+        self.lock = Lock()
+        for item in itens:
+            self.append(item)
+
+    def append(self, item):
+        registro = (tuple(item[0]), item[1]) if self.pares else tuple(item)
+        with self.lock:
+            self.bloco.append(registro)
+            self.total += 1
+            if len(self.bloco) >= TAMANHO_BLOCO_LISTA:
+                self._gravar_bloco()
+
+    def _gravar_bloco(self):
+        dados = marshal.dumps(self.bloco)
+        self.arquivo.write(TAMANHO_BLOCO_EM_DISCO.pack(len(dados)))
+        self.arquivo.write(dados)
+        self.blocos += 1
+        self.bloco = []
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        with self.lock:
+            if self.bloco:
+                self._gravar_bloco()
+            self.arquivo.flush()
+            blocos = self.blocos
+        criar = EntradaArquivo._make
+        with open(self.caminho, "rb") as f:
+            for _ in range(blocos):
+                tamanho, = TAMANHO_BLOCO_EM_DISCO.unpack(f.read(TAMANHO_BLOCO_EM_DISCO.size))
+                bloco = marshal.loads(f.read(tamanho))
+                if self.pares:
+                    yield from ((criar(entrada), hash_arquivo) for entrada, hash_arquivo in bloco)
+                else:
+                    yield from map(criar, bloco)
+
+    def fechar(self):
+        arquivo = getattr(self, "arquivo", None)
+        if arquivo and not arquivo.closed:
+            arquivo.close()
+            remover_temporario(self.caminho)
+
+    def __del__(self):
+        self.fechar()
+
+def ordenar_com_despejo(entradas, chave, limite=LIMITE_ORDENACAO_MEMORIA):
+    # sorted() com memória limitada: a cada `limite` entradas um bloco ordenado vai para uma ListaEmDisco
+    # (um run) e no fim os runs e o último bloco são intercalados com heapq.merge
+    bloco, runs = [], []
+    try:
+        for entrada in entradas:
+            bloco.append(entrada)
+            if len(bloco) >= limite:
+                bloco.sort(key=chave)
+                runs.append(ListaEmDisco(bloco))
+                bloco = []
+        bloco.sort(key=chave)
+        yield from heapq.merge(*runs, bloco, key=chave) if runs else bloco
+    finally:
+        for run in runs:
+            run.fechar()
+
+def comparar_com_manifesto(entradas, registros):
+    # Merge-join de duas sequências na ordem (pasta, nome): a varredura ordenada e o manifesto anterior
+    # (iterar_manifesto). Produz (situacao, entrada, registro) com situacao DIFERENCA_*; só os dois itens
+    # da frente de cada lado ficam na memória.
+    registros = verificar_ordem((((registro.pasta, registro.nome), registro) for registro in registros), "Manifesto")
+    chave_registro, registro = next(registros, (None, None))
+    for chave, entrada in verificar_ordem(((os.path.split(entrada.rel_path), entrada) for entrada in entradas),
+                                          "Varredura"):
+        while registro is not None and chave_registro < chave:
+            yield DIFERENCA_REMOVIDO, None, registro
+            chave_registro, registro = next(registros, (None, None))
+        if registro is not None and chave_registro == chave:
+            inalterado = registro.tamanho == entrada.tamanho and registro.mtime == entrada.mtime
+            yield (DIFERENCA_INALTERADO if inalterado else DIFERENCA_ALTERADO,
+                   entrada._replace(anterior=(registro.tamanho, registro.mtime, registro.hash)), registro)
+            chave_registro, registro = next(registros, (None, None))
+        else:
+            yield DIFERENCA_NOVO, entrada, None
+    while registro is not None:
+        yield DIFERENCA_REMOVIDO, None, registro
+        chave_registro, registro = next(registros, (None, None))
+
+def verificar_ordem(pares, descricao):
+    # Recebe pares (chave, item). O merge-join só está certo com os dois lados estritamente crescentes:
+    # melhor parar do que marcar arquivos como removidos ou novos por engano
+    anterior = None
+    for chave, item in pares:
+        if anterior is not None and chave <= anterior:
+            raise ValueError(f"{descricao} fora de ordem em {chave}.")
+        anterior = chave
+        yield chave, item
+
+def comparar_varredura(origem, snapshot_id=None, filtro=None):
+    # Varredura completa comparada em fluxo com o manifesto do snapshot anterior: as entradas (com o
+    # registro anterior) vão para uma ListaEmDisco e só as contagens por situação ficam na memória
+    entradas = ListaEmDisco()
+    diferenca = dict.fromkeys((DIFERENCA_NOVO, DIFERENCA_ALTERADO, DIFERENCA_INALTERADO, DIFERENCA_REMOVIDO), 0)
+    registros = iterar_manifesto(snapshot_id) if snapshot_id is not None else ()
+    for situacao, entrada, _ in comparar_com_manifesto(escanear_ordenado(origem, filtro), registros):
+        diferenca[situacao] += 1
+        if entrada is not None:
+            entradas.append(entrada)
+    return entradas, diferenca
+
+def escanear_origem(origem, filtro=None):
+    # Materializa a varredura para que verificação de espaço, progresso e cópia usem a mesma lista.
+    # Sem um filtro explícito, valem as regras de inclusão/exclusão da configuração.
+    return list(escanear_arvore(origem, filtro or compilar_filtro()))
+
+def calcular_tamanho_total(origem, entradas=None, filtro=None):
+    if entradas is None:
+        entradas = escanear_arvore(origem, filtro or compilar_filtro())
+    return sum(entrada.tamanho for entrada in entradas)
+
+class ObservadorAlteracoes:
+    # Mantém, entre execuções, o conjunto de caminhos alterados na origem: inotify no Linux e, nos
+    # demais sistemas, varreduras periódicas em segundo plano. O conjunto só é confiável para um destino
+    # se o observador estava ativo desde antes da última varredura completa daquele destino e não perdeu eventos.
+    MASCARA_INOTIFY = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800  # Escrita, atributos, moves, criação, remoção
+    IN_ISDIR = 0x40000000
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_CRIACAO = 0x100 | 0x80  # IN_CREATE | IN_MOVED_TO
+
+    def __init__(self, origem, intervalo_polling=None):
+        self.origem = os.path.abspath(origem)
+        self.intervalo_polling = intervalo_polling or carregar_configuracao().get(
+            "intervalo_polling_observador", INTERVALO_POLLING_OBSERVADOR)
+        self.lock = Lock()
+        self.parar = False
+        self.desde = None       # Momento a partir do qual nenhuma alteração foi perdida
+        self.estouro = False    # Fila do kernel estourou ou faltaram watches: exige varredura completa
+        self.pendentes = set()
+        self.bases = {}         # destino -> (snapshot_id, marca consumida, última varredura completa)
+        self.fd = None
+        self.diretorios = {}    # wd -> caminho relativo (inotify)
+        self.estado = {}        # rel_path -> (tamanho, mtime) (polling)
+        self.thread = None
+
+    def iniciar(self):
+        self.fd = self._abrir_inotify()
+        alvo = self._executar_inotify if self.fd is not None else self._executar_polling
+        if self.fd is not None:
+            self._observar_arvore("")
+        else:
+            self.estado = {entrada.rel_path: (entrada.tamanho, entrada.mtime) for entrada in escanear_arvore(self.origem)}
+        self.desde = time.time()
+        self.thread = Thread(target=alvo, daemon=True)
+        self.thread.start()
+        logging.info(f"Observando alterações em '{self.origem}' ({'inotify' if self.fd is not None else 'polling'})")
+        return self
+
+    def encerrar(self):
+        self.parar = True
+        if self.thread:
+            self.thread.join()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def confiavel(self):
+        return self.desde is not None and not self.estouro and not self.parar
+
+    def sincronizar(self):
+        # Traz para o banco tudo o que aconteceu até agora e retorna a marca correspondente
+        with self.lock:
+            if self.fd is not None:
+                self._ler_eventos(espera=0)
+            else:
+                self._varrer_polling()
+            self._gravar_pendentes()
+        return obter_marca_alteracoes(self.origem)
+
+    def recuperar(self):
+        # Após um estouro: descarta as bases e volta a observar a árvore inteira; a próxima
+        # varredura completa restabelece a confiança
+        with self.lock:
+            self.bases.clear()
+            self.estouro = False
+            if self.fd is not None:
+                self._observar_arvore("")
+            self.desde = time.time()
+
+    def registrar_base(self, destino, snapshot_id, marca, varredura_completa):
+        # Chamado após uma execução sem erros; a execução seguinte parte desta marca
+        with self.lock:
+            self.bases[destino] = (snapshot_id, marca, varredura_completa)
+            minima = min(base[1] for base in self.bases.values())
+        descartar_caminhos_alterados(self.origem, minima)
+
+    def invalidar_base(self, destino):
+        with self.lock:
+            self.bases.pop(destino, None)
+
+    def _marcar(self, rel_path):
+        self.pendentes.add(rel_path)
+        if len(self.pendentes) >= TAMANHO_LOTE_ALTERACOES:
+            self._gravar_pendentes()
+
+    def _gravar_pendentes(self):
+        if self.pendentes:
+            registrar_caminhos_alterados(self.origem, sorted(self.pendentes))
+            self.pendentes.clear()
+
+    def _abrir_inotify(self):
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            import ctypes
+            import ctypes.util
+            self.ctypes = ctypes
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            logging.warning(f"inotify indisponível: {e}. Usando polling...")
+            return None
+        return fd if fd >= 0 else None
+
+    def _observar_arvore(self, rel_dir):
+        pilha = [rel_dir]
+        while pilha:
+            rel = pilha.pop()
+            caminho = os.path.join(self.origem, rel) if rel else self.origem
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(caminho), self.MASCARA_INOTIFY)
+            if wd < 0:
+                # Tipicamente ENOSPC (fs.inotify.max_user_watches): sem cobertura total, volta à varredura completa
+                logging.warning(f"Não foi possível observar '{caminho}' (errno {self.ctypes.get_errno()}).")
+                self.estouro = True
+                continue
+            self.diretorios[wd] = rel
+            try:
+                with os.scandir(caminho) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            pilha.append(os.path.join(rel, entry.name) if rel else entry.name)
+            except OSError:
+                continue
+
+    def _executar_inotify(self):
+        import select
+        while not self.parar:
+            prontos, _, _ = select.select([self.fd], [], [], 1.0)
+            with self.lock:
+                if prontos and self.fd is not None:
+                    self._ler_eventos(espera=0)
+                self._gravar_pendentes()
+
+    def _ler_eventos(self, espera):
+        while True:
+            try:
+                dados = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            deslocamento = 0
+            while deslocamento < len(dados):
+                wd, mascara, _, tamanho = struct.unpack_from("iIII", dados, deslocamento)
+                nome = dados[deslocamento + 16:deslocamento + 16 + tamanho].rstrip(b"\0")
+                deslocamento += 16 + tamanho
+                if mascara & self.IN_Q_OVERFLOW:
+                    logging.warning(f"Fila de eventos do inotify estourou em '{self.origem}'. A próxima execução fará varredura completa.")
+                    self.estouro = True
+                    continue
+                if mascara & self.IN_IGNORED:
+                    self.diretorios.pop(wd, None)
+                    continue
+                rel_dir = self.diretorios.get(wd)
+                if rel_dir is None:
+                    continue
+                nome = os.fsdecode(nome)
+                rel_path = os.path.join(rel_dir, nome) if rel_dir and nome else (nome or rel_dir)
+                self._marcar(rel_path)
+                if mascara & self.IN_ISDIR and mascara & self.IN_CRIACAO:
+                    self._observar_arvore(rel_path)  # Pasta nova ou movida para dentro: observa e marca a subárvore
+
+    def _executar_polling(self):
+        while not self.parar:
+            prazo = time.monotonic() + self.intervalo_polling
+            while not self.parar and time.monotonic() < prazo:
+                time.sleep(1)
+            if not self.parar:
+                with self.lock:
+                    self._varrer_polling()
+                    self._gravar_pendentes()
+
+    def _varrer_polling(self):
+        # Sem notificações do sistema: compara uma varredura com a anterior. Não evita o custo da
+        # varredura, apenas o mantém fora da janela do backup quando a sincronização encontra pouco a fazer.
+        novo = {entrada.rel_path: (entrada.tamanho, entrada.mtime) for entrada in escanear_arvore(self.origem)}
+        for rel_path, dados in novo.items():
+            if self.estado.get(rel_path) != dados:
+                self._marcar(rel_path)
+        for rel_path in self.estado.keys() - novo.keys():
+            self._marcar(rel_path)
+        self.estado = novo
+
+observadores = {}
+
+def configurar_observacao(origem, config=None):
+    # Liga ou desliga o observador conforme a configuração; chamado junto com o agendamento.
+    # Aceita uma origem ou a lista de origens de todos os jobs; as demais deixam de ser observadas.
+    config = carregar_configuracao() if config is None else config
+    origens = [origem] if isinstance(origem, str) else list(origem or [])
+    origens = [origem for origem in origens if origem and os.path.isdir(origem)]
+    if not config.get("observar_alteracoes") or not origens:
+        encerrar_observacao()
+        return None
+    manter = {os.path.abspath(origem) for origem in origens}
+    for chave in [chave for chave in observadores if chave not in manter]:
+        encerrar_observacao(chave)
+    observadores_ativos = [iniciar_observacao(origem) for origem in origens]
+    return observadores_ativos[0] if isinstance(origem, str) else observadores_ativos
+
+def iniciar_observacao(origem):
+    # Um observador por origem, compartilhado pelos agendamentos do processo
+    origem = os.path.abspath(origem)
+    observador = observadores.get(origem)
+    if observador is None or observador.parar:
+        observador = observadores[origem] = ObservadorAlteracoes(origem).iniciar()
+    return observador
+
+def encerrar_observacao(origem=None):
+    for chave in [chave for chave in observadores if origem is None or chave == os.path.abspath(origem)]:
+        observadores.pop(chave).encerrar()
+
+def obter_observador(origem):
+    return observadores.get(os.path.abspath(origem))
+
+def aplicar_alteracoes(origem, snapshot_id, caminhos_alterados, filtro=None):
+    # Monta a lista de entradas sem percorrer a origem: o manifesto do snapshot anterior, lido em fluxo,
+    # para o que não mudou e um stat (ou varredura da subárvore) só para os caminhos alterados. O filtro vale
+    # também para o que vem do manifesto, já que as regras podem ter mudado desde o snapshot anterior.
+    # Como em comparar_varredura, as entradas vão para uma ListaEmDisco e trazem o registro anterior;
+    # só os caminhos alterados ficam na memória.
+    removidos = set()
+    subarvores = set()  # Pastas revarridas: a varredura substitui tudo o que o manifesto tinha abaixo delas
+    novas = {}
+    for rel_path in caminhos_alterados:
+        caminho = os.path.join(origem, rel_path)
+        try:
+            st = os.stat(caminho, follow_symlinks=False)
+        except FileNotFoundError:
+            removidos.add(rel_path)
+            continue
+        except OSError as e:
+            logging.warning(f"Erro ao acessar '{caminho}': {e}. Ignorando...")
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            subarvores.add(rel_path)
+            if filtro and filtro.pasta_excluida(rel_path):
+                continue
+            for entrada in escanear_arvore(caminho, filtro, rel_path):
+                novas[entrada.rel_path] = entrada
+        elif stat.S_ISREG(st.st_mode):
+            entrada = EntradaArquivo(caminho, rel_path, st.st_size, st.st_mtime, st.st_mode)
+            if filtro and filtro.excluir_entrada(entrada):
+                removidos.add(rel_path)
+            else:
+                novas[rel_path] = entrada
+        else:
+            removidos.add(rel_path)
+    prefixos = tuple(rel_path + os.sep if rel_path else "" for rel_path in removidos | subarvores)
+    entradas = ListaEmDisco()
+    for registro in iterar_manifesto(snapshot_id):
+        rel_path = os.path.join(registro.pasta, registro.nome)
+        anterior = (registro.tamanho, registro.mtime, registro.hash)
+        if rel_path in novas:
+            novas[rel_path] = novas[rel_path]._replace(anterior=anterior)
+            continue
+        if rel_path in removidos or (prefixos and rel_path.startswith(prefixos)):
+            continue
+        entrada = EntradaArquivo(os.path.join(origem, rel_path), rel_path, registro.tamanho, registro.mtime,
+                                 stat.S_IFREG | 0o644, anterior)
+        if not (filtro and filtro.excluir_entrada(entrada)):
+            entradas.append(entrada)
+    for entrada in novas.values():
+        entradas.append(entrada)
+    return entradas
+
+def verificar_espaco_suficiente(origem, destino, entradas=None, bytes_necessarios=None, bytes_liberaveis=0):
+    total_size = calcular_tamanho_total(origem, entradas) if bytes_necessarios is None else bytes_necessarios
+    free_space = shutil.disk_usage(destino).free + bytes_liberaveis
+    logging.info(f"Tamanho total do backup: {total_size / (1024 * 1024):.2f} MB")
+    logging.info(f"Espaço livre no destino: {free_space / (1024 * 1024):.2f} MB")
+    if free_space < total_size:
+        logging.error(f"Espaço insuficiente para o backup. Necessário: {total_size / (1024 * 1024):.2f} MB, disponível: {free_space / (1024 * 1024):.2f} MB.")
+        return False
+    return True
+
+def arredondar_cluster(tamanho):
+    return -(-tamanho // TAMANHO_CLUSTER) * TAMANHO_CLUSTER
+
+def estimar_bytes_necessarios(entradas, modo_destino, snapshot_anterior=None, tamanho_anterior=None):
+    # Estima o que a execução vai gravar: só arquivos novos ou alterados em relação ao manifesto
+    # anterior (os demais viram hard-links ou chunks reaproveitados); no modo arquivo tudo é
+    # gravado, mas reduzido pela razão de compressão observada no contêiner anterior, cujo conteúdo
+    # original soma tamanho_anterior bytes (ou o total do manifesto em snapshot_anterior).
+    if modo_destino == MODO_ARQUIVO:
+        razao = 1.0
+        if snapshot_anterior and snapshot_anterior[0].endswith(".tar") and os.path.exists(snapshot_anterior[0]):
+            tamanho_original = (tamanho_anterior if tamanho_anterior is not None else
+                                sum(registro[0] for registro in snapshot_anterior[1].values()))
+            if tamanho_original:
+                razao = min(1.0, os.path.getsize(snapshot_anterior[0]) / tamanho_original)
+        return int(sum(entrada.tamanho for entrada in entradas) * razao)
+    manifesto = snapshot_anterior[1] if snapshot_anterior else {}
+    necessarios = 0
+    for entrada in entradas:
+        anterior = entrada.anterior or manifesto.get(entrada.rel_path)
+        if not anterior or anterior[0] != entrada.tamanho or anterior[1] != entrada.mtime:
+            necessarios += arredondar_cluster(entrada.tamanho)
+    return necessarios
+
+class VigiaEspaco:
+    # Acompanha o espaço livre do destino durante a cópia. Cada arquivo reserva seu tamanho antes de
+    # ser gravado; abaixo da reserva mínima os workers pausam e, se o espaço não voltar a tempo,
+    # a execução para de forma limpa (status parcial) em vez de falhar com o disco cheio.
+    def __init__(self, destino, reserva=RESERVA_ESPACO, intervalo=INTERVALO_VIGIA_ESPACO,
+                 tempo_maximo_pausa=TEMPO_MAXIMO_PAUSA_ESPACO):
+        self.destino = destino
+        self.reserva = reserva
+        self.intervalo = intervalo
+        self.tempo_maximo_pausa = tempo_maximo_pausa
+        self.condicao = Condition()
+        self.livre = shutil.disk_usage(destino).free
+        self.pausado = False
+        self.parado = False
+        self.encerrado = False
+
+    def iniciar(self):
+        Thread(target=self._monitorar, daemon=True).start()
+        return self
+
+    def encerrar(self):
+        with self.condicao:
+            self.encerrado = True
+            self.condicao.notify_all()
+
+    def _medir(self):
+        try:
+            self.livre = shutil.disk_usage(self.destino).free
+        except OSError as e:
+            logging.warning(f"Erro ao medir o espaço livre em '{self.destino}': {e}")
+
+    def _monitorar(self):
+        with self.condicao:
+            while not self.encerrado:
+                self.condicao.wait(self.intervalo)
+                self._medir()
+                self.condicao.notify_all()
+
+    def reservar(self, tamanho):
+        with self.condicao:
+            if self.parado:
+                return False
+            if self.livre - tamanho < self.reserva:
+                self._medir()
+            inicio = time.monotonic()
+            while self.livre - tamanho < self.reserva:
+                if not self.pausado:
+                    self.pausado = True
+                    logging.warning(f"Pouco espaço no destino ({self.livre / (1024 * 1024):.2f} MB livres). Cópia pausada...")
+                restante = self.tempo_maximo_pausa - (time.monotonic() - inicio)
+                if restante <= 0 or self.encerrado:
+                    self.parado = True
+                    logging.error("Espaço no destino não foi liberado a tempo. Backup interrompido.")
+                    self.condicao.notify_all()
+                    return False
+                self.condicao.wait(min(restante, self.intervalo))
+                if self.parado:
+                    return False
+            if self.pausado:
+                self.pausado = False
+                logging.info("Espaço disponível novamente. Cópia retomada.")
+            self.livre -= tamanho
+            return True
+
+def criar_diretorio_destino(dest_path, diretorios_criados):
+    # Evita um makedirs por arquivo quando vários arquivos compartilham a mesma pasta
+    dest_dir = os.path.dirname(dest_path)
+    if dest_dir not in diretorios_criados:
+        os.makedirs(dest_dir, exist_ok=True)
+        diretorios_criados.add(dest_dir)
+
+def obter_mtime_destino(dest_path):
+    try:
+        return os.stat(dest_path).st_mtime
+    except FileNotFoundError:
+        return None
+
+Snapshot = namedtuple("Snapshot", ["caminho", "data", "tipo"])
+
+def listar_snapshots(destino):
+    # Catálogo de snapshots: só o primeiro nível do destino e do repositório, nunca o conteúdo.
+    # A data vem do nome (backup_<data>), pois o mtime das pastas muda com o conteúdo.
+    snapshots = []  # (data, sequência, snapshot)
+    pastas = [(destino, None), (os.path.join(destino, PASTA_REPOSITORIO, "snapshots"), MODO_REPOSITORIO)]
+    for pasta, tipo_pasta in pastas:
+        try:
+            with os.scandir(pasta) as it:
+                for entry in it:
+                    correspondencia = PADRAO_SNAPSHOT.match(entry.name)
+                    if not correspondencia:
+                        continue
+                    data = datetime.strptime(correspondencia.group(1), "%Y-%m-%d_%H-%M-%S")
+                    if tipo_pasta:
+                        tipo = tipo_pasta
+                    elif correspondencia.group(3) == ".tar":
+                        tipo = MODO_ARQUIVO
+                    elif entry.is_dir(follow_symlinks=False):
+                        tipo = MODO_PASTA
+                    else:
+                        continue
+                    snapshots.append((data, int(correspondencia.group(2) or 1), Snapshot(entry.path, data, tipo)))
+        except FileNotFoundError:
+            continue
+    return [snapshot for _, _, snapshot in sorted(snapshots, key=lambda item: item[:2], reverse=True)]
+
+def nome_snapshot_livre(pasta, data, extensao="", sufixos=("",)):
+    # Primeiro backup_<data>[_n]<extensao> em que nenhum dos sufixos (ex.: a pasta .incompleto) existe
+    for sequencia in range(1, TENTATIVAS_NOME_SNAPSHOT + 1):
+        caminho = os.path.join(pasta, f"backup_{data}" + (f"_{sequencia}" if sequencia > 1 else "") + extensao)
+        if not any(os.path.lexists(caminho + sufixo) for sufixo in sufixos):
+            return caminho
+    raise FileExistsError(errno.EEXIST, f"Nenhum nome livre para o snapshot de {data}", pasta)
+
+def publicar_snapshot(temporario, pasta, data, extensao=""):
+    # Dá ao temporário o nome definitivo sem nunca substituir um snapshot existente: se o nome foi ocupado
+    # desde a escolha, usa o próximo sufixo livre. os.rename (e não os.replace) falha no Windows se o
+    # destino existe, e no POSIX só quando ele é uma pasta com conteúdo.
+    for _ in range(TENTATIVAS_NOME_SNAPSHOT):
+        caminho = nome_snapshot_livre(pasta, data, extensao)
+        try:
+            os.rename(temporario, caminho)
+            return caminho
+        except OSError as e:
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+    raise FileExistsError(errno.EEXIST, f"Nenhum nome livre para o snapshot de {data}", pasta)
+
+def politica_retencao(dias_retencao=None, config=None):
+    # Um snapshot é mantido se qualquer regra o mantiver (como no restic/borg)
+    config = carregar_configuracao() if config is None else config
+    return {
+        "dias": dias_retencao if dias_retencao is not None else config.get("dias_retencao", 7),
+        "ultimos": config.get("manter_ultimos", 1),
+        "diarios": config.get("manter_diarios", 0),
+        "semanais": config.get("manter_semanais", 0),
+        "mensais": config.get("manter_mensais", 0),
+    }
+
+def decidir_retencao(snapshots, politica, agora=None):
+    # Retorna (manter, remover); manter é uma lista de (snapshot, motivos). snapshots do mais novo ao mais antigo.
+    agora = agora or datetime.now()
+    motivos = {snapshot.caminho: [] for snapshot in snapshots}
+    for indice, snapshot in enumerate(snapshots):
+        if indice < politica.get("ultimos", 0):
+            motivos[snapshot.caminho].append("últimos")
+        if politica.get("dias") and snapshot.data >= agora - timedelta(days=politica["dias"]):
+            motivos[snapshot.caminho].append("dias")
+    # GFS: o snapshot mais novo de cada um dos N dias/semanas/meses mais recentes
+    for regra, chave in (("diarios", lambda data: data.date()),
+                         ("semanais", lambda data: data.isocalendar()[:2]),
+                         ("mensais", lambda data: (data.year, data.month))):
+        limite = politica.get(regra, 0)
+        periodos = set()
+        for snapshot in snapshots:
+            if len(periodos) >= limite:
+                break
+            periodo = chave(snapshot.data)
+            if periodo not in periodos:
+                periodos.add(periodo)
+                motivos[snapshot.caminho].append(regra)
+    manter = [(snapshot, motivos[snapshot.caminho]) for snapshot in snapshots if motivos[snapshot.caminho]]
+    remover = [snapshot for snapshot in snapshots if not motivos[snapshot.caminho]]
+    return manter, remover
+
+def remover_arvore_paralela(caminho, executor):
+    # Cada subpasta de primeiro nível é removida por um worker; o custo não depende de um único rmtree sequencial
+    futuros = []
+    with os.scandir(caminho) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                futuros.append(executor.submit(shutil.rmtree, entry.path))
+            else:
+                futuros.append(executor.submit(os.remove, entry.path))
+    for futuro in futuros:
+        futuro.result()
+    os.rmdir(caminho)
+
+def remover_snapshots(destino, snapshots, metricas=None):
+    # Com metricas, o tempo da remoção entra na fase "retencao" da execução, mesmo em segundo plano
+    with metricas.fase("retencao") if metricas else nullcontext():
+        _remover_snapshots(destino, snapshots)
+
+def _remover_snapshots(destino, snapshots):
+    repositorio_alterado = False
+    with ThreadPoolExecutor(max_workers=WORKERS_REMOCAO) as executor:
+        for snapshot in snapshots:
+            try:
+                if snapshot.tipo == MODO_PASTA:
+                    remover_arvore_paralela(snapshot.caminho, executor)
+                else:
+                    os.remove(snapshot.caminho)
+                    repositorio_alterado = repositorio_alterado or snapshot.tipo == MODO_REPOSITORIO
+                remover_snapshot_catalogo(snapshot.caminho)
+                logging.info(f"Backup antigo removido: {snapshot.caminho}")
+            except Exception as e:
+                logging.warning(f"Erro ao remover backup '{snapshot.caminho}': {e}")
+    if repositorio_alterado:
+        RepositorioChunks(os.path.join(destino, PASTA_REPOSITORIO)).coletar_lixo()
+    limpar_assinaturas_orfas()
+
+def aplicar_retencao(destino, politica=None, dry_run=False, em_segundo_plano=True, metricas=None):
+    # Decide por snapshot (nunca por arquivo) e remove em segundo plano. Snapshots em andamento
+    # não entram na decisão; o snapshot mais recente e o mais recente concluído com sucesso são sempre
+    # preservados (o mais novo pode ser parcial, e sozinho não serviria para restaurar tudo).
+    politica = politica or politica_retencao()
+    em_andamento = obter_caminhos_snapshots_em_andamento()
+    snapshots = [snapshot for snapshot in listar_snapshots(destino) if snapshot.caminho not in em_andamento]
+    manter, remover = decidir_retencao(snapshots, dict(politica, ultimos=max(1, politica.get("ultimos", 1))))
+    sem_sucesso = obter_caminhos_snapshots_sem_sucesso()
+    concluido = next((snapshot for snapshot in snapshots if snapshot.caminho not in sem_sucesso), None)
+    if concluido in remover:
+        remover.remove(concluido)
+        manter = sorted(manter + [(concluido, ["último sucesso"])], key=lambda item: item[0].data, reverse=True)
+    for snapshot in remover:
+        logging.info(f"{'[simulação] ' if dry_run else ''}Backup marcado para remoção: {snapshot.caminho}")
+    if dry_run or not remover:
+        return manter, remover
+    # Apagar snapshots do repositório enquanto um backup grava chunks nele não é seguro: coleta síncrona
+    if em_segundo_plano and not any(snapshot.tipo == MODO_REPOSITORIO for snapshot in remover):
+        remocao = Thread(target=remover_snapshots, args=(destino, remover, metricas))
+        remocao.start()
+        if metricas:
+            metricas.acompanhar(remocao)
+    else:
+        remover_snapshots(destino, remover, metricas)
+    return manter, remover
+
+def estimar_bytes_liberados(remover, manter):
+    # Bytes que a retenção vai liberar: contêineres inteiros, e nos snapshots em pasta só os arquivos
+    # que nenhum snapshot mantido compartilha (os demais são hard-links e continuam ocupando espaço)
+    liberados = 0
+    caminhos_mantidos = [snapshot.caminho for snapshot, _ in manter]
+    for snapshot in remover:
+        if snapshot.tipo == MODO_ARQUIVO:
+            try:
+                liberados += os.path.getsize(snapshot.caminho)
+            except OSError:
+                pass
+        elif snapshot.tipo == MODO_PASTA:
+            liberados += calcular_bytes_exclusivos_snapshot(snapshot.caminho, caminhos_mantidos)
+    return liberados
+
+def remover_backups_antigos(destino, dias_retencao):
+    return aplicar_retencao(destino, politica_retencao(dias_retencao))
+
+def caminho_temporario(dest_path):
+    # Ao lado do destino (mesmo volume, para o os.replace ser atômico) e único por thread
+    return f"{dest_path}.{os.getpid()}.{get_ident()}{SUFIXO_TEMPORARIO}"
+
+def limpar_temporarios(pasta):
+    # Temporários deixados por uma execução interrompida; chamada só ao retomar
+    for entrada in escanear_arvore(pasta):
+        if entrada.rel_path.endswith(SUFIXO_TEMPORARIO):
+            try:
+                os.remove(entrada.caminho)
+            except OSError as e:
+                logging.warning(f"Erro ao remover o temporário '{entrada.caminho}': {e}")
+
+class DiarioCheckpoint:
+    # Arquivos já gravados no snapshot em andamento, persistidos em lotes (executemany numa transação,
+    # a cada TAMANHO_LOTE_CHECKPOINT arquivos ou INTERVALO_CHECKPOINT segundos). Ao retomar, concluidos
+    # traz o que a execução interrompida registrou.
+    def __init__(self, snapshot_id, concluidos=None):
+        self.snapshot_id = snapshot_id
+        self.concluidos = concluidos or {}
+        self.lock = Lock()
+        self.pendentes = []
+        self.ultimo_lote = time.monotonic()
+
+    def registrar(self, entrada, hash_arquivo):
+        lote = None
+        with self.lock:
+            self.pendentes.append((self.snapshot_id, entrada.rel_path, entrada.tamanho, entrada.mtime, hash_arquivo))
+            if len(self.pendentes) >= TAMANHO_LOTE_CHECKPOINT or time.monotonic() - self.ultimo_lote >= INTERVALO_CHECKPOINT:
+                lote, self.pendentes = self.pendentes, []
+                self.ultimo_lote = time.monotonic()
+        if lote:
+            gravar_checkpoint(lote)
+
+    def gravar(self):
+        with self.lock:
+            lote, self.pendentes = self.pendentes, []
+        if lote:
+            gravar_checkpoint(lote)
+
+    def concluido(self, entrada, dest_path):
+        # O diário só vale se a origem não mudou e a cópia no destino ainda é a que foi registrada
+        # (o lote pode ter sido gravado antes de os dados chegarem ao disco numa queda de energia)
+        registro = self.concluidos.get(entrada.rel_path)
+        if not registro or registro[0] != entrada.tamanho or registro[1] != entrada.mtime:
+            return None
+        try:
+            st = os.stat(dest_path)
+        except FileNotFoundError:
+            return None
+        return registro if st.st_size == entrada.tamanho and st.st_mtime == entrada.mtime else None
+
+def backup_incremental(origem, destino, progress_callback, entradas=None, snapshot_anterior=None, workers=None, vigia=None,
+                       metricas=None, checkpoint=None):
+    # snapshot_anterior: (caminho, manifesto) do último snapshot concluído. Arquivos com mesmo
+    # tamanho e mtime são vinculados (hard-link) a partir dele em vez de copiados, como o --link-dest do rsync.
+    # Entradas de comparar_varredura já trazem o registro anterior (o manifesto pode vir vazio) e, numa
+    # ListaEmDisco, as entradas salvas também ficam em disco. Retorna pares (entrada, hash).
+    if entradas is None:
+        entradas = escanear_origem(origem)
+    total_items = len(entradas)
+    if total_items == 0:
+        progress_callback(100)
+        return []
+    caminho_anterior, manifesto_anterior = snapshot_anterior if snapshot_anterior else (None, {})
+
+    limite_delta = resolver_limite_delta()
+    metodo_copia = resolver_metodo_copia()
+    calcular_hash = carregar_configuracao().get("hash_na_copia", True)
+
+    # Arquivos pequenos em pacotes: os pacotes anteriores ainda úteis são vinculados antes da cópia
+    limite_pacote = resolver_limite_pacote()
+    escritor = EscritorPacotes(destino) if limite_pacote else None
+    vinculados = set()
+    indice_anterior = IndicePacotes.abrir(caminho_anterior) if escritor and caminho_anterior else None
+    if indice_anterior:
+        vinculados = escritor.reaproveitar(indice_anterior, (entrada for entrada in entradas
+                                                             if entrada.tamanho < limite_pacote))
+
+    def empacotar(entrada):
+        registro = vinculados and EscritorPacotes.registro_reaproveitado(indice_anterior, vinculados, entrada)
+        if registro:
+            escritor.registrar(registro)
+            return ACAO_VINCULADO, registro.hash
+        if vigia and not vigia.reservar(entrada.tamanho):
+            return ACAO_IGNORADO, None
+        hash_arquivo = escritor.empacotar(entrada)
+        return hash_arquivo and ACAO_EMPACOTADO, hash_arquivo
+
+    def processar(entrada, dest_path):
+        if dest_path is None:
+            return empacotar(entrada)
+        anterior = entrada.anterior or manifesto_anterior.get(entrada.rel_path)
+        inalterado = anterior and anterior[0] == entrada.tamanho and anterior[1] == entrada.mtime
+        base_path = os.path.join(caminho_anterior, entrada.rel_path) if caminho_anterior else None
+        if inalterado and vincular_item(base_path, dest_path):
+            if entrada.tamanho >= limite_delta:
+                vincular_assinaturas(base_path, dest_path)
+            return ACAO_VINCULADO, anterior[2]  # Mesmo conteúdo (hard-link): herda o hash
+        dest_mtime = obter_mtime_destino(dest_path)
+        if dest_mtime is None or entrada.mtime > dest_mtime:
+            # Só o que será gravado reserva espaço: vínculos e arquivos inalterados não ocupam o destino
+            if vigia and not vigia.reservar(entrada.tamanho):
+                return ACAO_IGNORADO, None
+            hash_arquivo = novo_hash_arquivo() if calcular_hash else None
+            if entrada.tamanho >= limite_delta:
+                acao = copiar_delta(entrada.caminho, dest_path, base_path, hash_arquivo) and ACAO_DELTA
+            else:
+                acao = copiar_item(entrada.caminho, dest_path, hash_arquivo, metodo_copia) and ACAO_COPIADO
+            return acao, hash_arquivo.hexdigest() if acao and hash_arquivo is not None else None
+        return ACAO_INALTERADO, anterior[2] if inalterado else None
+
+    def processar_com_checkpoint(entrada, dest_path):
+        # Retomada: o que o diário da execução interrompida registrou não é copiado de novo. Arquivos
+        # empacotados não entram no diário: o índice dos pacotes só existe no fim da execução.
+        if dest_path is None:
+            return processar(entrada, dest_path)
+        registro = checkpoint.concluido(entrada, dest_path)
+        if registro:
+            return ACAO_INALTERADO, registro[2]
+        acao, hash_arquivo = processar(entrada, dest_path)
+        if acao and acao != ACAO_IGNORADO:
+            if acao == ACAO_INALTERADO and hash_arquivo is None and calcular_hash:
+                # Gravado pela execução interrompida depois do último lote do checkpoint: o hash vem da cópia
+                hash_arquivo = hash_de_arquivo(dest_path)
+            checkpoint.registrar(entrada, hash_arquivo)
+        return acao, hash_arquivo
+
+    salvas = ListaEmDisco(pares=True) if isinstance(entradas, ListaEmDisco) else []
+    executar_pipeline_copia(entradas, destino, processar_com_checkpoint if checkpoint else processar, progress_callback,
+                            workers, vigia, metricas, limite_pacote, com_hash=True, salvas=salvas)
+    if indice_anterior:
+        indice_anterior.fechar()
+    if escritor:
+        escritor.concluir()
+    if checkpoint:
+        checkpoint.gravar()
+    progress_callback(100)  # Garantir que a barra de progresso atinja 100%
+    return salvas
+
+def vincular_item(link_origem, dest_path):
+    # Falha silenciosamente (ex.: FAT/exFAT, volumes diferentes ou arquivo removido) para que o chamador copie
+    try:
+        os.link(link_origem, dest_path)
+        return True
+    except OSError as e:
+        logging.debug(f"Não foi possível vincular '{link_origem}': {e}. Copiando...")
+        return False
+
+def dentro_do_horario(perfil, agora):
+    # "inicio"/"fim" em HH:MM (fim maior que início ou virando a meia-noite) e "dias" com 0 = segunda
+    if "dias" in perfil and agora.weekday() not in perfil["dias"]:
+        return False
+    inicio, fim, atual = perfil.get("inicio", "00:00"), perfil.get("fim", "24:00"), agora.strftime("%H:%M")
+    return inicio <= atual < fim if inicio <= fim else (atual >= inicio or atual < fim)
+
+def resolver_limites_io(config, agora=None):
+    # Limites globais da configuração, sobrepostos pelo primeiro perfil de "perfis_io" que vale agora
+    limites = {
+        "nome": None,
+        "limite_vazao_mb": config.get("limite_vazao_mb"),
+        "limite_arquivos_por_segundo": config.get("limite_arquivos_por_segundo"),
+        "vazao_adaptativa": config.get("vazao_adaptativa", False),
+        "latencia_alvo_ms": config.get("latencia_alvo_ms", LATENCIA_ALVO_MS),
+    }
+    agora = agora or datetime.now()
+    for perfil in config.get("perfis_io", []):
+        if dentro_do_horario(perfil, agora):
+            limites.update((chave, valor) for chave, valor in perfil.items() if chave in limites)
+            limites["nome"] = perfil.get("nome", f"{perfil.get('inicio', '00:00')}-{perfil.get('fim', '24:00')}")
+            break
+    return limites
+
+class LimitadorIO:
+    # Baldes de fichas (token bucket) para bytes/s e arquivos/s, compartilhados por todas as threads de
+    # cópia do processo. Leitura e gravação usam o mesmo orçamento de bytes, já que a cópia grava o que lê.
+    # Os limites são reavaliados a cada segundo, então a troca de perfil vale no meio de uma execução.
+    # No modo adaptativo a taxa cai quando a latência média das leituras da origem passa do alvo e volta
+    # a subir aos poucos (AIMD): o backup ocupa só a E/S que o uso normal deixa livre.
+    def __init__(self):
+        self.lock = Lock()
+        self.proxima_revisao = 0.0
+        self.ativo = False
+        self.perfil = None
+        self.limite_bytes = None
+        self.limite_arquivos = None
+        self.adaptativo = False
+        self.latencia_alvo = LATENCIA_ALVO_MS / 1000
+        self.taxa_adaptativa = None
+        self.latencia_media = None
+        self.baldes = {"bytes": [0.0, time.monotonic()], "arquivos": [0.0, time.monotonic()]}
+        self.bytes_janela = 0
+        self.inicio_janela = time.monotonic()
+        self.espera_total = 0.0
+
+    def _revisar(self, agora):
+        limites = resolver_limites_io(carregar_configuracao())
+        if limites["nome"] != self.perfil:
+            logging.info(f"Perfil de E/S: {limites['nome'] or 'padrão'} ({limites['limite_vazao_mb'] or 'sem limite de'} MB/s, "
+                         f"{limites['limite_arquivos_por_segundo'] or 'sem limite de'} arquivos/s"
+                         f"{', adaptativo' if limites['vazao_adaptativa'] else ''})")
+            self.perfil = limites["nome"]
+            self.taxa_adaptativa = None
+        self.limite_bytes = limites["limite_vazao_mb"] * 1024 * 1024 if limites["limite_vazao_mb"] else None
+        self.limite_arquivos = limites["limite_arquivos_por_segundo"] or None
+        self.adaptativo = bool(limites["vazao_adaptativa"])
+        self.latencia_alvo = limites["latencia_alvo_ms"] / 1000
+        vazao = self.bytes_janela / max(agora - self.inicio_janela, 1e-6)
+        if not self.adaptativo:
+            self.taxa_adaptativa = self.latencia_media = None
+        elif not self.bytes_janela or self.latencia_media is None:
+            pass  # Sem leituras no último segundo: nada a medir
+        elif self.latencia_media > self.latencia_alvo:
+            base = self.taxa_adaptativa or max(vazao, VAZAO_MINIMA_ADAPTATIVA)
+            self.taxa_adaptativa = max(VAZAO_MINIMA_ADAPTATIVA, base * FATOR_RECUO_ADAPTATIVO)
+        elif self.taxa_adaptativa is not None:
+            self.taxa_adaptativa *= FATOR_AUMENTO_ADAPTATIVO
+            # Sem limite fixo, a taxa é liberada quando deixa de ser o gargalo
+            if (self.limite_bytes and self.taxa_adaptativa >= self.limite_bytes) or \
+                    (not self.limite_bytes and self.taxa_adaptativa > 2 * vazao):
+                self.taxa_adaptativa = None
+        self.bytes_janela = 0
+        self.inicio_janela = agora
+        self.ativo = bool(self.limite_bytes or self.limite_arquivos or self.adaptativo)
+        self.proxima_revisao = agora + INTERVALO_REVISAO_IO
+
+    def _retirar(self, balde, quantidade, taxa, agora):
+        # Capacidade de um segundo de taxa; o saldo pode ficar negativo e quem vem depois espera a dívida
+        fichas, ultimo = self.baldes[balde]
+        fichas = min(taxa, fichas + (agora - ultimo) * taxa) - quantidade
+        self.baldes[balde] = [fichas, agora]
+        return -fichas / taxa if fichas < 0 else 0.0
+
+    def _aguardar(self, espera):
+        if espera > 0:
+            with self.lock:
+                self.espera_total += espera
+            time.sleep(espera)
+
+    def trecho(self, padrao):
+        # Tamanho de cada leitura/cópia: trechos pequenos mantêm o limite suave e a latência comparável
+        return min(padrao, TRECHO_LIMITADO) if self.ativo else padrao
+
+    def consumir(self, quantidade, duracao=None):
+        agora = time.monotonic()
+        with self.lock:
+            if agora >= self.proxima_revisao:
+                self._revisar(agora)
+            if not self.ativo:
+                return
+            self.bytes_janela += quantidade
+            if duracao is not None and self.adaptativo:
+                self.latencia_media = duracao if self.latencia_media is None else 0.8 * self.latencia_media + 0.2 * duracao
+            taxas = [taxa for taxa in (self.limite_bytes, self.taxa_adaptativa) if taxa]
+            espera = self._retirar("bytes", quantidade, min(taxas), agora) if taxas and quantidade else 0.0
+        self._aguardar(espera)
+
+    def aguardar_arquivo(self):
+        agora = time.monotonic()
+        with self.lock:
+            if agora >= self.proxima_revisao:
+                self._revisar(agora)
+            if not self.limite_arquivos:
+                return
+            espera = self._retirar("arquivos", 1, self.limite_arquivos, agora)
+        self._aguardar(espera)
+
+    def ler(self, arquivo, tamanho):
+        # arquivo.read() cronometrado (latência da origem) e descontado do balde de bytes
+        inicio = time.perf_counter()
+        bloco = arquivo.read(tamanho)
+        self.consumir(len(bloco), time.perf_counter() - inicio)
+        return bloco
+
+    def estado(self):
+        with self.lock:
+            return {"perfil": self.perfil, "limite_bytes": self.limite_bytes, "taxa_adaptativa": self.taxa_adaptativa,
+                    "limite_arquivos": self.limite_arquivos, "latencia_media": self.latencia_media,
+                    "espera_total": self.espera_total}
+
+limitador_io = LimitadorIO()
+
+class MetodoIndisponivel(Exception):
+    pass
+
+metodos_indisponiveis = {}  # (dispositivo de origem, dispositivo de destino) -> métodos que falharam
+_buffers_copia = local()
+
+def _clonar(src, dest, trechos, tamanho, hash_arquivo=None):
+    # FICLONE copia o arquivo inteiro (preservando buracos) ou nada
+    if fcntl is None:
+        raise MetodoIndisponivel()
+    fcntl.ioctl(dest, FICLONE, src)
+
+def _copiar_copy_file_range(src, dest, trechos, tamanho, hash_arquivo=None):
+    if not hasattr(os, "copy_file_range"):
+        raise MetodoIndisponivel()
+    for inicio, fim in trechos:
+        posicao = inicio
+        while posicao < fim:
+            inicio_chamada = time.perf_counter()
+            copiados = os.copy_file_range(src, dest, min(fim - posicao, limitador_io.trecho(TRECHO_COPIA_KERNEL)),
+                                          posicao, posicao)
+            if copiados == 0:
+                break  # Arquivo encolheu durante a cópia
+            limitador_io.consumir(copiados, time.perf_counter() - inicio_chamada)
+            posicao += copiados
+
+def _copiar_sendfile(src, dest, trechos, tamanho, hash_arquivo=None):
+    if not hasattr(os, "sendfile") or sys.platform == "win32":
+        raise MetodoIndisponivel()
+    for inicio, fim in trechos:
+        os.lseek(dest, inicio, os.SEEK_SET)
+        posicao = inicio
+        while posicao < fim:
+            inicio_chamada = time.perf_counter()
+            copiados = os.sendfile(dest, src, posicao, min(fim - posicao, limitador_io.trecho(TRECHO_COPIA_KERNEL)))
+            if copiados == 0:
+                break
+            limitador_io.consumir(copiados, time.perf_counter() - inicio_chamada)
+            posicao += copiados
+
+def _copiar_buffer(src, dest, trechos, tamanho, hash_arquivo=None):
+    # Último recurso, disponível em qualquer sistema: um buffer grande reaproveitado por thread,
+    # com o espaço pré-alocado para reduzir a fragmentação. Também é o único que passa os dados
+    # pelo processo, então calcula o hash na mesma leitura da cópia.
+    if trechos == [(0, tamanho)] and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(dest, 0, tamanho)
+        except OSError:
+            pass
+    buffer = getattr(_buffers_copia, "buffer", None)
+    if buffer is None:
+        buffer = _buffers_copia.buffer = bytearray(TAMANHO_BUFFER_COPIA)
+    visao = memoryview(buffer)
+    fim_anterior = 0
+    with open(src, "rb", buffering=0, closefd=False) as origem_f, open(dest, "wb", buffering=0, closefd=False) as dest_f:
+        for inicio, fim in trechos:
+            if hash_arquivo is not None:
+                atualizar_hash_zeros(hash_arquivo, inicio - fim_anterior)  # Buraco de arquivo esparso
+            origem_f.seek(inicio)
+            dest_f.seek(inicio)
+            posicao = inicio
+            while posicao < fim:
+                inicio_leitura = time.perf_counter()
+                lidos = origem_f.readinto(visao[:min(fim - posicao, limitador_io.trecho(len(buffer)))])
+                if not lidos:
+                    break
+                limitador_io.consumir(lidos, time.perf_counter() - inicio_leitura)
+                if hash_arquivo is not None:
+                    hash_arquivo.update(visao[:lidos])
+                dest_f.write(visao[:lidos])
+                posicao += lidos
+            fim_anterior = posicao
+    if hash_arquivo is not None:
+        atualizar_hash_zeros(hash_arquivo, tamanho - fim_anterior)
+
+def novo_hash_arquivo():
+    return hashlib.blake2b(digest_size=TAMANHO_HASH_ARQUIVO)
+
+_ZEROS = bytes(BLOCO_VERIFICACAO)
+
+def atualizar_hash_zeros(hash_arquivo, quantidade):
+    while quantidade > 0:
+        parte = min(quantidade, len(_ZEROS))
+        hash_arquivo.update(_ZEROS[:parte])
+        quantidade -= parte
+
+COPIADORES = {"clone": _clonar, "copy_file_range": _copiar_copy_file_range, "sendfile": _copiar_sendfile,
+              "buffer": _copiar_buffer}
+
+def trechos_com_dados(fd, tamanho, st):
+    # Arquivos esparsos: só os trechos com dados são copiados; os buracos são recriados pelo truncate
+    if not hasattr(os, "SEEK_DATA") or getattr(st, "st_blocks", tamanho) * 512 >= tamanho:
+        return [(0, tamanho)]
+    trechos = []
+    posicao = 0
+    try:
+        while posicao < tamanho:
+            inicio = os.lseek(fd, posicao, os.SEEK_DATA)
+            fim = min(os.lseek(fd, inicio, os.SEEK_HOLE), tamanho)
+            trechos.append((inicio, fim))
+            posicao = fim
+    except OSError as e:
+        if e.errno != errno.ENXIO:  # ENXIO: não há mais dados até o fim do arquivo
+            return [(0, tamanho)]
+    return trechos
+
+def copiar_arquivo(src_path, dest_path, metodo=None, hash_arquivo=None):
+    # Copia o conteúdo com o método mais rápido disponível, caindo para o próximo quando o sistema de
+    # arquivos ou o kernel não suportam um deles; a falha é lembrada por par de dispositivos.
+    # Com hash_arquivo no modo auto, o clone copy-on-write (que não move dados) é tentado primeiro e o hash
+    # vem de uma releitura da cópia; sem clone, o buffer calcula o hash na mesma leitura da cópia, o que
+    # custa menos que copy_file_range/sendfile seguidos de uma releitura. Um método fixo em "metodo_copia"
+    # é sempre respeitado, com a releitura da cópia quando não é o buffer.
+    # Retorna o nome do método usado. Metadados (mtime, permissões) ficam a cargo de quem chama.
+    metodo = resolver_metodo_copia(metodo)
+    metodos = METODOS_COPIA if metodo == "auto" else [metodo]
+    if hash_arquivo is not None and metodo == "auto":
+        metodos = ["clone", "buffer"]
+    with open(src_path, "rb") as src, open(dest_path, "wb") as dest:
+        st = os.fstat(src.fileno())
+        chave = (st.st_dev, os.fstat(dest.fileno()).st_dev)
+        indisponiveis = metodos_indisponiveis.setdefault(chave, set())
+        if st.st_size == 0:
+            return "vazio"
+        trechos = trechos_com_dados(src.fileno(), st.st_size, st)
+        for nome in metodos:
+            if nome in indisponiveis and nome != metodos[-1]:
+                continue
+            try:
+                COPIADORES[nome](src.fileno(), dest.fileno(), trechos, st.st_size, hash_arquivo)
+            except MetodoIndisponivel:
+                indisponiveis.add(nome)
+                continue
+            except OSError as e:
+                if e.errno not in ERROS_METODO_INDISPONIVEL or nome == metodos[-1]:
+                    raise
+                logging.debug(f"Método de cópia '{nome}' indisponível para '{src_path}': {e}")
+                indisponiveis.add(nome)
+                dest.truncate(0)  # Recomeça do zero com o próximo método
+                continue
+            if trechos != [(0, st.st_size)]:
+                dest.truncate(st.st_size)  # Buraco final de arquivos esparsos
+            if hash_arquivo is not None and nome != "buffer":
+                dest.flush()
+                hash_de_arquivo(dest_path, hash_arquivo)  # A própria cópia: o hash descreve o que foi gravado
+            return nome
+    raise OSError(errno.ENOTSUP, f"Nenhum método de cópia disponível para '{src_path}'")
+
+def copiar_item(src_path, dest_path, hash_arquivo=None, metodo=None):
+    # Grava em um temporário e troca com os.replace: uma interrupção nunca deixa um arquivo truncado
+    # com o nome definitivo (e o mtime da origem só aparece quando a cópia está completa)
+    temp_path = caminho_temporario(dest_path)
+    try:
+        copiar_arquivo(src_path, temp_path, metodo, hash_arquivo)
+        shutil.copystat(src_path, temp_path)
+        os.replace(temp_path, dest_path)
+        logging.info(f"Arquivo copiado: {src_path}")
+        return True
+    except FileNotFoundError as e:
+        logging.warning(f"Arquivo não encontrado '{src_path}': {e}. Ignorando...")
+    except PermissionError as e:
+        logging.warning(f"Erro de permissão ao acessar '{src_path}': {e}. Ignorando...")
+    except Exception as e:
+        logging.error(f"Erro inesperado ao copiar '{src_path}': {e}")
+    remover_temporario(temp_path)
+    return False
+
+def remover_temporario(temp_path):
+    try:
+        os.remove(temp_path)
+    except OSError:
+        pass
+
+def resolver_limite_delta():
+    return carregar_configuracao().get("limite_delta", LIMITE_DELTA)
+
+def resolver_metodo_copia(metodo=None):
+    # Resolvido uma vez por execução e repassado a cada cópia: reler a configuração por arquivo custa
+    # mais que a própria cópia de um arquivo pequeno
+    return metodo or carregar_configuracao().get("metodo_copia", "auto")
+
+def clonar_arquivo(base_path, dest_path):
+    # Clone copy-on-write (Btrfs/XFS): a nova cópia compartilha os blocos da anterior sem reler nada
+    if fcntl is None:
+        return False
+    try:
+        with open(base_path, "rb") as base, open(dest_path, "wb") as dest:
+            fcntl.ioctl(dest.fileno(), FICLONE, base.fileno())
+        return True
+    except OSError as e:
+        logging.debug(f"Clonagem indisponível para '{base_path}': {e}")
+        return False
+
+def copiar_delta(src_path, dest_path, base_path=None, hash_arquivo=None):
+    # Atualiza a cópia gravando só os blocos cujas assinaturas mudaram desde a execução anterior.
+    # A base é a própria cópia no destino (espelho) ou, em snapshots, um clone da cópia do snapshot
+    # anterior; sem base válida o arquivo é copiado por inteiro, já gerando as assinaturas.
+    # Só o espelho é atualizado no lugar (o mtime antigo faz a próxima execução refazê-lo se algo falhar);
+    # nos demais casos a cópia é montada em um temporário e trocada com os.replace no fim.
+    base_path = base_path if base_path and base_path != dest_path else None
+    temp_path = None
+    try:
+        assinaturas_base = obter_assinaturas(base_path or dest_path)
+        alvo = dest_path if assinaturas_base and not base_path else caminho_temporario(dest_path)
+        temp_path = alvo if alvo != dest_path else None
+        if assinaturas_base and base_path and not clonar_arquivo(base_path, alvo):
+            assinaturas_base = None
+        novas_assinaturas = bytearray()
+        bytes_gravados = 0
+        with open(src_path, "rb") as src, open(alvo, "r+b" if assinaturas_base else "wb") as dest:
+            posicao = 0
+            for bloco in iter(lambda: limitador_io.ler(src, BLOCO_DELTA), b""):
+                if hash_arquivo is not None:
+                    hash_arquivo.update(bloco)
+                assinatura = hashlib.blake2b(bloco, digest_size=TAMANHO_ASSINATURA).digest()
+                inicio = len(novas_assinaturas)
+                novas_assinaturas += assinatura
+                if not assinaturas_base or assinaturas_base[inicio:inicio + TAMANHO_ASSINATURA] != assinatura:
+                    dest.seek(posicao)
+                    dest.write(bloco)
+                    bytes_gravados += len(bloco)
+                posicao += len(bloco)
+            dest.truncate(posicao)
+        shutil.copystat(src_path, alvo)
+        if temp_path:
+            os.replace(temp_path, dest_path)
+            temp_path = None
+        salvar_assinaturas(dest_path, bytes(novas_assinaturas))
+        logging.info(f"Arquivo copiado (delta): {src_path} - {bytes_gravados / (1024 * 1024):.2f} MB gravados de {posicao / (1024 * 1024):.2f} MB")
+        return True
+    except FileNotFoundError as e:
+        logging.warning(f"Arquivo não encontrado '{src_path}': {e}. Ignorando...")
+    except PermissionError as e:
+        logging.warning(f"Erro de permissão ao acessar '{src_path}': {e}. Ignorando...")
+    except Exception as e:
+        logging.error(f"Erro inesperado ao copiar '{src_path}': {e}")
+    if temp_path:
+        remover_temporario(temp_path)
+    return False
+
+class PipelineCopia:
+    # O produtor (varredura) alimenta duas filas limitadas: arquivos pequenos e grandes têm workers
+    # próprios, para que um arquivo enorme não segure milhares de arquivos pequenos atrás dele.
+    # Com com_hash, processar() retorna (ação, hash) e as entradas salvas são pares (entrada, hash);
+    # salvas pode ser uma ListaEmDisco quando a árvore é grande demais para uma lista. processar() reserva
+    # no vigia os bytes que vai gravar e retorna ACAO_IGNORADO se não houver espaço; o pipeline só
+    # consulta o vigia para drenar a fila depois que a execução parou.
+    def __init__(self, processar, total_items, progress_callback, workers=WORKERS_COPIA_PADRAO,
+                 limite_grande=LIMITE_ARQUIVO_GRANDE, tamanho_fila=TAMANHO_FILA_COPIA, bytes_totais=None, vigia=None,
+                 metricas=None, com_hash=False, salvas=None):
+        self.processar = processar
+        self.com_hash = com_hash
+        self.total_items = total_items
+        self.bytes_totais = bytes_totais
+        self.vigia = vigia
+        self.metricas = metricas
+        self.progress_callback = progress_callback
+        self.limite_grande = limite_grande
+        self.fila_pequenos = queue.Queue(maxsize=tamanho_fila)
+        self.fila_grandes = queue.Queue(maxsize=tamanho_fila)
+        self.lock = Lock()
+        self.items_processados = 0
+        self.bytes_processados = 0
+        self.entradas_salvas = [] if salvas is None else salvas
+        workers = max(1, workers)
+        self.threads_pequenos = [Thread(target=self._worker, args=(self.fila_pequenos,), daemon=True)
+                                 for _ in range(workers)]
+        self.threads_grandes = [Thread(target=self._worker, args=(self.fila_grandes,), daemon=True)
+                                for _ in range(max(1, workers // 4))]
+
+    def iniciar(self):
+        for thread in self.threads_pequenos + self.threads_grandes:
+            thread.start()
+        return self
+
+    def enviar(self, entrada, dest_path):
+        fila = self.fila_grandes if entrada.tamanho >= self.limite_grande else self.fila_pequenos
+        fila.put((entrada, dest_path))
+
+    def concluir(self):
+        # Um sentinela por worker encerra as threads depois que as filas esvaziam
+        for _ in self.threads_pequenos:
+            self.fila_pequenos.put(None)
+        for _ in self.threads_grandes:
+            self.fila_grandes.put(None)
+        for thread in self.threads_pequenos + self.threads_grandes:
+            thread.join()
+        return self.entradas_salvas
+
+    def _worker(self, fila):
+        while True:
+            tarefa = fila.get()
+            if tarefa is None:
+                break
+            entrada, dest_path = tarefa
+            hash_arquivo = None
+            cronometrar = self.metricas is not None and self.metricas.detalhado
+            if cronometrar:
+                inicio = time.perf_counter()
+            try:
+                if self.vigia and self.vigia.parado:
+                    acao = ACAO_IGNORADO  # Execução interrompida por falta de espaço: só drena a fila
+                    sucesso = False
+                else:
+                    limitador_io.aguardar_arquivo()
+                    if self.com_hash:
+                        acao, hash_arquivo = self.processar(entrada, dest_path)
+                    else:
+                        acao = self.processar(entrada, dest_path)
+                    acao = acao or ACAO_ERRO
+                    sucesso = acao not in (ACAO_ERRO, ACAO_IGNORADO)
+            except Exception as e:
+                logging.error(f"Erro inesperado ao copiar '{entrada.caminho}': {e}")
+                acao = ACAO_ERRO
+                sucesso = False
+            if self.metricas:
+                self.metricas.registrar(entrada, acao, time.perf_counter() - inicio if cronometrar else None)
+            with self.lock:
+                if sucesso:
+                    self.entradas_salvas.append((entrada, hash_arquivo) if self.com_hash else entrada)
+                self.items_processados += 1
+                self.bytes_processados += entrada.tamanho
+                self.progress_callback((self.items_processados / self.total_items) * 100,
+                                       self.bytes_processados, self.bytes_totais)
+
+class MetricasExecucao:
+    # Contadores da execução e diário por arquivo; o diário é gravado em lotes (executemany)
+    # dentro de uma transação, nunca uma linha por vez
+    def __init__(self, execucao_id=None, tamanho_lote=TAMANHO_LOTE_DIARIO, detalhado=None):
+        self.execucao_id = execucao_id
+        self.tamanho_lote = tamanho_lote
+        self.detalhado = carregar_configuracao().get("metricas_detalhadas", False) if detalhado is None else detalhado
+        self.lock = Lock()
+        self.inicio = time.monotonic()
+        self.arquivos_escaneados = 0
+        self.arquivos_copiados = 0
+        self.bytes_copiados = 0
+        self.erros = 0
+        self.ignorados = 0
+        self.pendentes = []
+        self.fases = {}
+        # Por faixa de tamanho: contagem por bucket de latência (o último é o +Inf), soma e total
+        self.histogramas = {rotulo: {"buckets": [0] * (len(LIMITES_LATENCIA) + 1), "soma": 0.0, "total": 0}
+                            for _, rotulo in FAIXAS_TAMANHO}
+        self.lentos = []  # Heap mínimo de (duração, caminho) com os TOP_LENTOS mais lentos
+        self.tempo_pastas = {}
+        self.anotacoes = {}  # Informações livres da execução (ex.: tipo de varredura)
+        self.tarefas = []  # Threads da execução que rodam em paralelo com a cópia (ex.: remoção da retenção)
+
+    @contextmanager
+    def fase(self, nome):
+        # Fases do backup (varredura, espaço, retenção, cópia...), sempre medidas: poucas por execução.
+        # Podem ser medidas em outra thread; fases paralelas se sobrepõem no tempo total.
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.fases[nome] = self.fases.get(nome, 0.0) + time.perf_counter() - inicio
+
+    def acompanhar(self, thread):
+        # concluir() espera a thread, para que o tempo que ela registra entre na telemetria
+        self.tarefas.append(thread)
+
+    def _registrar_latencia(self, entrada, duracao):
+        # Chamado com o lock: histograma da faixa de tamanho, arquivos e pastas mais lentos
+        rotulo = next(rotulo for limite, rotulo in FAIXAS_TAMANHO if entrada.tamanho < limite)
+        histograma = self.histogramas[rotulo]
+        histograma["buckets"][bisect.bisect_left(LIMITES_LATENCIA, duracao)] += 1
+        histograma["soma"] += duracao
+        histograma["total"] += 1
+        if len(self.lentos) < TOP_LENTOS:
+            heapq.heappush(self.lentos, (duracao, entrada.rel_path))
+        elif duracao > self.lentos[0][0]:
+            heapq.heapreplace(self.lentos, (duracao, entrada.rel_path))
+        pasta = os.path.dirname(entrada.rel_path)
+        self.tempo_pastas[pasta] = self.tempo_pastas.get(pasta, 0.0) + duracao
+
+    def registrar(self, entrada, acao, duracao=None):
+        lote = None
+        with self.lock:
+            if acao in ACOES_COM_ESCRITA:
+                self.arquivos_copiados += 1
+                self.bytes_copiados += entrada.tamanho
+            elif acao == ACAO_ERRO:
+                self.erros += 1
+            elif acao == ACAO_IGNORADO:
+                self.ignorados += 1
+            if duracao is not None:
+                self._registrar_latencia(entrada, duracao)
+            if self.execucao_id is not None:
+                self.pendentes.append((self.execucao_id, entrada.rel_path, acao, entrada.tamanho))
+                if len(self.pendentes) >= self.tamanho_lote:
+                    lote, self.pendentes = self.pendentes, []
+        if lote:
+            gravar_diario(lote)
+
+    def concluir(self):
+        for thread in self.tarefas:
+            thread.join()
+        with self.lock:
+            lote, self.pendentes = self.pendentes, []
+        if lote:
+            gravar_diario(lote)
+        duracao = time.monotonic() - self.inicio
+        return {
+            "arquivos_escaneados": self.arquivos_escaneados,
+            "arquivos_copiados": self.arquivos_copiados,
+            "bytes_copiados": self.bytes_copiados,
+            "duracao": duracao,
+            "vazao": self.bytes_copiados / duracao if duracao > 0 else 0,
+            "erros": self.erros,
+            "telemetria": self.telemetria(),
+        }
+
+    def telemetria(self):
+        with self.lock:
+            dados = {"fases": dict(self.fases), "erros": self.erros, "ignorados": self.ignorados, **self.anotacoes}
+            if self.detalhado:
+                dados["limites_latencia"] = LIMITES_LATENCIA
+                dados["histogramas"] = {rotulo: dict(histograma, buckets=list(histograma["buckets"]))
+                                        for rotulo, histograma in self.histogramas.items() if histograma["total"]}
+                dados["arquivos_lentos"] = [{"caminho": caminho, "duracao": duracao}
+                                            for duracao, caminho in sorted(self.lentos, reverse=True)]
+                dados["pastas_lentas"] = [{"caminho": pasta or ".", "duracao": duracao} for pasta, duracao in
+                                          heapq.nlargest(TOP_LENTOS, self.tempo_pastas.items(), key=lambda item: item[1])]
+        return dados
+
+def gravar_arquivo_atomico(caminho, conteudo):
+    # Leitores (ex.: textfile collector do node_exporter) nunca veem um arquivo pela metade
+    temp_path = caminho + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(conteudo)
+    os.replace(temp_path, caminho)
+
+def escapar_rotulo(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def formatar_prometheus(resultado, origem, destino, status):
+    def rotulos(**extras):
+        pares = dict(origem=origem, destino=destino, **extras)
+        return "{" + ",".join(f'{chave}="{escapar_rotulo(valor)}"' for chave, valor in pares.items()) + "}"
+
+    telemetria = resultado.get("telemetria") or {}
+    linhas = [
+        "# TYPE easybackup_ultima_execucao_timestamp_seconds gauge",
+        f"easybackup_ultima_execucao_timestamp_seconds{rotulos()} {time.time():.0f}",
+        "# TYPE easybackup_ultima_execucao_sucesso gauge",
+        f"easybackup_ultima_execucao_sucesso{rotulos()} {int(status.startswith('Sucesso'))}",
+    ]
+    for metrica, chave in (("arquivos_escaneados", "arquivos_escaneados"), ("arquivos_copiados", "arquivos_copiados"),
+                           ("bytes_copiados", "bytes_copiados"), ("duracao_segundos", "duracao"),
+                           ("erros", "erros")):
+        linhas.append(f"# TYPE easybackup_{metrica} gauge")
+        linhas.append(f"easybackup_{metrica}{rotulos()} {resultado.get(chave) or 0}")
+    linhas.append("# TYPE easybackup_fase_duracao_segundos gauge")
+    for fase, duracao in telemetria.get("fases", {}).items():
+        linhas.append(f"easybackup_fase_duracao_segundos{rotulos(fase=fase)} {duracao:.6f}")
+    if telemetria.get("histogramas"):
+        linhas.append("# TYPE easybackup_latencia_arquivo_segundos histogram")
+        for faixa, histograma in telemetria["histogramas"].items():
+            acumulado = 0
+            for limite, quantidade in zip(telemetria["limites_latencia"] + ["+Inf"], histograma["buckets"]):
+                acumulado += quantidade
+                linhas.append(f"easybackup_latencia_arquivo_segundos_bucket{rotulos(faixa=faixa, le=limite)} {acumulado}")
+            linhas.append(f"easybackup_latencia_arquivo_segundos_sum{rotulos(faixa=faixa)} {histograma['soma']:.6f}")
+            linhas.append(f"easybackup_latencia_arquivo_segundos_count{rotulos(faixa=faixa)} {histograma['total']}")
+    if telemetria.get("filtros"):
+        for metrica in ("arquivos", "bytes", "pastas"):
+            linhas.append(f"# TYPE easybackup_filtro_excluidos_{metrica} gauge")
+            for regra, estatistica in telemetria["filtros"].items():
+                linhas.append(f"easybackup_filtro_excluidos_{metrica}{rotulos(regra=regra)} {estatistica[metrica]}")
+    return "\n".join(linhas) + "\n"
+
+def exportar_metricas(resultado, origem, destino, status, config=None):
+    # Destinos opcionais na configuração: "exportar_metricas_json" e "exportar_metricas_prometheus"
+    config = carregar_configuracao() if config is None else config
+    try:
+        if config.get("exportar_metricas_json"):
+            gravar_arquivo_atomico(config["exportar_metricas_json"], json.dumps(
+                {"origem": origem, "destino": destino, "status": status, **resultado}, ensure_ascii=False, indent=2))
+        if config.get("exportar_metricas_prometheus"):
+            gravar_arquivo_atomico(config["exportar_metricas_prometheus"],
+                                   formatar_prometheus(resultado, origem, destino, status))
+    except OSError as e:
+        logging.warning(f"Não foi possível exportar as métricas: {e}")
+
+class CanalEventos:
+    # Fila thread-safe entre o motor e a interface: o motor publica sem bloquear e a interface
+    # drena no próprio ritmo (root.after), juntando as atualizações de progresso pendentes
+    def __init__(self):
+        self.fila = queue.SimpleQueue()
+
+    def progresso(self, progresso, bytes_processados=None, bytes_totais=None):
+        self.fila.put(("progresso", (progresso, bytes_processados, bytes_totais)))
+
+    def log(self, texto):
+        self.fila.put(("log", texto))
+
+    def historico(self, texto):
+        self.fila.put(("historico", texto))
+
+    def drenar(self):
+        # Só o último progresso importa; logs e histórico são acumulados na ordem
+        ultimo_progresso = None
+        logs = []
+        historicos = []
+        while True:
+            try:
+                tipo, dados = self.fila.get_nowait()
+            except queue.Empty:
+                break
+            if tipo == "progresso":
+                ultimo_progresso = dados
+            elif tipo == "log":
+                logs.append(dados)
+            else:
+                historicos.append(dados)
+        return ultimo_progresso, logs, historicos
+
+class MedidorVazao:
+    # Vazão em janela deslizante e ETA a partir das amostras de bytes processados
+    def __init__(self, janela_segundos=5):
+        self.janela_segundos = janela_segundos
+        self.amostras = deque()
+
+    def reiniciar(self):
+        self.amostras.clear()
+
+    def registrar(self, bytes_processados, bytes_totais):
+        agora = time.monotonic()
+        self.amostras.append((agora, bytes_processados))
+        while len(self.amostras) > 2 and agora - self.amostras[0][0] > self.janela_segundos:
+            self.amostras.popleft()
+        inicio, bytes_inicio = self.amostras[0]
+        if agora - inicio <= 0:
+            return None, None
+        vazao = (bytes_processados - bytes_inicio) / (agora - inicio)
+        eta = (bytes_totais - bytes_processados) / vazao if vazao > 0 and bytes_totais else None
+        return vazao, eta
+
+def formatar_bytes(valor):
+    for unidade in ("B", "KB", "MB", "GB"):
+        if abs(valor) < 1024:
+            return f"{valor:.1f} {unidade}"
+        valor /= 1024
+    return f"{valor:.1f} TB"
+
+def resolver_workers_copia(workers=None):
+    if workers is None:
+        workers = carregar_configuracao().get("workers_copia", WORKERS_COPIA_PADRAO)
+    return max(1, int(workers))
+
+def executar_pipeline_copia(entradas, destino, processar, progress_callback, workers=None, vigia=None, metricas=None,
+                            limite_pacote=None, com_hash=False, salvas=None):
+    # Com limite_pacote, arquivos menores chegam a processar() com dest_path None (vão para um pacote)
+    pipeline = PipelineCopia(processar, len(entradas), progress_callback, resolver_workers_copia(workers),
+                             bytes_totais=sum(entrada.tamanho for entrada in entradas), vigia=vigia,
+                             metricas=metricas, com_hash=com_hash, salvas=salvas).iniciar()
+    diretorios_criados = set()
+    for entrada in entradas:
+        if limite_pacote and entrada.tamanho < limite_pacote:
+            pipeline.enviar(entrada, None)
+            continue
+        dest_path = os.path.join(destino, entrada.rel_path)
+        criar_diretorio_destino(dest_path, diretorios_criados)  # Pastas criadas só pelo produtor
+        pipeline.enviar(entrada, dest_path)
+    return pipeline.concluir()
+
+# Pacotes de arquivos pequenos (modos em pasta). Em SMB/NTFS o custo de milhões de arquivos pequenos está em
+# criar arquivos e entradas de pasta, não nos bytes: abaixo de "limite_pacote_kb" os arquivos são acrescentados
+# a pacotes grandes em .pacotes/, com um índice compacto ordenado pelo caminho. Os maiores seguem como cópias soltas.
+RegistroPacote = namedtuple("RegistroPacote", ["rel_path", "pacote", "deslocamento", "tamanho", "mtime", "hash"])
+
+def resolver_limite_pacote(config=None):
+    # None com o empacotamento desligado (padrão): todo arquivo vira uma cópia solta
+    config = config or carregar_configuracao()
+    if not config.get("empacotar_pequenos", False):
+        return None
+    return int(config.get("limite_pacote_kb", LIMITE_PACOTE // 1024) * 1024)
+
+def chave_pacote(rel_path):
+    # Caminho no índice: UTF-8 com "/", a mesma ordem em qualquer sistema
+    return rel_path.replace(os.sep, "/").encode("utf-8", "surrogateescape")
+
+class IndicePacotes:
+    # Leitura por mmap: obter() faz busca binária nos registros de tamanho fixo sem carregar o índice
+    # (extração de um arquivo = uma busca e uma leitura posicional); listar() percorre os registros em ordem.
+    def __init__(self, pasta):
+        import mmap
+        self.pasta = os.path.join(pasta, PASTA_PACOTES)
+        with open(os.path.join(self.pasta, ARQUIVO_INDICE_PACOTES), "rb") as f:
+            self.dados = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magico, versao, total_pacotes, self.total, self.inicio_caminhos = CABECALHO_INDICE_PACOTES.unpack_from(self.dados)
+        if magico != MAGICO_INDICE_PACOTES or versao != VERSAO_INDICE_PACOTES:
+            self.dados.close()
+            raise ValueError(f"Índice de pacotes inválido em '{self.pasta}'.")
+        posicao = CABECALHO_INDICE_PACOTES.size
+        self.pacotes = []
+        for _ in range(total_pacotes):
+            (tamanho,) = struct.unpack_from("<H", self.dados, posicao)
+            self.pacotes.append(self.dados[posicao + 2:posicao + 2 + tamanho].decode("utf-8"))
+            posicao += 2 + tamanho
+        self.inicio_registros = posicao
+        self.lock = Lock()
+        self.descritores = {}
+        self.local = local()  # Última posição encontrada por thread (ponto de partida da próxima busca)
+
+    @classmethod
+    def abrir(cls, pasta):
+        # None se a pasta não tem pacotes (empacotamento desligado ou snapshot anterior ao recurso)
+        try:
+            return cls(pasta)
+        except FileNotFoundError:
+            return None
+
+    def __len__(self):
+        return self.total
+
+    def _chave(self, indice):
+        deslocamento, tamanho = struct.unpack_from("<QH", self.dados, self.inicio_registros + indice * REGISTRO_INDICE_PACOTES.size)
+        inicio = self.inicio_caminhos + deslocamento
+        return self.dados[inicio:inicio + tamanho]
+
+    def _registro(self, indice):
+        _, _, pacote, deslocamento, tamanho, mtime, hash_bytes = REGISTRO_INDICE_PACOTES.unpack_from(
+            self.dados, self.inicio_registros + indice * REGISTRO_INDICE_PACOTES.size)
+        rel_path = self._chave(indice).decode("utf-8", "surrogateescape").replace("/", os.sep)
+        return RegistroPacote(rel_path, self.pacotes[pacote], deslocamento, tamanho, mtime,
+                              hash_bytes.hex() if any(hash_bytes) else None)
+
+    def obter(self, rel_path):
+        # Consultas na ordem da varredura caem perto da anterior: busca exponencial a partir da última
+        # posição da thread (duas ou três comparações) antes da busca binária no intervalo encontrado
+        chave = chave_pacote(rel_path)
+        baixo, alto = 0, self.total
+        posicao = getattr(self.local, "posicao", 0)
+        passo = 1
+        if posicao < self.total and self._chave(posicao) < chave:
+            baixo = posicao + 1
+            while baixo < alto:
+                sonda = baixo + passo - 1
+                if sonda >= alto:
+                    break
+                if self._chave(sonda) < chave:
+                    baixo = sonda + 1
+                    passo *= 2
+                else:
+                    alto = sonda
+                    break
+        elif posicao < self.total:
+            alto = posicao
+            while baixo < alto:
+                sonda = alto - passo
+                if sonda < baixo:
+                    break
+                if self._chave(sonda) >= chave:
+                    alto = sonda
+                    passo *= 2
+                else:
+                    baixo = sonda + 1
+                    break
+        while baixo < alto:
+            meio = (baixo + alto) // 2
+            if self._chave(meio) < chave:
+                baixo = meio + 1
+            else:
+                alto = meio
+        self.local.posicao = baixo
+        return self._registro(baixo) if baixo < self.total and self._chave(baixo) == chave else None
+
+    def listar(self):
+        for indice in range(self.total):
+            yield self._registro(indice)
+
+    def ler(self, registro):
+        # Leitura posicional: com os.pread um descritor por pacote é compartilhado entre as threads
+        caminho = os.path.join(self.pasta, registro.pacote)
+        if hasattr(os, "pread"):
+            with self.lock:
+                fd = self.descritores.get(registro.pacote)
+                if fd is None:
+                    fd = self.descritores[registro.pacote] = os.open(caminho, os.O_RDONLY)
+            dados = os.pread(fd, registro.tamanho, registro.deslocamento)
+        else:
+            with open(caminho, "rb") as f:
+                f.seek(registro.deslocamento)
+                dados = f.read(registro.tamanho)
+        if len(dados) != registro.tamanho:
+            raise EOFError(f"Pacote truncado: '{registro.rel_path}' em {registro.pacote}")
+        return dados
+
+    def fechar(self):
+        with self.lock:
+            for fd in self.descritores.values():
+                os.close(fd)
+            self.descritores.clear()
+        self.dados.close()
+
+class EscritorPacotes:
+    # Cada worker acrescenta ao seu próprio pacote (nenhum lock durante a escrita). Os pacotes têm nomes
+    # únicos por execução e o índice só é gravado em concluir(), com os.replace, depois de fechados: até lá
+    # o índice anterior (ex.: no espelho do backup completo) continua válido. Pacotes fora do novo índice
+    # (da execução anterior ou de uma interrompida) são removidos no fim.
+    def __init__(self, pasta, tamanho_pacote=None):
+        self.pasta = os.path.join(pasta, PASTA_PACOTES)
+        os.makedirs(self.pasta, exist_ok=True)
+        if tamanho_pacote is None:
+            tamanho_pacote = carregar_configuracao().get("tamanho_pacote_mb", TAMANHO_PACOTE // (1024 * 1024)) * 1024 * 1024
+        self.tamanho_pacote = tamanho_pacote
+        self.prefixo = f"pacote_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{os.getpid()}"
+        self.local = local()
+        self.lock = Lock()
+        self.sequencia = 0
+        self.abertos = []
+        self.registros = []
+
+    def _pacote_atual(self):
+        atual = getattr(self.local, "pacote", None)
+        if atual is None or atual[1].tell() >= self.tamanho_pacote:
+            if atual:
+                atual[1].close()
+            with self.lock:
+                self.sequencia += 1
+                nome = f"{self.prefixo}_{self.sequencia:05d}.dat"
+                atual = (nome, open(os.path.join(self.pasta, nome), "wb", buffering=TAMANHO_BUFFER_COPIA))
+                self.abertos.append(atual[1])
+            self.local.pacote = atual
+        return atual
+
+    def empacotar(self, entrada):
+        # Lê o arquivo inteiro (com o limite de E/S) e o acrescenta ao pacote da thread; retorna o hash,
+        # ou None se a origem não pôde ser lida
+        try:
+            with open(entrada.caminho, "rb") as f:
+                dados = limitador_io.ler(f, -1)
+        except FileNotFoundError as e:
+            logging.warning(f"Arquivo não encontrado '{entrada.caminho}': {e}. Ignorando...")
+            return None
+        except PermissionError as e:
+            logging.warning(f"Erro de permissão ao acessar '{entrada.caminho}': {e}. Ignorando...")
+            return None
+        hash_arquivo = novo_hash_arquivo()
+        hash_arquivo.update(dados)
+        nome, f = self._pacote_atual()
+        deslocamento = f.tell()
+        try:
+            f.write(dados)
+        except OSError:
+            self.local.pacote = None  # Pacote com uma escrita pela metade: os próximos vão para um novo
+            raise
+        self.registrar(RegistroPacote(entrada.rel_path, nome, deslocamento, len(dados), entrada.mtime, hash_arquivo.hexdigest()))
+        return hash_arquivo.hexdigest()
+
+    def registrar(self, registro):
+        with self.lock:
+            self.registros.append(registro)
+
+    def reaproveitar(self, indice_anterior, entradas):
+        # Pacotes do snapshot anterior entram no novo por hard-link, como os arquivos soltos, e levam os registros
+        # dos arquivos inalterados (mesmo tamanho e mtime). Um pacote com pouco dado vivo não é vinculado:
+        # seus arquivos são empacotados de novo e o espaço morto sai com a retenção. As entradas são lidas em
+        # fluxo (uma busca no índice por arquivo) e só os bytes vivos de cada pacote ficam na memória.
+        # Retorna os nomes dos pacotes vinculados; ver registro_reaproveitado.
+        vivos_por_pacote = {}
+        for entrada in entradas:
+            registro = indice_anterior.obter(entrada.rel_path)
+            if registro and registro.tamanho == entrada.tamanho and registro.mtime == entrada.mtime:
+                vivos_por_pacote[registro.pacote] = vivos_por_pacote.get(registro.pacote, 0) + registro.tamanho
+        vinculados = set()
+        for pacote, bytes_vivos in vivos_por_pacote.items():
+            origem = os.path.join(indice_anterior.pasta, pacote)
+            destino = os.path.join(self.pasta, pacote)
+            try:
+                vivos = bytes_vivos / max(1, os.path.getsize(origem))
+            except OSError:
+                continue
+            if vivos < APROVEITAMENTO_MINIMO_PACOTE:
+                logging.info(f"Pacote {pacote} com {vivos:.0%} de dados vivos: arquivos empacotados de novo.")
+                continue
+            if (os.path.exists(destino) and os.path.samefile(origem, destino)) or vincular_item(origem, destino):
+                vinculados.add(pacote)
+        return vinculados
+
+    @staticmethod
+    def registro_reaproveitado(indice_anterior, vinculados, entrada):
+        # Registro do arquivo num pacote vinculado por reaproveitar(), se ele não mudou; senão None
+        registro = indice_anterior.obter(entrada.rel_path)
+        if (registro and registro.pacote in vinculados and registro.tamanho == entrada.tamanho
+                and registro.mtime == entrada.mtime):
+            return registro
+        return None
+
+    def concluir(self):
+        for f in self.abertos:
+            f.close()
+        itens = sorted((chave_pacote(registro.rel_path), registro) for registro in self.registros)
+        pacotes = sorted({registro.pacote for _, registro in itens})
+        numeros = {nome: numero for numero, nome in enumerate(pacotes)}
+        nomes = b"".join(struct.pack("<H", len(nome.encode("utf-8"))) + nome.encode("utf-8") for nome in pacotes)
+        caminhos = bytearray()
+        registros = bytearray()
+        for chave, registro in itens:
+            registros += REGISTRO_INDICE_PACOTES.pack(len(caminhos), len(chave), numeros[registro.pacote], registro.deslocamento,
+                                                      registro.tamanho, registro.mtime,
+                                                      bytes.fromhex(registro.hash) if registro.hash else bytes(TAMANHO_HASH_ARQUIVO))
+            caminhos += chave
+        inicio_caminhos = CABECALHO_INDICE_PACOTES.size + len(nomes) + len(registros)
+        indice_path = os.path.join(self.pasta, ARQUIVO_INDICE_PACOTES)
+        temp_path = caminho_temporario(indice_path)
+        with open(temp_path, "wb") as f:
+            f.write(CABECALHO_INDICE_PACOTES.pack(MAGICO_INDICE_PACOTES, VERSAO_INDICE_PACOTES, len(pacotes), len(itens),
+                                                  inicio_caminhos))
+            f.write(nomes)
+            f.write(registros)
+            f.write(caminhos)
+        os.replace(temp_path, indice_path)
+        for nome in os.listdir(self.pasta):
+            if nome.endswith(".dat") and nome not in numeros:
+                try:
+                    os.remove(os.path.join(self.pasta, nome))
+                except OSError as e:
+                    logging.warning(f"Erro ao remover o pacote órfão '{nome}': {e}")
+        logging.info(f"{len(itens)} arquivo(s) pequeno(s) em {len(pacotes)} pacote(s) em '{self.pasta}'.")
+        return len(itens)
+
+# Repositório de chunks deduplicados
+_GERADOR_GEAR = random.Random(0x45425350)  # Semente fixa: os limites de chunk precisam ser estáveis entre execuções
+_GEAR = [_GERADOR_GEAR.getrandbits(64) for _ in range(256)]
+_MASCARA_64 = 0xFFFFFFFFFFFFFFFF
+# Máscaras nos bits altos (janela efetiva de 64 bytes); mais restritiva antes do tamanho médio
+_MASCARA_CURTA = ((1 << 22) - 1) << 42
+_MASCARA_LONGA = ((1 << 18) - 1) << 46
+
+def encontrar_corte(buffer, tamanho):
+    # Retorna o fim do próximo chunk dentro de buffer[:tamanho]
+    if tamanho <= CHUNK_MINIMO:
+        return tamanho
+    limite_medio = min(tamanho, CHUNK_MEDIO)
+    h = 0
+    posicao = CHUNK_MINIMO
+    for byte in buffer[CHUNK_MINIMO:limite_medio]:
+        h = ((h << 1) + _GEAR[byte]) & _MASCARA_64
+        posicao += 1
+        if not h & _MASCARA_CURTA:
+            return posicao
+    for byte in buffer[limite_medio:tamanho]:
+        h = ((h << 1) + _GEAR[byte]) & _MASCARA_64
+        posicao += 1
+        if not h & _MASCARA_LONGA:
+            return posicao
+    return tamanho
+
+def dividir_em_chunks(arquivo):
+    # Gera os chunks de um arquivo aberto; limites dependem do conteúdo, então inserções
+    # e renomeações só alteram os chunks ao redor da mudança
+    buffer = bytearray()
+    fim_arquivo = False
+    while True:
+        while not fim_arquivo and len(buffer) < CHUNK_MAXIMO:
+            bloco = limitador_io.ler(arquivo, limitador_io.trecho(CHUNK_MAXIMO))
+            if not bloco:
+                fim_arquivo = True
+            buffer += bloco
+        if not buffer:
+            return
+        corte = encontrar_corte(memoryview(buffer), min(len(buffer), CHUNK_MAXIMO))
+        yield bytes(buffer[:corte])
+        del buffer[:corte]
+
+class RepositorioChunks:
+    # chunks/<xx>/<blake2b>: cada chunk é gravado uma única vez, independente de arquivo, snapshot ou nome.
+    # snapshots/backup_<data>.json: o snapshot é apenas a lista de referências de chunks de cada arquivo.
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.pasta_chunks = os.path.join(caminho, "chunks")
+        self.pasta_snapshots = os.path.join(caminho, "snapshots")
+        os.makedirs(self.pasta_chunks, exist_ok=True)
+        os.makedirs(self.pasta_snapshots, exist_ok=True)
+
+    def caminho_chunk(self, chave):
+        return os.path.join(self.pasta_chunks, chave[:2], chave)
+
+    def gravar_chunk(self, dados):
+        chave = hashlib.blake2b(dados, digest_size=32).hexdigest()
+        chunk_path = self.caminho_chunk(chave)
+        if not os.path.exists(chunk_path):
+            os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+            temp_path = f"{chunk_path}.{os.getpid()}.{get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(dados)
+            os.replace(temp_path, chunk_path)  # Workers gravando o mesmo chunk não corrompem o arquivo
+        return chave
+
+    def ler_chunk(self, chave):
+        with open(self.caminho_chunk(chave), "rb") as f:
+            return f.read()
+
+    def armazenar_arquivo(self, src_path):
+        # Retorna (chaves dos chunks, hash do arquivo inteiro)
+        chaves = []
+        hash_arquivo = novo_hash_arquivo()
+        with open(src_path, "rb") as f:
+            for dados in dividir_em_chunks(f):
+                hash_arquivo.update(dados)
+                chaves.append(self.gravar_chunk(dados))
+        return chaves, hash_arquivo.hexdigest()
+
+    def salvar_snapshot(self, data, origem, arquivos):
+        # backup_<data>.json; um snapshot do mesmo segundo nunca é substituído (o novo recebe um sufixo),
+        # senão dois registros do histórico apontariam para o mesmo arquivo e a coleta de lixo apagaria
+        # chunks que só o snapshot sobrescrito usava
+        temp_path = os.path.join(self.pasta_snapshots, f"backup_{data}.{os.getpid()}.{get_ident()}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump({"origem": origem, "data": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "arquivos": arquivos}, f)
+        try:
+            return publicar_snapshot(temp_path, self.pasta_snapshots, data, ".json")
+        except OSError:
+            remover_temporario(temp_path)
+            raise
+
+    @staticmethod
+    def carregar_snapshot(snapshot_path):
+        with open(snapshot_path, "r") as f:
+            return json.load(f)
+
+    def listar_snapshots(self):
+        return sorted(os.path.join(self.pasta_snapshots, nome)
+                      for nome in os.listdir(self.pasta_snapshots) if nome.endswith(".json"))
+
+    def restaurar_snapshot(self, snapshot_path, destino):
+        snapshot = self.carregar_snapshot(snapshot_path)
+        for rel_path, arquivo in snapshot["arquivos"].items():
+            dest_path = os.path.join(destino, rel_path)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            with open(dest_path, "wb") as f:
+                for chave in arquivo["chunks"]:
+                    f.write(self.ler_chunk(chave))
+            os.utime(dest_path, (arquivo["mtime"], arquivo["mtime"]))
+
+    def coletar_lixo(self):
+        # Marca os chunks referenciados pelos snapshots restantes e remove os demais
+        referenciados = set()
+        for snapshot_path in self.listar_snapshots():
+            for arquivo in self.carregar_snapshot(snapshot_path)["arquivos"].values():
+                referenciados.update(arquivo["chunks"])
+        for prefixo in os.listdir(self.pasta_chunks):
+            pasta = os.path.join(self.pasta_chunks, prefixo)
+            for chave in os.listdir(pasta):
+                if chave not in referenciados:
+                    try:
+                        os.remove(os.path.join(pasta, chave))
+                    except OSError as e:
+                        logging.warning(f"Erro ao remover chunk '{chave}': {e}")
+
+def backup_repositorio(origem, destino, progress_callback, entradas=None, snapshot_anterior=None, workers=None, vigia=None,
+                       metricas=None):
+    # Grava um snapshot no repositório de chunks em destino/repositorio. Arquivos inalterados
+    # desde o snapshot anterior reaproveitam a lista de chunks sem serem lidos novamente.
+    if entradas is None:
+        entradas = escanear_origem(origem)
+    repositorio = RepositorioChunks(os.path.join(destino, PASTA_REPOSITORIO))
+    arquivos_anteriores = {}
+    if snapshot_anterior and snapshot_anterior[0].endswith(".json"):
+        arquivos_anteriores = RepositorioChunks.carregar_snapshot(snapshot_anterior[0])["arquivos"]
+    arquivos = {}
+    lock = Lock()
+
+    def processar(entrada, _dest_path):
+        anterior = arquivos_anteriores.get(entrada.rel_path)
+        if anterior and anterior["tamanho"] == entrada.tamanho and anterior["mtime"] == entrada.mtime:
+            registro = anterior
+            acao = ACAO_REAPROVEITADO
+        else:
+            if vigia and not vigia.reservar(entrada.tamanho):
+                return ACAO_IGNORADO
+            try:
+                chaves, hash_arquivo = repositorio.armazenar_arquivo(entrada.caminho)
+            except FileNotFoundError as e:
+                logging.warning(f"Arquivo não encontrado '{entrada.caminho}': {e}. Ignorando...")
+                return False
+            except PermissionError as e:
+                logging.warning(f"Erro de permissão ao acessar '{entrada.caminho}': {e}. Ignorando...")
+                return False
+            registro = {"tamanho": entrada.tamanho, "mtime": entrada.mtime, "hash": hash_arquivo, "chunks": chaves}
+            logging.info(f"Arquivo armazenado: {entrada.caminho}")
+            acao = ACAO_ARMAZENADO
+        with lock:
+            arquivos[entrada.rel_path] = registro
+        return acao
+
+    pipeline = PipelineCopia(processar, max(1, len(entradas)), progress_callback, resolver_workers_copia(workers),
+                             bytes_totais=calcular_tamanho_total(origem, entradas), vigia=vigia,
+                             metricas=metricas).iniciar()
+    for entrada in entradas:
+        pipeline.enviar(entrada, None)
+    entradas_salvas = pipeline.concluir()
+    snapshot_path = repositorio.salvar_snapshot(datetime.now().strftime("%Y-%m-%d_%H-%M-%S"), origem, arquivos)
+    progress_callback(100)  # Garantir que a barra de progresso atinja 100%
+    return snapshot_path, [(entrada, arquivos[entrada.rel_path]["hash"]) for entrada in entradas_salvas]
+
+# Funções do modo arquivo (tar com membros compactados individualmente)
+def codec_padrao():
+    return "zstd" if carregar_zstandard() else "zlib"
+
+def criar_compressor(codec):
+    if codec == "zstd":
+        return carregar_zstandard().ZstdCompressor(level=3).compressobj()
+    if codec == "lzma":
+        import lzma
+        return lzma.LZMACompressor(preset=3)
+    return zlib.compressobj(6)
+
+def criar_descompressor(codec):
+    if codec == "zstd":
+        zstandard = carregar_zstandard()
+        if not zstandard:
+            # Sem fallback possível: os dados só podem ser lidos com o codec em que foram gravados
+            raise RuntimeError("O membro foi compactado com zstd e o módulo zstandard não está instalado "
+                               "(pip install zstandard).")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == "lzma":
+        import lzma
+        return lzma.LZMADecompressor()
+    return zlib.decompressobj()
+
+def amostra_incompressivel(amostra):
+    if len(amostra) < BLOCO_TAR:
+        return True  # O tar arredonda cada membro para blocos de 512 bytes: compactar não economiza nada
+    return len(zlib.compress(amostra, 1)) > len(amostra) * RAZAO_INCOMPRESSIVEL
+
+def compactar_membro(entrada, codec):
+    # Executado nos workers: zlib, lzma e zstd liberam o GIL, então a compressão roda em paralelo.
+    # Retorna (entrada, codec usado ou None, arquivo temporário, tamanho gravado, hash do original)
+    # ou None em caso de erro.
+    import tempfile
+    try:
+        temp = tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA_MEMBRO)
+        with open(entrada.caminho, "rb") as f:
+            amostra = limitador_io.ler(f, AMOSTRA_COMPRESSAO)
+            if os.path.splitext(entrada.rel_path)[1].lower() in EXTENSOES_COMPACTADAS or amostra_incompressivel(amostra):
+                codec = None
+            compressor = criar_compressor(codec) if codec else None
+            hash_arquivo = novo_hash_arquivo()
+            bloco = amostra
+            while bloco:
+                hash_arquivo.update(bloco)
+                temp.write(compressor.compress(bloco) if compressor else bloco)
+                bloco = limitador_io.ler(f, limitador_io.trecho(BLOCO_COMPRESSAO))
+            if compressor:
+                temp.write(compressor.flush())
+        tamanho = temp.tell()
+        temp.seek(0)
+        return entrada, codec, temp, tamanho, hash_arquivo.hexdigest()
+    except FileNotFoundError as e:
+        logging.warning(f"Arquivo não encontrado '{entrada.caminho}': {e}. Ignorando...")
+    except PermissionError as e:
+        logging.warning(f"Erro de permissão ao acessar '{entrada.caminho}': {e}. Ignorando...")
+    except Exception as e:
+        logging.error(f"Erro inesperado ao compactar '{entrada.caminho}': {e}")
+    return None
+
+def gravar_membro(tar, resultado):
+    import tarfile
+    entrada, codec, temp, tamanho, hash_arquivo = resultado
+    info = tarfile.TarInfo(entrada.rel_path.replace(os.sep, "/"))
+    info.size = tamanho
+    info.mtime = entrada.mtime
+    info.mode = entrada.modo & 0o7777
+    info.pax_headers = {CABECALHO_COMPRESSAO: codec or "nenhuma", "EASYBACKUP.tamanho": str(entrada.tamanho),
+                        CABECALHO_HASH: hash_arquivo}
+    with temp:
+        tar.addfile(info, temp)
+    logging.info(f"Arquivo compactado: {entrada.caminho}")
+
+def backup_arquivo_compactado(origem, destino, progress_callback, entradas=None, workers=None, codec=None, vigia=None,
+                              metricas=None):
+    # Grava o snapshot como um único destino/backup_<data>.tar em escrita sequencial. Cada membro é
+    # compactado separadamente (permitindo extrair um arquivo sem ler os anteriores); arquivos
+    # já compactados são detectados pela extensão ou por uma amostra e gravados sem recompressão.
+    import tarfile
+    if entradas is None:
+        entradas = escanear_origem(origem)
+    codec = codec or carregar_configuracao().get("compressao_arquivo", codec_padrao())
+    if codec == "zstd" and not carregar_zstandard():
+        logging.warning("Módulo zstandard não instalado. Usando zlib...")
+        codec = "zlib"
+    workers = resolver_workers_copia(workers)
+    # O nome definitivo só é escolhido no fim: um .tar de outra execução no mesmo segundo nunca é substituído
+    data = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    temp_path = os.path.join(destino, f"backup_{data}.{os.getpid()}.{get_ident()}.tar.part")
+    total_items = max(1, len(entradas))
+    bytes_totais = calcular_tamanho_total(origem, entradas)
+    entradas_salvas = []
+    pendentes = deque()
+    items_processados = 0
+    bytes_processados = 0
+
+    def gravar_proximo(tar):
+        nonlocal items_processados, bytes_processados
+        entrada, futuro = pendentes.popleft()
+        resultado, duracao = futuro.result()
+        acao = ACAO_ERRO if resultado is None else ACAO_COMPACTADO
+        if resultado is not None and vigia and not vigia.reservar(resultado[3]):
+            resultado[2].close()
+            resultado = None
+            acao = ACAO_IGNORADO
+        if resultado is not None:
+            gravar_membro(tar, resultado)
+            entradas_salvas.append((entrada, resultado[4]))
+        if metricas:
+            metricas.registrar(entrada, acao, duracao)
+        items_processados += 1
+        bytes_processados += entrada.tamanho
+        progress_callback((items_processados / total_items) * 100, bytes_processados, bytes_totais)
+
+    cronometrar = metricas is not None and metricas.detalhado
+
+    def compactar_cronometrado(entrada, codec):
+        # Latência por membro medida no worker (compressão), só com métricas detalhadas
+        if not cronometrar:
+            return compactar_membro(entrada, codec), None
+        inicio = time.perf_counter()
+        return compactar_membro(entrada, codec), time.perf_counter() - inicio
+
+    with tarfile.open(temp_path, "w", format=tarfile.PAX_FORMAT) as tar, ThreadPoolExecutor(max_workers=workers) as executor:
+        # Janela limitada de membros em voo: compressão em paralelo, gravação na ordem da varredura
+        for entrada in entradas:
+            pendentes.append((entrada, executor.submit(compactar_cronometrado, entrada, codec)))
+            if len(pendentes) >= workers * 2:
+                gravar_proximo(tar)
+        while pendentes:
+            gravar_proximo(tar)
+    arquivo_path = publicar_snapshot(temp_path, destino, data, ".tar")
+    progress_callback(100)  # Garantir que a barra de progresso atinja 100%
+    return arquivo_path, entradas_salvas
+
+def extrair_arquivo_compactado(arquivo_path, destino):
+    import tarfile
+    destino_real = os.path.realpath(destino)
+    with tarfile.open(arquivo_path, "r") as tar:
+        for membro in tar:
+            if not membro.isfile():
+                continue
+            dest_path = os.path.realpath(os.path.join(destino, membro.name))
+            if not dest_path.startswith(destino_real + os.sep):
+                logging.warning(f"Membro ignorado fora do destino: {membro.name}")
+                continue
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            codec = membro.pax_headers.get(CABECALHO_COMPRESSAO, "nenhuma")
+            dados = tar.extractfile(membro)
+            with open(dest_path, "wb") as f:
+                if codec == "nenhuma":
+                    shutil.copyfileobj(dados, f, BLOCO_COMPRESSAO)
+                else:
+                    descompressor = criar_descompressor(codec)
+                    for bloco in iter(lambda: dados.read(BLOCO_COMPRESSAO), b""):
+                        f.write(descompressor.decompress(bloco))
+            os.utime(dest_path, (membro.mtime, membro.mtime))
+
+# Verificação de integridade dos snapshots
+def selecionar_amostra(rel_path, amostra, rodada):
+    # Amostragem determinística por faixas: com amostra=0.1 cada arquivo cai em uma de 10 faixas e a
+    # rodada (por padrão, o dia) escolhe a faixa, de modo que 10 noites cobrem o snapshot inteiro
+    if amostra >= 1:
+        return True
+    faixas = max(1, round(1 / amostra))
+    faixa = int.from_bytes(hashlib.blake2b(rel_path.encode("utf-8", "surrogateescape"), digest_size=8).digest(), "big")
+    return faixa % faixas == rodada % faixas
+
+def hash_de_arquivo(caminho, hash_arquivo=None):
+    if hash_arquivo is None:
+        hash_arquivo = novo_hash_arquivo()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(BLOCO_VERIFICACAO), b""):
+            hash_arquivo.update(bloco)
+    return hash_arquivo.hexdigest()
+
+def _verificar_pasta(snapshot_path, manifesto, selecionados, executor, resultado, registrar):
+    indice = IndicePacotes.abrir(snapshot_path)
+
+    def verificar_empacotado(rel_path, registro):
+        tamanho, _, hash_esperado = manifesto[rel_path]
+        try:
+            dados = indice.ler(registro)
+        except (OSError, EOFError) as e:
+            logging.warning(f"Erro ao ler '{rel_path}' do pacote {registro.pacote}: {e}")
+            return rel_path, "corrompido", 0
+        if len(dados) != tamanho:
+            return rel_path, "corrompido", tamanho
+        if not hash_esperado:
+            return rel_path, "sem_hash", 0
+        hash_arquivo = novo_hash_arquivo()
+        hash_arquivo.update(dados)
+        return rel_path, "ok" if hash_arquivo.hexdigest() == hash_esperado else "corrompido", tamanho
+
+    def verificar(rel_path):
+        registro = indice.obter(rel_path) if indice else None
+        if registro:
+            return verificar_empacotado(rel_path, registro)
+        tamanho, _, hash_esperado = manifesto[rel_path]
+        caminho = os.path.join(snapshot_path, rel_path)
+        try:
+            if os.path.getsize(caminho) != tamanho:
+                return rel_path, "corrompido", tamanho
+            if not hash_esperado:
+                return rel_path, "sem_hash", 0
+            return rel_path, "ok" if hash_de_arquivo(caminho) == hash_esperado else "corrompido", tamanho
+        except FileNotFoundError:
+            return rel_path, "ausente", 0
+        except OSError as e:
+            logging.warning(f"Erro ao ler '{caminho}': {e}")
+            return rel_path, "corrompido", 0
+
+    for rel_path, situacao, bytes_lidos in executor.map(verificar, selecionados):
+        registrar(rel_path, situacao, bytes_lidos)
+    # Arquivos a mais: só metadados, então a pasta inteira (e o índice dos pacotes) é listada mesmo com amostragem
+    extras = [entrada.rel_path for entrada in escanear_arvore(snapshot_path)
+              if entrada.rel_path not in manifesto and entrada.rel_path.split(os.sep)[0] != PASTA_PACOTES]
+    if indice:
+        extras.extend(registro.rel_path for registro in indice.listar() if registro.rel_path not in manifesto)
+        indice.fechar()
+    resultado["extras"] = sorted(extras)
+
+def _verificar_repositorio(snapshot_path, manifesto, selecionados, executor, resultado, registrar):
+    repositorio = RepositorioChunks(os.path.dirname(os.path.dirname(snapshot_path)))
+    arquivos = RepositorioChunks.carregar_snapshot(snapshot_path)["arquivos"]
+
+    def verificar(rel_path):
+        # Relê os chunks: confere o conteúdo de cada chunk (a chave é o próprio hash) e o arquivo inteiro
+        arquivo = arquivos.get(rel_path)
+        if arquivo is None:
+            return rel_path, "ausente", 0
+        hash_arquivo = novo_hash_arquivo()
+        bytes_lidos = 0
+        for chave in arquivo["chunks"]:
+            try:
+                dados = repositorio.ler_chunk(chave)
+            except FileNotFoundError:
+                return rel_path, "ausente", bytes_lidos
+            bytes_lidos += len(dados)
+            if hashlib.blake2b(dados, digest_size=32).hexdigest() != chave:
+                return rel_path, "corrompido", bytes_lidos
+            hash_arquivo.update(dados)
+        hash_esperado = manifesto[rel_path][2] or arquivo.get("hash")
+        return rel_path, "ok" if hash_arquivo.hexdigest() == hash_esperado else "corrompido", bytes_lidos
+
+    for rel_path, situacao, bytes_lidos in executor.map(verificar, selecionados):
+        registrar(rel_path, situacao, bytes_lidos)
+    resultado["extras"] = sorted(set(arquivos) - set(manifesto))
+
+def _verificar_arquivo_compactado(snapshot_path, manifesto, selecionados, executor, resultado, registrar):
+    # Uma passada pelos cabeçalhos do tar localiza cada membro; os workers leem os dados direto do
+    # deslocamento do membro com o próprio descritor, descompactando e calculando o hash em paralelo
+    import tarfile
+    membros = {}
+    extras = []
+    with tarfile.open(snapshot_path, "r") as tar:
+        for membro in tar:
+            if not membro.isfile():
+                continue
+            rel_path = membro.name.replace("/", os.sep)
+            if rel_path not in manifesto:
+                extras.append(rel_path)
+                continue
+            membros[rel_path] = (membro.offset_data, membro.size, membro.pax_headers.get(CABECALHO_COMPRESSAO, "nenhuma"),
+                                 membro.pax_headers.get(CABECALHO_HASH))
+
+    def verificar(rel_path):
+        if rel_path not in membros:
+            return rel_path, "ausente", 0
+        deslocamento, restante, codec, hash_membro = membros[rel_path]
+        tamanho, _, hash_esperado = manifesto[rel_path]
+        hash_esperado = hash_esperado or hash_membro
+        hash_arquivo = novo_hash_arquivo()
+        descompressor = criar_descompressor(codec) if codec != "nenhuma" else None
+        total = 0
+        try:
+            with open(snapshot_path, "rb") as f:
+                f.seek(deslocamento)
+                while restante > 0:
+                    bloco = f.read(min(restante, BLOCO_COMPRESSAO))
+                    if not bloco:
+                        return rel_path, "corrompido", total
+                    restante -= len(bloco)
+                    dados = descompressor.decompress(bloco) if descompressor else bloco
+                    total += len(dados)
+                    hash_arquivo.update(dados)
+        except Exception as e:  # Dados compactados inválidos (zlib, lzma e zstd têm exceções próprias)
+            logging.debug(f"Membro inválido '{rel_path}': {e}")
+            return rel_path, "corrompido", total
+        if total != tamanho:
+            return rel_path, "corrompido", total
+        if not hash_esperado:
+            return rel_path, "sem_hash", total
+        return rel_path, "ok" if hash_arquivo.hexdigest() == hash_esperado else "corrompido", total
+
+    for rel_path, situacao, bytes_lidos in executor.map(verificar, selecionados):
+        registrar(rel_path, situacao, bytes_lidos)
+    resultado["extras"] = sorted(extras)
+
+def verificar_snapshot(snapshot_id, amostra=1.0, rodada=None, workers=None, progress_callback=None):
+    # Relê o snapshot em paralelo e compara com o manifesto gravado durante o backup. Reporta arquivos
+    # ausentes, corrompidos (tamanho ou hash diferentes) e extras, e registra o resultado no histórico.
+    snapshot = obter_snapshot(snapshot_id)
+    if snapshot is None:
+        raise ValueError(f"Snapshot {snapshot_id} não encontrado no catálogo.")
+    _, origem, destino, snapshot_path, _ = snapshot
+    rodada = date.today().toordinal() if rodada is None else rodada
+    manifesto = carregar_manifesto(snapshot_id)
+    selecionados = [rel_path for rel_path in manifesto if selecionar_amostra(rel_path, amostra, rodada)]
+    progress_callback = progress_callback or (lambda *_: None)
+    resultado = {"snapshot_id": snapshot_id, "snapshot": snapshot_path, "amostra": amostra, "arquivos_manifesto": len(manifesto),
+                 "verificados": 0, "ok": 0, "sem_hash": 0, "bytes_lidos": 0, "ausentes": [], "corrompidos": [], "extras": []}
+    inicio = time.monotonic()
+
+    def registrar(rel_path, situacao, bytes_lidos):
+        resultado["verificados"] += 1
+        resultado["bytes_lidos"] += bytes_lidos
+        if situacao in ("ok", "sem_hash"):
+            resultado[situacao] += 1
+        else:
+            resultado["ausentes" if situacao == "ausente" else "corrompidos"].append(rel_path)
+            logging.warning(f"Verificação: '{rel_path}' {situacao} em {snapshot_path}")
+        progress_callback(resultado["verificados"] / max(1, len(selecionados)) * 100)
+
+    if snapshot_path.endswith(".tar"):
+        verificador = _verificar_arquivo_compactado
+    elif snapshot_path.endswith(".json"):
+        verificador = _verificar_repositorio
+    else:
+        verificador = _verificar_pasta
+    with ThreadPoolExecutor(max_workers=resolver_workers_copia(workers)) as executor:
+        verificador(snapshot_path, manifesto, selecionados, executor, resultado, registrar)
+    resultado["duracao"] = time.monotonic() - inicio
+    problemas = len(resultado["ausentes"]) + len(resultado["corrompidos"]) + len(resultado["extras"])
+    resultado["status"] = "Verificado" if not problemas else f"Erro: verificação com {problemas} problema(s)"
+    adicionar_entrada_historico(origem, destino, resultado["status"], {
+        "arquivos_escaneados": resultado["verificados"], "duracao": resultado["duracao"],
+        "erros": problemas, "telemetria": {"verificacao": {chave: resultado[chave] for chave in
+                                                           ("amostra", "verificados", "ok", "sem_hash", "bytes_lidos")}}})
+    return resultado
+
+# Restauração seletiva e em paralelo
+class FonteSnapshot:
+    # Abre o conteúdo de um arquivo do snapshot como um iterável de blocos, qualquer que seja o modo
+    def __init__(self, snapshot_path):
+        self.caminho = snapshot_path
+        self.membros = {}
+        self.arquivos = {}
+        self.indice = None
+        if snapshot_path.endswith(".tar"):
+            import tarfile
+            with tarfile.open(snapshot_path, "r") as tar:
+                for membro in tar:
+                    if membro.isfile():
+                        self.membros[membro.name.replace("/", os.sep)] = (
+                            membro.offset_data, membro.size, membro.pax_headers.get(CABECALHO_COMPRESSAO, "nenhuma"))
+        elif snapshot_path.endswith(".json"):
+            self.repositorio = RepositorioChunks(os.path.dirname(os.path.dirname(snapshot_path)))
+            self.arquivos = RepositorioChunks.carregar_snapshot(snapshot_path)["arquivos"]
+        else:
+            self.indice = IndicePacotes.abrir(snapshot_path)
+
+    def caminho_direto(self, rel_path):
+        # Snapshots em pasta: o arquivo existe em disco e pode usar o backend de cópia rápida
+        if self.membros or self.arquivos or (self.indice and self.indice.obter(rel_path)):
+            return None
+        return os.path.join(self.caminho, rel_path)
+
+    def blocos(self, rel_path):
+        registro = self.indice.obter(rel_path) if self.indice else None
+        if registro:
+            yield self.indice.ler(registro)
+            return
+        if rel_path in self.arquivos:
+            for chave in self.arquivos[rel_path]["chunks"]:
+                yield self.repositorio.ler_chunk(chave)
+            return
+        deslocamento, restante, codec = self.membros[rel_path]
+        descompressor = criar_descompressor(codec) if codec != "nenhuma" else None
+        with open(self.caminho, "rb") as f:
+            f.seek(deslocamento)
+            while restante > 0:
+                bloco = f.read(min(restante, BLOCO_COMPRESSAO))
+                if not bloco:
+                    raise EOFError(f"Membro truncado: {rel_path}")
+                restante -= len(bloco)
+                yield descompressor.decompress(bloco) if descompressor else bloco
+
+    def fechar(self):
+        if self.indice:
+            self.indice.fechar()
+
+def corresponde_padroes(rel_path, padroes):
+    # Globs sobre o caminho relativo com "/" (ex.: "docs/*.txt", "*.xlsx"); um padrão sem curinga
+    # seleciona o arquivo ou a pasta inteira
+    if not padroes:
+        return True
+    caminho = rel_path.replace(os.sep, "/")
+    for padrao in padroes:
+        padrao = padrao.replace(os.sep, "/").strip("/")
+        if fnmatch.fnmatchcase(caminho, padrao) or caminho == padrao or caminho.startswith(padrao + "/"):
+            return True
+    return False
+
+def selecionar_versoes(origem, destino, momento=None, snapshot_id=None, padroes=None):
+    # Retorna {rel_path: (snapshot_path, tamanho, mtime, hash)} com a versão mais recente de cada arquivo
+    # até o momento pedido: o snapshot concluído mais recente é a base e snapshots parciais mais novos
+    # que ele contribuem com o que chegaram a gravar
+    if snapshot_id is not None:
+        snapshot = obter_snapshot(snapshot_id)
+        if snapshot is None:
+            raise ValueError(f"Snapshot {snapshot_id} não encontrado no catálogo.")
+        candidatos = [(snapshot[0], None, snapshot[3], "Sucesso")]
+    else:
+        ate = momento.strftime("%Y-%m-%d %H:%M:%S") if isinstance(momento, datetime) else momento
+        candidatos = listar_snapshots_catalogo(origem, destino, ate)
+    versoes = {}
+    for candidato_id, _, caminho, status in candidatos:
+        if not caminho or not os.path.exists(caminho):
+            continue
+        for rel_path, (tamanho, mtime, hash_arquivo) in carregar_manifesto(candidato_id).items():
+            if rel_path not in versoes and corresponde_padroes(rel_path, padroes):
+                versoes[rel_path] = (caminho, tamanho, mtime, hash_arquivo)
+        if status == "Sucesso":
+            break
+    return versoes
+
+def restaurar_arquivo(fonte, rel_path, versao, alvo, verificar_hash=True, metodo_copia=None):
+    # Grava em um temporário ao lado do destino e troca com os.replace: uma restauração interrompida
+    # nunca deixa um arquivo pela metade no lugar do original. Retorna uma ação ACAO_*.
+    _, tamanho, mtime, hash_esperado = versao
+    normalizado = os.path.normpath(rel_path)
+    if os.path.isabs(normalizado) or normalizado.split(os.sep)[0] == os.pardir:
+        logging.warning(f"Caminho ignorado fora do destino: {rel_path}")
+        return ACAO_ERRO
+    dest_path = os.path.join(alvo, normalizado)
+    try:
+        st = os.stat(dest_path)
+        if st.st_size == tamanho and (st.st_mtime == mtime or
+                                      (hash_esperado and hash_de_arquivo(dest_path) == hash_esperado)):
+            if st.st_mtime != mtime:
+                os.utime(dest_path, (mtime, mtime))
+            return ACAO_INALTERADO
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    temp_path = f"{dest_path}.{os.getpid()}.{get_ident()}.restauracao"
+    hash_arquivo = novo_hash_arquivo() if verificar_hash and hash_esperado else None
+    try:
+        caminho_direto = fonte.caminho_direto(rel_path)
+        if caminho_direto:
+            copiar_arquivo(caminho_direto, temp_path, metodo_copia, hash_arquivo)
+        else:
+            with open(temp_path, "wb") as f:
+                for bloco in fonte.blocos(rel_path):
+                    if hash_arquivo is not None:
+                        hash_arquivo.update(bloco)
+                    f.write(bloco)
+        if hash_arquivo is not None and hash_arquivo.hexdigest() != hash_esperado:
+            logging.error(f"Hash divergente ao restaurar '{rel_path}' de {fonte.caminho}. Arquivo não restaurado.")
+            os.remove(temp_path)
+            return ACAO_ERRO
+        os.utime(temp_path, (mtime, mtime))
+        os.replace(temp_path, dest_path)
+        return ACAO_COPIADO
+    except Exception as e:
+        logging.error(f"Erro ao restaurar '{rel_path}': {e}")
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return ACAO_ERRO
+
+def restaurar(alvo, origem=None, destino=None, momento=None, snapshot_id=None, padroes=None, workers=None,
+              progress_callback=None, verificar_hash=True):
+    # Restaura a versão mais recente (até o momento, ou de um snapshot) dos arquivos que casam com
+    # os padrões, com um pool de workers e progresso por bytes. Arquivos já iguais no alvo são pulados.
+    progress_callback = progress_callback or (lambda *_: None)
+    if snapshot_id is not None and not (origem and destino):
+        snapshot = obter_snapshot(snapshot_id)
+        origem, destino = (snapshot[1], snapshot[2]) if snapshot else (origem, destino)
+    versoes = selecionar_versoes(origem, destino, momento, snapshot_id, padroes)
+    fontes = {caminho: FonteSnapshot(caminho) for caminho in {versao[0] for versao in versoes.values()}}
+    bytes_totais = sum(versao[1] for versao in versoes.values())
+    resultado = {"alvo": alvo, "arquivos": len(versoes), "restaurados": 0, "inalterados": 0, "erros": 0,
+                 "bytes_restaurados": 0, "snapshots": sorted(fontes)}
+    bytes_processados = 0
+    inicio = time.monotonic()
+    os.makedirs(alvo, exist_ok=True)
+
+    def concluir_proximo(pendentes):
+        nonlocal bytes_processados
+        tamanho, futuro = pendentes.popleft()
+        acao = futuro.result()
+        bytes_processados += tamanho
+        if acao == ACAO_COPIADO:
+            resultado["restaurados"] += 1
+            resultado["bytes_restaurados"] += tamanho
+        elif acao == ACAO_INALTERADO:
+            resultado["inalterados"] += 1
+        else:
+            resultado["erros"] += 1
+        progress_callback(bytes_processados / bytes_totais * 100 if bytes_totais else 100,
+                          bytes_processados, bytes_totais)
+
+    workers = resolver_workers_copia(workers)
+    metodo_copia = resolver_metodo_copia()
+    pendentes = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Maiores primeiro, para que os arquivos grandes não fiquem para o fim segurando um único worker;
+        # a janela de tarefas em voo é limitada para não criar um futuro por arquivo de uma vez
+        for rel_path, versao in sorted(versoes.items(), key=lambda item: item[1][1], reverse=True):
+            pendentes.append((versao[1], executor.submit(restaurar_arquivo, fontes[versao[0]], rel_path, versao, alvo,
+                                                         verificar_hash, metodo_copia)))
+            if len(pendentes) >= workers * 4:
+                concluir_proximo(pendentes)
+        while pendentes:
+            concluir_proximo(pendentes)
+    for fonte in fontes.values():
+        fonte.fechar()
+    progress_callback(100)
+    resultado["duracao"] = time.monotonic() - inicio
+    resultado["status"] = "Restaurado" if not resultado["erros"] else f"Erro: restauração com {resultado['erros']} erro(s)"
+    if origem and destino:
+        adicionar_entrada_historico(origem, destino, resultado["status"], {
+            "arquivos_escaneados": resultado["arquivos"], "arquivos_copiados": resultado["restaurados"],
+            "bytes_copiados": resultado["bytes_restaurados"], "duracao": resultado["duracao"],
+            "erros": resultado["erros"]})
+    return resultado
+
+def resolver_modo_destino(modo_destino=None):
+    if modo_destino is None:
+        modo_destino = carregar_configuracao().get("modo_destino", MODO_PASTA)
+    return modo_destino
+
+def backup_diario(origem, destino, progress_callback, log_callback, historico_callback, dias_retencao, modo_destino=None,
+                  politica=None, filtro=None, retomar=None):
+    if not os.path.exists(origem):
+        log_callback(f"Erro: O caminho de origem '{origem}' não foi encontrado.")
+        execucao_id = adicionar_entrada_historico(origem, destino, "Erro: Caminho de origem não encontrado")
+        return {"status": "Erro: Caminho de origem não encontrado", "execucao_id": execucao_id}
+
+    modo_destino = resolver_modo_destino(modo_destino)
+    data_atual = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    os.makedirs(destino, exist_ok=True)
+    execucao_id = adicionar_entrada_historico(origem, destino, "Em andamento")
+    metricas = MetricasExecucao(execucao_id)
+
+    def finalizar(status, **extras):
+        # Histórico, exportação e resumo da execução para chamadores sem interface (CLI, scripts)
+        if observador and status != "Sucesso":
+            observador.invalidar_base(destino)  # Snapshot incompleto: a próxima execução varre tudo
+        resultado = metricas.concluir()
+        atualizar_entrada_historico(execucao_id, status, resultado)
+        exportar_metricas(resultado, origem, destino, status)
+        return {"status": status, "execucao_id": execucao_id, **extras, **resultado}
+
+    # Qualquer falha daqui em diante fecha a execução: o vigia e o checkpoint são sempre encerrados,
+    # e o histórico e o snapshot registram o erro em vez de ficarem "Em andamento". Um snapshot em pasta
+    # com falha continua retomável a partir do checkpoint.
+    vigia = None
+    observador = None
+    checkpoint = None
+    snapshot_id = None
+    snapshot_marcado = False
+    try:
+        # Uma única varredura da origem alimenta a verificação de espaço, o progresso e a cópia. Com o
+        # observador ativo e uma base válida para este destino, só os caminhos alterados são lidos; a marca
+        # é tomada antes, para que alterações durante a execução fiquem para a próxima.
+        ultimo_snapshot = obter_ultimo_snapshot(origem, destino)
+        observador = obter_observador(origem)
+        if observador and observador.estouro:
+            observador.recuperar()
+        marca = observador.sincronizar() if observador and observador.confiavel() else None
+        base = observador.bases.get(destino) if marca is not None else None
+        horas_reconciliacao = carregar_configuracao().get("reconciliar_a_cada_horas", RECONCILIAR_A_CADA_HORAS)
+        varredura_completa = time.time()
+        filtro = filtro or compilar_filtro()
+        usar_alteracoes = bool(base and ultimo_snapshot and modo_destino != MODO_ARQUIVO and base[0] == ultimo_snapshot[0]
+                               and varredura_completa - base[2] < horas_reconciliacao * 3600)
+        # O manifesto anterior nunca é carregado na memória: a varredura completa é comparada com ele em fluxo
+        # (merge-join na ordem dos caminhos) e, com o observador, ele é lido em fluxo sob os caminhos alterados.
+        # Em ambos os casos cada entrada já traz o registro anterior, e os arquivos inalterados são vinculados
+        # (ou têm os chunks reaproveitados).
+        snapshot_anterior = (ultimo_snapshot[1], {}) if ultimo_snapshot else None
+
+        with metricas.fase("varredura"):
+            if usar_alteracoes:
+                alterados = obter_caminhos_alterados(observador.origem, base[1], marca)
+                entradas = aplicar_alteracoes(origem, ultimo_snapshot[0], alterados, filtro)
+                varredura_completa = base[2]
+                metricas.anotacoes.update(varredura="alteracoes", caminhos_alterados=len(alterados))
+                log_callback(f"{len(alterados)} caminho(s) alterado(s) desde o último backup. Varredura completa dispensada.")
+            else:
+                entradas, diferenca = comparar_varredura(origem, ultimo_snapshot[0] if ultimo_snapshot else None, filtro)
+                metricas.anotacoes.update(varredura="completa", diferenca=diferenca)
+                if ultimo_snapshot:
+                    log_callback(f"Desde o último backup: {diferenca[DIFERENCA_NOVO]} arquivo(s) novo(s), "
+                                 f"{diferenca[DIFERENCA_ALTERADO]} alterado(s) e {diferenca[DIFERENCA_REMOVIDO]} removido(s).")
+        metricas.arquivos_escaneados = len(entradas)
+        if filtro:
+            metricas.anotacoes["filtros"] = filtro.resumo()
+
+        # Verifica se há espaço para o que será realmente gravado, contando o que a retenção vai liberar.
+        # A pasta do novo snapshot só é criada depois, para que uma execução abortada não deixe um snapshot vazio.
+        with metricas.fase("verificacao_espaco"):
+            politica = politica or politica_retencao(dias_retencao)
+            manter, remover = aplicar_retencao(destino, politica, dry_run=True)
+            bytes_necessarios = estimar_bytes_necessarios(
+                entradas, modo_destino, snapshot_anterior,
+                obter_tamanho_manifesto(ultimo_snapshot[0]) if ultimo_snapshot and modo_destino == MODO_ARQUIVO else None)
+            espaco_suficiente = verificar_espaco_suficiente(origem, destino, entradas, bytes_necessarios,
+                                                            estimar_bytes_liberados(remover, manter))
+        if not espaco_suficiente:
+            log_callback("Espaço insuficiente para o backup.")
+            return finalizar("Erro: Espaço insuficiente")
+        aplicar_retencao(destino, politica, metricas=metricas)  # A remoção corre em paralelo com a cópia
+
+        # No modo pasta o snapshot é gravado em backup_<data>.incompleto e só ganha o nome definitivo no fim
+        # (com sufixo de sequência se outra execução no mesmo segundo já o ocupou).
+        # Uma pasta incompleta deixada por uma execução interrompida é retomada a partir do checkpoint
+        # (ou descartada, com "retomar_interrompidos": false).
+        em_pasta = False
+        if modo_destino == MODO_REPOSITORIO:
+            backup_path = os.path.join(destino, PASTA_REPOSITORIO)
+        elif modo_destino == MODO_ARQUIVO:
+            backup_path = destino
+        else:
+            em_pasta = True
+            backup_path = nome_snapshot_livre(destino, data_atual, sufixos=("", SUFIXO_INCOMPLETO)) + SUFIXO_INCOMPLETO
+            interrompido = obter_snapshot_interrompido(origem, destino)
+            retomar = carregar_configuracao().get("retomar_interrompidos", True) if retomar is None else retomar
+            if interrompido and retomar:
+                snapshot_id, backup_path = interrompido
+                checkpoint = DiarioCheckpoint(snapshot_id, carregar_checkpoint(snapshot_id))
+                limpar_temporarios(backup_path)
+                metricas.anotacoes["retomado"] = {"snapshot_id": snapshot_id, "arquivos_concluidos": len(checkpoint.concluidos)}
+                log_callback(f"Retomando o backup interrompido em '{backup_path}' "
+                             f"({len(checkpoint.concluidos)} arquivo(s) já concluído(s)).")
+            elif interrompido:
+                log_callback(f"Descartando o backup interrompido em '{interrompido[1]}'.")
+                descartar_snapshot_interrompido(*interrompido)
+        os.makedirs(backup_path, exist_ok=True)
+
+        def marcar_snapshot(status):
+            nonlocal snapshot_marcado
+            if em_pasta:
+                caminho_snapshot = concluir_snapshot_pasta(snapshot_id, backup_path, destino, data_atual, status)
+            else:
+                atualizar_status_snapshot(snapshot_id, status)
+                caminho_snapshot = backup_path
+            snapshot_marcado = True
+            # O catálogo de versões é derivado do manifesto: uma falha aqui não invalida o snapshot, que fica
+            # pendente para a próxima sincronização
+            with metricas.fase("catalogo"):
+                try:
+                    sincronizar_catalogo()
+                except sqlite3.Error as e:
+                    logging.warning(f"Não foi possível atualizar o catálogo de versões: {e}")
+            return caminho_snapshot
+
+        vigia = VigiaEspaco(destino, carregar_configuracao().get("reserva_espaco_mb", RESERVA_ESPACO // (1024 * 1024)) * 1024 * 1024).iniciar()
+        log_callback(f"Iniciando o backup incremental diário para a data: {data_atual}")
+        with metricas.fase("copia"):
+            if modo_destino == MODO_REPOSITORIO:
+                snapshot_id = registrar_snapshot(origem, destino, None, "Em andamento")
+                backup_path, entradas_salvas = backup_repositorio(origem, destino, progress_callback, entradas, snapshot_anterior, vigia=vigia, metricas=metricas)
+                atualizar_caminho_snapshot(snapshot_id, backup_path)
+            elif modo_destino == MODO_ARQUIVO:
+                snapshot_id = registrar_snapshot(origem, destino, None, "Em andamento")
+                backup_path, entradas_salvas = backup_arquivo_compactado(origem, destino, progress_callback, entradas, vigia=vigia, metricas=metricas)
+                atualizar_caminho_snapshot(snapshot_id, backup_path)
+            else:
+                if checkpoint is None:
+                    snapshot_id = registrar_snapshot(origem, destino, backup_path, "Em andamento")
+                    checkpoint = DiarioCheckpoint(snapshot_id)
+                entradas_salvas = backup_incremental(origem, backup_path, progress_callback, entradas, snapshot_anterior, vigia=vigia,
+                                                     metricas=metricas, checkpoint=checkpoint)
+        vigia.encerrar()  # Também no finally, se a cópia falhar
+        with metricas.fase("manifesto"):
+            salvar_manifesto(snapshot_id, entradas_salvas)
+        if vigia.parado:
+            backup_path = marcar_snapshot("Parcial: espaço insuficiente")
+            log_callback("Backup interrompido por falta de espaço no destino. Os arquivos já copiados foram mantidos.")
+            return finalizar("Parcial: espaço insuficiente", snapshot=backup_path)
+        backup_path = marcar_snapshot("Sucesso")
+        log_callback("Backup diário concluído com sucesso!")
+        historico_callback(f"Backup realizado em {data_atual} para {backup_path}")
+        if marca is not None and modo_destino != MODO_ARQUIVO:
+            if metricas.erros:
+                observador.invalidar_base(destino)  # Arquivos com erro ficaram fora do manifesto
+            else:
+                observador.registrar_base(destino, snapshot_id, marca, varredura_completa)
+        return finalizar("Sucesso", snapshot=backup_path)
+    except BaseException as e:
+        logging.exception(f"Erro durante o backup diário de '{origem}' para '{destino}': {e}")
+        if snapshot_id is not None and not snapshot_marcado:
+            atualizar_status_snapshot(snapshot_id, "Falhou")
+        resultado = finalizar(f"Erro: {e}")
+        if not isinstance(e, Exception):
+            raise  # KeyboardInterrupt/SystemExit: registrados, mas o processo continua encerrando
+        log_callback(f"Erro durante o backup: {e}")
+        return resultado
+    finally:
+        if vigia:
+            vigia.encerrar()
+        if checkpoint:
+            checkpoint.gravar()
+
+def executar_backup_completo(origem, destino, progress_callback, log_callback=None):
+    # Backup completo com a mesma contabilidade do diário: entrada no histórico, métricas e diário por arquivo
+    execucao_id = adicionar_entrada_historico(origem, destino, "Em andamento")
+    metricas = MetricasExecucao(execucao_id)
+    try:
+        filtro = compilar_filtro()
+        with metricas.fase("varredura"):
+            entradas = escanear_origem(origem, filtro)
+        metricas.arquivos_escaneados = len(entradas)
+        if filtro:
+            metricas.anotacoes["filtros"] = filtro.resumo()
+        with metricas.fase("copia"):
+            backup_completo(origem, destino, progress_callback, entradas, metricas=metricas)
+    except BaseException as e:
+        # Como no diário: o histórico registra o erro em vez de ficar "Em andamento"
+        logging.exception(f"Erro durante o backup completo de '{origem}' para '{destino}': {e}")
+        status = f"Erro: {e}"
+        resultado = metricas.concluir()
+        atualizar_entrada_historico(execucao_id, status, resultado)
+        exportar_metricas(resultado, origem, destino, status)
+        if not isinstance(e, Exception):
+            raise
+        if log_callback:
+            log_callback(f"Erro durante o backup completo: {e}")
+        return {"status": status, "execucao_id": execucao_id, **resultado}
+    resultado = metricas.concluir()
+    status = "Sucesso" if not resultado["erros"] else f"Sucesso com {resultado['erros']} erro(s)"
+    atualizar_entrada_historico(execucao_id, status, resultado)
+    exportar_metricas(resultado, origem, destino, status)
+    if log_callback:
+        log_callback(f"Backup completo concluído: {resultado['arquivos_copiados']} arquivo(s) copiado(s).")
+    return {"status": status, "execucao_id": execucao_id, **resultado}
+
+class Agendador:
+    # Uma única thread mantém um heap de (próxima execução, job) e dorme até o próximo vencimento.
+    # Reagendar um job com o mesmo nome substitui o anterior em vez de criar outra thread.
+    def __init__(self):
+        self.heap = []
+        self.jobs = {}
+        self.condicao = Condition()
+        self.thread = None
+        self.sequencia = 0
+
+    def agendar(self, nome, calcular_proxima, funcao, args=(), chave_trava=None,
+                politica_recuperacao=None, jitter_segundos=None):
+        config = carregar_configuracao()
+        job = {
+            "nome": nome,
+            "calcular_proxima": calcular_proxima,
+            "funcao": funcao,
+            "args": args,
+            "chave_trava": chave_trava or nome,
+            "politica_recuperacao": politica_recuperacao or config.get("politica_recuperacao", RECUPERAR_EXECUTAR),
+            "jitter_segundos": jitter_segundos if jitter_segundos is not None else config.get("jitter_segundos", 0),
+        }
+        with self.condicao:
+            self.jobs[nome] = job
+            self._enfileirar(job, datetime.now())
+            self.condicao.notify()
+        self._iniciar_thread()
+
+    def remover(self, nome):
+        with self.condicao:
+            self.jobs.pop(nome, None)  # Entradas antigas no heap são descartadas ao vencer
+            self.condicao.notify()
+
+    def proximas_execucoes(self):
+        with self.condicao:
+            return sorted((datetime.fromtimestamp(vencimento), job["nome"]) for vencimento, _, job in self.heap
+                          if self.jobs.get(job["nome"]) is job)
+
+    def _enfileirar(self, job, referencia):
+        proxima = job["calcular_proxima"](referencia)
+        if job["jitter_segundos"]:
+            proxima += timedelta(seconds=random.uniform(0, job["jitter_segundos"]))
+        self.sequencia += 1
+        heapq.heappush(self.heap, (proxima.timestamp(), self.sequencia, job))
+
+    def _iniciar_thread(self):
+        with self.condicao:
+            if self.thread is None:
+                self.thread = Thread(target=self._executar, daemon=True)
+                self.thread.start()
+
+    def _executar(self):
+        while True:
+            with self.condicao:
+                while True:
+                    while self.heap and self.jobs.get(self.heap[0][2]["nome"]) is not self.heap[0][2]:
+                        heapq.heappop(self.heap)  # Job removido ou substituído
+                    # Relógio de parede: após suspensão o vencimento já passou e é tratado abaixo
+                    espera = self.heap[0][0] - time.time() if self.heap else ESPERA_MAXIMA_AGENDADOR
+                    if espera <= 0:
+                        break
+                    self.condicao.wait(min(espera, ESPERA_MAXIMA_AGENDADOR))
+                vencimento, _, job = heapq.heappop(self.heap)
+                agora = datetime.now()
+                # Vários vencimentos perdidos se tornam uma única execução; o próximo é calculado a partir de agora
+                self._enfileirar(job, agora)
+            atraso = time.time() - vencimento
+            if atraso > TOLERANCIA_ATRASO and job["politica_recuperacao"] == RECUPERAR_PULAR:
+                logging.warning(f"Execução perdida de '{job['nome']}' ({atraso / 60:.0f} min de atraso). Aguardando o próximo horário...")
+                continue
+            if atraso > TOLERANCIA_ATRASO:
+                logging.info(f"Recuperando execução perdida de '{job['nome']}' ({atraso / 60:.0f} min de atraso)")
+            Thread(target=executar_com_trava, args=(job["chave_trava"], job["funcao"]) + tuple(job["args"]), daemon=True).start()
+
+_travas_destino = {}
+_travas_lock = Lock()
+
+def obter_trava_destino(chave):
+    with _travas_lock:
+        return _travas_destino.setdefault(chave, Lock())
+
+def executar_com_trava(chave, funcao, *args):
+    # Impede que duas execuções (agendadas ou manuais) gravem no mesmo destino ao mesmo tempo
+    trava = obter_trava_destino(chave)
+    if not trava.acquire(blocking=False):
+        logging.warning(f"Já existe um backup em execução para '{chave}'. Execução ignorada.")
+        return False
+    try:
+        funcao(*args)
+        return True
+    finally:
+        trava.release()
+
+def proxima_execucao_diaria(horario):
+    hora, minuto = (int(parte) for parte in horario.split(":"))
+
+    def calcular(referencia):
+        proxima = referencia.replace(hour=hora, minute=minuto, second=0, microsecond=0)
+        if proxima <= referencia:
+            proxima += timedelta(days=1)
+        return proxima
+    return calcular
+
+def proxima_execucao_intervalo(intervalo_dias):
+    def calcular(referencia):
+        return referencia + timedelta(days=intervalo_dias)
+    return calcular
+
+agendador = Agendador()
+
+def agendar_backup(horario, funcao_backup, *args, nome="backup_diario", chave_trava=None):
+    agendador.agendar(nome, proxima_execucao_diaria(horario), funcao_backup, args, chave_trava)
+
+def backup_completo(origem, destino, progress_callback, entradas=None, workers=None, vigia=None, metricas=None):
+    if entradas is None:
+        entradas = escanear_origem(origem)
+    if not entradas:
+        progress_callback(100)
+        return []
+
+    limite_delta = resolver_limite_delta()
+    metodo_copia = resolver_metodo_copia()
+    limite_pacote = resolver_limite_pacote()
+    escritor = EscritorPacotes(destino) if limite_pacote else None
+
+    def processar(entrada, dest_path):
+        if vigia and not vigia.reservar(entrada.tamanho):
+            return ACAO_IGNORADO
+        if dest_path is None:
+            return escritor.empacotar(entrada) and ACAO_EMPACOTADO  # Pacotes do espelho são regravados a cada execução
+        if entrada.tamanho >= limite_delta:
+            return copiar_delta(entrada.caminho, dest_path) and ACAO_DELTA  # Atualiza a cópia existente no lugar
+        return copiar_item(entrada.caminho, dest_path, metodo=metodo_copia) and ACAO_COPIADO
+
+    entradas_salvas = executar_pipeline_copia(entradas, destino, processar, progress_callback, workers, vigia, metricas,
+                                              limite_pacote)
+    if escritor:
+        escritor.concluir()
+    progress_callback(100)  # Garantir que a barra de progresso atinja 100%
+    return entradas_salvas
+
+def agendar_backup_completo(intervalo_dias, funcao_backup, *args, nome="backup_completo", chave_trava=None):
+    agendador.agendar(nome, proxima_execucao_intervalo(intervalo_dias), funcao_backup, args, chave_trava)
+
+# Jobs: vários pares origem/destino nomeados, cada um com horário e retenção próprios
+def carregar_jobs(config=None):
+    # Os jobs vêm da chave "jobs"; sem ela, as chaves antigas "origem"/"destino" formam o job "padrao".
+    # Horário, retenção e modo ausentes no job herdam os valores globais da configuração.
+    config = carregar_configuracao() if config is None else config
+    jobs = config.get("jobs")
+    if not jobs:
+        if not config.get("origem") or not config.get("destino"):
+            return []
+        jobs = [{"nome": JOB_PADRAO, "origem": config["origem"], "destino": config["destino"]}]
+    normalizados = []
+    for indice, job in enumerate(jobs):
+        origens = job.get("origens") or ([job["origem"]] if job.get("origem") else [])
+        if not origens or not job.get("destino"):
+            logging.warning(f"Job '{job.get('nome', indice)}' ignorado: origem e destino são obrigatórios.")
+            continue
+        normalizados.append(dict(job,
+                                 nome=job.get("nome") or f"job_{indice + 1}",
+                                 origens=origens,
+                                 horario=job.get("horario", config.get("horario", "02:00")),
+                                 dias_retencao=job.get("dias_retencao", config.get("dias_retencao", 7)),
+                                 modo_destino=job.get("modo_destino", config.get("modo_destino", MODO_PASTA))))
+    return normalizados
+
+def nome_pasta_origem(origem):
+    nome = os.path.basename(os.path.normpath(origem).rstrip("\\/"))
+    return re.sub(r"[^\w.-]+", "_", nome or origem).strip("_") or "origem"
+
+def tarefas_job(job):
+    # Um job com uma origem grava direto no destino; com várias, cada origem ganha uma subpasta própria
+    # no destino, para que snapshots e retenção de origens diferentes não se misturem
+    if len(job["origens"]) == 1:
+        return [(job["origens"][0], job["destino"])]
+    tarefas, usados = [], set()
+    for origem in job["origens"]:
+        nome = base = nome_pasta_origem(origem)
+        sufixo = 2
+        while nome in usados:
+            nome, sufixo = f"{base}_{sufixo}", sufixo + 1
+        usados.add(nome)
+        tarefas.append((origem, os.path.join(job["destino"], nome)))
+    return tarefas
+
+def identificar_dispositivo(caminho, config=None):
+    # Nome do disco físico de um caminho. Compartilhamentos de rede contam pelo servidor; em Linux a
+    # partição é resolvida para o disco via /sys. A chave "dispositivos" (prefixo -> nome) da
+    # configuração agrupa o que o sistema não consegue ver, como dois volumes no mesmo RAID.
+    config = carregar_configuracao() if config is None else config
+    absoluto = os.path.abspath(caminho)
+    normalizado = absoluto.replace("\\", "/").lower()
+    for prefixo, nome in sorted(config.get("dispositivos", {}).items(), key=lambda item: -len(item[0])):
+        if normalizado.startswith(prefixo.replace("\\", "/").lower()):
+            return nome
+    if caminho.startswith(("\\\\", "//")):
+        return "rede:" + caminho.replace("\\", "/").strip("/").split("/")[0].lower()
+    while not os.path.exists(absoluto) and os.path.dirname(absoluto) != absoluto:
+        absoluto = os.path.dirname(absoluto)  # Destinos ainda não criados: o disco da pasta existente mais próxima
+    try:
+        st_dev = os.stat(absoluto).st_dev
+    except OSError:
+        return normalizado
+    if not hasattr(os, "major"):
+        return f"volume:{st_dev}"  # Windows: número de série do volume
+    bloco = os.path.realpath(f"/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}")
+    if os.path.exists(os.path.join(bloco, "partition")):
+        bloco = os.path.dirname(bloco)
+    if os.path.exists(bloco):
+        return os.path.basename(bloco)
+    return f"{os.major(st_dev)}:{os.minor(st_dev)}"  # Sistemas de arquivos sem bloco (NFS, tmpfs)
+
+class LimitadorDispositivos:
+    # Vagas por disco físico e um teto global de tarefas. Todos os discos de uma tarefa são reservados
+    # de uma vez sob a mesma condição, então duas tarefas nunca ficam esperando uma pela outra; quem
+    # chegou antes tem prioridade nos discos que disputa, para que nenhuma tarefa seja adiada para sempre.
+    def __init__(self):
+        self.condicao = Condition()
+        self.em_uso = {}
+        self.ativas = 0
+        self.fila = {}
+        self.sequencia = 0
+
+    def _pode_reservar(self, senha, dispositivos, limite_global, limites, limite_padrao):
+        if self.ativas >= limite_global:
+            return False
+        if any(self.em_uso.get(dispositivo, 0) >= limites.get(dispositivo, limite_padrao) for dispositivo in dispositivos):
+            return False
+        return not any(outra < senha and dispositivos & outros for outra, outros in self.fila.items())
+
+    @contextmanager
+    def reservar(self, dispositivos, config=None):
+        config = carregar_configuracao() if config is None else config
+        limite_global = max(1, config.get("jobs_simultaneos", JOBS_SIMULTANEOS))
+        limites = config.get("limites_dispositivos", {})
+        limite_padrao = max(1, config.get("limite_por_dispositivo", LIMITE_POR_DISPOSITIVO))
+        dispositivos = set(dispositivos)
+        with self.condicao:
+            self.sequencia += 1
+            senha = self.sequencia
+            self.fila[senha] = dispositivos
+            while not self._pode_reservar(senha, dispositivos, limite_global, limites, limite_padrao):
+                self.condicao.wait()
+            del self.fila[senha]
+            self.ativas += 1
+            for dispositivo in dispositivos:
+                self.em_uso[dispositivo] = self.em_uso.get(dispositivo, 0) + 1
+        try:
+            yield
+        finally:
+            with self.condicao:
+                self.ativas -= 1
+                for dispositivo in dispositivos:
+                    self.em_uso[dispositivo] -= 1
+                self.condicao.notify_all()
+
+    def ocupacao(self):
+        with self.condicao:
+            return {dispositivo: quantidade for dispositivo, quantidade in self.em_uso.items() if quantidade}
+
+limitador_dispositivos = LimitadorDispositivos()
+
+def executar_jobs(nomes=None, progress_callback=None, log_callback=None, historico_callback=None, config=None):
+    # Cada par origem/destino dos jobs selecionados roda em sua própria thread, mas só começa quando há
+    # vaga nos discos de origem e de destino. O limitador é global ao processo, então execuções
+    # agendadas e manuais disputam as mesmas vagas.
+    config = carregar_configuracao() if config is None else config
+    jobs = [job for job in carregar_jobs(config) if nomes is None or job["nome"] in nomes]
+    tarefas = [(job, origem, destino) for job in jobs for origem, destino in tarefas_job(job)]
+    progresso_tarefas = [0.0] * len(tarefas)
+    lock_progresso = Lock()
+    resultados = [None] * len(tarefas)
+
+    def executar_tarefa(indice, job, origem, destino):
+        def progresso(valor, *_):
+            # Progresso agregado: média das tarefas, sem bytes (cada tarefa tem o seu total)
+            with lock_progresso:
+                progresso_tarefas[indice] = valor
+                media = sum(progresso_tarefas) / len(progresso_tarefas)
+            if progress_callback:
+                progress_callback(media)
+
+        def log(mensagem):
+            (log_callback or _log_stderr)(f"[{job['nome']}] {mensagem}")
+
+        dispositivos = {identificar_dispositivo(origem, config), identificar_dispositivo(destino, config)}
+        with limitador_dispositivos.reservar(dispositivos, config):
+            log(f"Iniciando {origem} -> {destino} (discos: {', '.join(sorted(dispositivos))})")
+            politica = politica_retencao(job["dias_retencao"], dict(config, **job))
+            resultado = {}
+
+            def executar():
+                resultado.update(backup_diario(origem, destino, progresso, log, historico_callback or (lambda *_: None),
+                                               job["dias_retencao"], job["modo_destino"], politica,
+                                               compilar_filtro(dict(config, **job))))
+            try:
+                if not executar_com_trava(destino, executar):
+                    resultado["status"] = "Erro: destino em uso por outra execução"
+            except Exception as e:
+                logging.exception(f"Erro no job '{job['nome']}' ({origem})")
+                resultado["status"] = f"Erro: {e}"
+        resultados[indice] = {"job": job["nome"], "origem": origem, "destino": destino, **resultado}
+
+    threads = [Thread(target=executar_tarefa, args=(indice,) + tarefa, daemon=True) for indice, tarefa in enumerate(tarefas)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    falhas = sum(1 for resultado in resultados if not resultado["status"].startswith("Sucesso"))
+    return {"status": "Sucesso" if not falhas else f"Erro: {falhas} de {len(resultados)} tarefa(s) sem sucesso",
+            "tarefas": resultados}
+
+def agendar_jobs(progress_callback=None, log_callback=None, historico_callback=None, config=None):
+    # Um agendamento por job, no horário do job; agendamentos de jobs removidos da configuração são
+    # cancelados. A trava do agendador é o nome do job, e a dos destinos fica com executar_jobs.
+    config = carregar_configuracao() if config is None else config
+    jobs = carregar_jobs(config)
+    nomes = {PREFIXO_AGENDAMENTO_JOB + job["nome"] for job in jobs}
+    for nome in [nome for nome in agendador.jobs if nome.startswith(PREFIXO_AGENDAMENTO_JOB) and nome not in nomes]:
+        agendador.remover(nome)
+    configurar_observacao([origem for job in jobs for origem in job["origens"]], config)
+    for job in jobs:
+        agendador.agendar(PREFIXO_AGENDAMENTO_JOB + job["nome"], proxima_execucao_diaria(job["horario"]), executar_jobs,
+                          ([job["nome"]], progress_callback, log_callback, historico_callback))
+    return jobs
+
+# Linha de comando (servidores sem interface gráfica): python -m backup_engine run|full|prune|status|verify|restore|jobs|daemon
+def _log_stderr(mensagem):
+    logging.info(mensagem)
+
+def _resolver_origem_destino(args, config):
+    origem = args.origem or config.get("origem")
+    destino = args.destino or config.get("destino")
+    if not origem or not destino:
+        raise SystemExit("Origem e destino devem ser informados (--origem/--destino) ou definidos na configuração.")
+    return origem, destino
+
+def _imprimir_json(dados):
+    print(json.dumps(dados, ensure_ascii=False, indent=2, default=str))
+
+def comando_run(args, config):
+    origem, destino = _resolver_origem_destino(args, config)
+    dias_retencao = args.dias_retencao if args.dias_retencao is not None else config.get("dias_retencao", 7)
+    return backup_diario(origem, destino, lambda *_: None, _log_stderr, _log_stderr, dias_retencao, args.modo,
+                         retomar=False if args.descartar_interrompido else None)
+
+def comando_full(args, config):
+    origem, destino = _resolver_origem_destino(args, config)
+    return executar_backup_completo(origem, destino, lambda *_: None, _log_stderr)
+
+def comando_prune(args, config):
+    destino = args.destino or config.get("destino")
+    if not destino:
+        raise SystemExit("Destino deve ser informado (--destino) ou definido na configuração.")
+    dias_retencao = args.dias_retencao if args.dias_retencao is not None else config.get("dias_retencao")
+    # Remoção síncrona: o processo termina logo depois e não pode abandonar uma thread de remoção
+    manter, remover = aplicar_retencao(destino, politica_retencao(dias_retencao, config), dry_run=args.dry_run,
+                                       em_segundo_plano=False)
+    return {
+        "dry_run": args.dry_run,
+        "manter": [{"caminho": snapshot.caminho, "motivos": motivos} for snapshot, motivos in manter],
+        "remover": [snapshot.caminho for snapshot in remover],
+        "bytes_liberados": estimar_bytes_liberados(remover, manter) if args.dry_run else None,
+    }
+
+def comando_status(args, config):
+    if args.execucao:
+        return {"execucao_id": args.execucao, "telemetria": obter_telemetria(args.execucao)}
+    colunas = ("id", "data", "origem", "destino", "status", "arquivos_copiados", "bytes_copiados", "duracao", "erros")
+    execucoes = [dict(zip(colunas, linha)) for linha in obter_historico(limite=args.limite, filtro=args.origem or args.destino)]
+    destino = args.destino or config.get("destino")
+    snapshots = []
+    if destino:
+        snapshots = [{"caminho": s.caminho, "data": s.data.isoformat(), "tipo": s.tipo} for s in listar_snapshots(destino)]
+    return {"execucoes": execucoes, "snapshots": snapshots}
+
+def comando_verify(args, config):
+    snapshot_id = args.snapshot
+    if snapshot_id is None:
+        origem, destino = _resolver_origem_destino(args, config)
+        ultimo_snapshot = obter_ultimo_snapshot(origem, destino)
+        if ultimo_snapshot is None:
+            raise SystemExit("Nenhum snapshot concluído para verificar.")
+        snapshot_id = ultimo_snapshot[0]
+    return verificar_snapshot(snapshot_id, args.amostra, args.rodada, args.workers)
+
+def comando_restore(args, config):
+    origem = destino = None
+    if args.snapshot is None:
+        origem, destino = _resolver_origem_destino(args, config)
+    momento = datetime.strptime(args.momento, "%Y-%m-%d %H:%M:%S") if args.momento else None
+    return restaurar(args.alvo, origem, destino, momento, args.snapshot, args.incluir, args.workers,
+                     verificar_hash=not args.sem_verificar)
+
+def comando_find(args, config):
+    # --origem/--destino só restringem a busca a uma série; sem eles vale o catálogo inteiro
+    sincronizar_catalogo()
+    if args.versoes:
+        versoes = listar_versoes(args.termo, args.origem, args.destino)
+    else:
+        versoes = buscar_catalogo(args.termo, args.modo, args.origem, args.destino, args.limite)
+    return {"resultados": [versao._asdict() for versao in versoes]}
+
+def comando_jobs(args, config):
+    if args.listar:
+        return {"jobs": [dict(job, tarefas=[{"origem": origem, "destino": destino,
+                                              "discos": sorted({identificar_dispositivo(origem, config),
+                                                                identificar_dispositivo(destino, config)})}
+                                             for origem, destino in tarefas_job(job)])
+                         for job in carregar_jobs(config)]}
+    return executar_jobs(args.job, config=config)
+
+def comando_daemon(args, config):
+    # Agenda o backup diário no horário da configuração e bloqueia; a thread do agendador é daemon.
+    # Com "jobs" na configuração (e sem --origem/--destino), cada job é agendado no seu horário.
+    if config.get("jobs") and not (args.origem or args.destino):
+        jobs = agendar_jobs(config=config)
+        logging.info(f"{len(jobs)} job(s) agendado(s). Próximas execuções: {agendador.proximas_execucoes()}")
+        return _aguardar()
+    origem, destino = _resolver_origem_destino(args, config)
+    dias_retencao = args.dias_retencao if args.dias_retencao is not None else config.get("dias_retencao", 7)
+    configurar_observacao(origem, config)
+    agendar_backup(config.get("horario", "02:00"), backup_diario, origem, destino, lambda *_: None, _log_stderr,
+                   _log_stderr, dias_retencao, args.modo, chave_trava=destino)
+    logging.info(f"Agendador iniciado. Próximas execuções: {agendador.proximas_execucoes()}")
+    return _aguardar()
+
+def _aguardar():
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        return None
+
+def main(argv=None):
+    global CONFIG_FILE
+    import argparse
+    parser = argparse.ArgumentParser(prog="backup_engine", description="EasyBackup sem interface gráfica")
+    parser.add_argument("--config", help=f"Arquivo de configuração (padrão: {CONFIG_FILE})")
+    parser.add_argument("--banco", help=f"Banco de histórico (padrão: {DB_FILE})")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+    for nome, ajuda in (("run", "Backup incremental diário com retenção"), ("full", "Backup completo"),
+                        ("prune", "Aplica a política de retenção"), ("status", "Histórico de execuções e snapshots"),
+                        ("verify", "Confere um snapshot contra os hashes do manifesto"),
+                        ("restore", "Restaura arquivos de um snapshot ou de um momento"),
+                        ("find", "Busca arquivos e versões no catálogo de todos os snapshots"),
+                        ("jobs", "Executa os jobs da configuração em paralelo"),
+                        ("daemon", "Executa o backup diário no horário configurado")):
+        sub = subparsers.add_parser(nome, help=ajuda)
+        sub.add_argument("--origem")
+        sub.add_argument("--destino")
+        if nome in ("run", "prune", "daemon"):
+            sub.add_argument("--dias-retencao", type=int, dest="dias_retencao")
+        if nome in ("run", "daemon"):
+            sub.add_argument("--modo", choices=(MODO_PASTA, MODO_REPOSITORIO, MODO_ARQUIVO))
+        if nome == "run":
+            sub.add_argument("--descartar-interrompido", action="store_true", dest="descartar_interrompido",
+                             help="Recomeça do zero em vez de retomar um backup interrompido")
+        if nome == "prune":
+            sub.add_argument("--dry-run", action="store_true", dest="dry_run")
+        if nome == "verify":
+            sub.add_argument("--snapshot", type=int, help="Id do snapshot (padrão: o último da origem/destino)")
+            sub.add_argument("--amostra", type=float, default=1.0, help="Fração verificada por rodada (ex.: 0.1)")
+            sub.add_argument("--rodada", type=int, help="Rodada da amostragem (padrão: o dia atual)")
+            sub.add_argument("--workers", type=int)
+        if nome == "restore":
+            sub.add_argument("--alvo", required=True, help="Pasta onde os arquivos serão restaurados")
+            sub.add_argument("--snapshot", type=int, help="Id do snapshot (padrão: a versão mais recente)")
+            sub.add_argument("--momento", help='Versões até este momento, ex.: "2026-01-31 18:00:00"')
+            sub.add_argument("--incluir", nargs="+", help='Globs dos caminhos, ex.: "docs/*.xlsx" projetos/app')
+            sub.add_argument("--workers", type=int)
+            sub.add_argument("--sem-verificar", action="store_true", dest="sem_verificar",
+                             help="Não confere o hash do manifesto ao restaurar")
+        if nome == "find":
+            sub.add_argument("termo", nargs="?", default="", help='Ex.: "docs/rel", "*.xlsx", "relatorio final"')
+            sub.add_argument("--modo", choices=MODOS_BUSCA, default=BUSCA_PREFIXO)
+            sub.add_argument("--versoes", action="store_true", help="Lista todas as versões do caminho exato")
+            sub.add_argument("--limite", type=int, default=LIMITE_BUSCA_CATALOGO)
+        if nome == "jobs":
+            sub.add_argument("--job", action="append", help="Executa só este job (pode repetir)")
+            sub.add_argument("--listar", action="store_true", help="Lista os jobs, as tarefas e os discos de cada uma")
+        if nome == "status":
+            sub.add_argument("--limite", type=int, default=20)
+            sub.add_argument("--execucao", type=int, help="Mostra a telemetria (fases, latências) de uma execução")
+    args = parser.parse_args(argv)
+
+    # Logs vão para stderr; stdout fica reservado ao JSON do resultado
+    configurar_logging()
+    if args.config:
+        CONFIG_FILE = args.config
+    if args.banco:
+        banco.configurar(args.banco)
+    config = carregar_configuracao()
+    comandos = {"run": comando_run, "full": comando_full, "prune": comando_prune, "status": comando_status,
+                "verify": comando_verify, "restore": comando_restore, "find": comando_find, "jobs": comando_jobs,
+                "daemon": comando_daemon}
+    resultado = comandos[args.comando](args, config)
+    if resultado is not None:
+        _imprimir_json(resultado)
+    status = (resultado or {}).get("status", "")
+    return 1 if status.startswith("Erro") else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,328 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timedelta
+
+# Benchmarks reproduzíveis dos caminhos do motor (varredura, cópia completa, incremental e retenção).
+# Cada caso roda em um processo separado para que o pico de memória e os contadores de E/S sejam só dele:
+#   python benchmark.py --formas pequenos misto --escala 0.01 --salvar resultado.json --baseline baseline.json
+# Para comparar tmpfs e disco, rode duas vezes variando --diretorio (ex.: /dev/shm e uma pasta no disco).
+# Por padrão as repetições rodam com o cache de páginas quente; em disco real use --cache-frio (Linux, root).
+
+try:
+    import resource  # Pico de RSS (Unix); no Windows o campo fica nulo
+except ImportError:
+    resource = None
+
+SEMENTE = 0x42454E43
+MTIME_FIXO = 1_600_000_000  # Árvores idênticas entre execuções: mesmo conteúdo e mesmos mtimes
+BLOCO_CONTEUDO = 1024 * 1024
+LIMITE_REGRESSAO_PADRAO = 0.10
+SNAPSHOTS_RETENCAO = 5
+VERSAO_ARVORE = 1  # Incrementar quando a geração mudar, para não reaproveitar árvores antigas
+
+# Formas das árvores sintéticas em escala 1.0; --escala reduz arquivos e tamanhos proporcionalmente
+FORMAS = {
+    "pequenos": {"arquivos": 1_000_000, "tamanho": 512, "por_pasta": 1000, "profundidade": 1},
+    "grandes": {"arquivos": 3, "tamanho": 2 * 1024 ** 3, "por_pasta": 3, "profundidade": 1},
+    "profundo": {"arquivos": 20_000, "tamanho": 4096, "por_pasta": 4, "profundidade": 40},
+    "misto": {"arquivos": 100_000, "tamanho": None, "por_pasta": 200, "profundidade": 6},
+}
+
+CASOS = ["escanear", "completo_inicial", "completo_sem_mudancas", "incremental_inicial",
+         "incremental_sem_mudancas", "retencao"]
+
+# Métricas comparadas com a baseline: maior é melhor
+METRICAS_VAZAO = ("arquivos_s", "mb_s")
+
+def tamanho_misto(gerador):
+    # Distribuição típica de uma pasta de usuário: maioria pequena, cauda de arquivos grandes
+    sorteio = gerador.random()
+    if sorteio < 0.70:
+        return gerador.randint(0, 16 * 1024)
+    if sorteio < 0.95:
+        return gerador.randint(16 * 1024, 1024 * 1024)
+    if sorteio < 0.995:
+        return gerador.randint(1024 * 1024, 32 * 1024 * 1024)
+    return gerador.randint(32 * 1024 * 1024, 256 * 1024 * 1024)
+
+def gravar_conteudo(caminho, tamanho, bloco, indice):
+    # Conteúdo pseudoaleatório reaproveitando um bloco fixo; o cabeçalho por bloco evita que
+    # arquivos e blocos fiquem idênticos (o que favoreceria deduplicação e compressão)
+    with open(caminho, "wb") as f:
+        restante = tamanho
+        numero = 0
+        while restante > 0:
+            parte = min(restante, len(bloco))
+            cabecalho = f"{indice}:{numero}:".encode()
+            f.write((cabecalho + bloco[len(cabecalho):parte])[:parte])
+            restante -= parte
+            numero += 1
+    os.utime(caminho, (MTIME_FIXO, MTIME_FIXO))
+
+def caminho_pasta(raiz, indice_pasta, profundidade):
+    partes = [f"d{indice_pasta % 10}"]
+    for nivel in range(1, profundidade):
+        partes.append(f"n{nivel}_{(indice_pasta // (10 ** min(nivel, 4))) % 10}")
+    partes.append(f"p{indice_pasta}")
+    return os.path.join(raiz, *partes)
+
+def gerar_arvore(raiz, forma, escala):
+    # Reaproveita a árvore se já foi gerada com os mesmos parâmetros (gerar 1M de arquivos leva minutos)
+    marcador = os.path.join(raiz, ".benchmark.json")
+    parametros = {"forma": forma, "escala": escala, "versao": VERSAO_ARVORE}
+    if os.path.exists(marcador):
+        with open(marcador) as f:
+            if json.load(f) == parametros:
+                return raiz
+    shutil.rmtree(raiz, ignore_errors=True)
+    os.makedirs(raiz)
+    definicao = FORMAS[forma]
+    gerador = random.Random(SEMENTE)
+    bloco = gerador.randbytes(BLOCO_CONTEUDO)
+    arquivos = max(1, int(definicao["arquivos"] * escala))
+    for indice in range(arquivos):
+        pasta = caminho_pasta(raiz, indice // definicao["por_pasta"], definicao["profundidade"])
+        os.makedirs(pasta, exist_ok=True)
+        if definicao["tamanho"] is None:
+            tamanho = int(tamanho_misto(gerador) * min(1.0, escala * 10))
+        elif forma == "grandes":
+            tamanho = max(BLOCO_CONTEUDO, int(definicao["tamanho"] * escala))
+        else:
+            tamanho = definicao["tamanho"]
+        gravar_conteudo(os.path.join(pasta, f"f{indice}.dat"), tamanho, bloco, indice)
+    with open(marcador, "w") as f:
+        json.dump(parametros, f)
+    return raiz
+
+def tipo_sistema_arquivos(caminho):
+    # Registrado no resultado para não comparar uma execução em tmpfs com uma em disco
+    try:
+        caminho = os.path.realpath(caminho)
+        melhor = ("", None)
+        with open("/proc/mounts") as f:
+            for linha in f:
+                partes = linha.split()
+                if caminho.startswith(partes[1]) and len(partes[1]) > len(melhor[0]):
+                    melhor = (partes[1], partes[2])
+        return melhor[1]
+    except OSError:
+        return None
+
+def ler_contadores_io():
+    # Chamadas read/write (e variantes) do processo, de /proc/self/io (Linux). Não inclui stat, open,
+    # getdents nem close: numa varredura esse número fica perto de zero por arquivo.
+    try:
+        with open("/proc/self/io") as f:
+            campos = dict(linha.split(": ") for linha in f.read().splitlines())
+        return int(campos["syscr"]) + int(campos["syscw"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def descartar_cache():
+    # Esvazia o cache de páginas, dentries e inodes (Linux, requer root) para que a medição leia do disco
+    try:
+        os.sync()
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+        return True
+    except (OSError, AttributeError):
+        return False
+
+def pico_rss_mb():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+def preparar_retencao(motor, origem, destino, entradas):
+    # Snapshots antigos vinculados entre si, como os deixados por backup_diario ao longo de dias
+    shutil.rmtree(destino, ignore_errors=True)
+    os.makedirs(destino)
+    anterior = None
+    data = datetime(2020, 1, 1)
+    for _ in range(SNAPSHOTS_RETENCAO + 1):
+        caminho = os.path.join(destino, f"backup_{data.strftime('%Y-%m-%d_%H-%M-%S')}")
+        os.makedirs(caminho)
+        motor.backup_incremental(origem, caminho, lambda *_: None, entradas, anterior)
+        anterior = (caminho, {entrada.rel_path: (entrada.tamanho, entrada.mtime, None) for entrada in entradas})
+        data += timedelta(days=1)
+
+def executar_caso(caso, origem, trabalho, workers, cache_frio=False):
+    # Executado no processo filho. A preparação fica fora da medição; os destinos de um caso
+    # "inicial" são reaproveitados pelo caso "sem_mudancas" seguinte. Com cache_frio, o cache é
+    # descartado depois da preparação, que sozinha já deixaria a árvore inteira em memória.
+    import backup_engine as motor
+    motor.CONFIG_FILE = os.path.join(trabalho, "config.json")  # Sem configuração do usuário
+    motor.banco.configurar(os.path.join(trabalho, "historico.db"))
+    destino_completo = os.path.join(trabalho, "completo")
+    # Dois snapshots consecutivos: o segundo vincula os arquivos inalterados do primeiro
+    snapshot_inicial = os.path.join(trabalho, "incremental", "backup_2020-01-01_00-00-00")
+    snapshot_seguinte = os.path.join(trabalho, "incremental", "backup_2020-01-02_00-00-00")
+    destino_retencao = os.path.join(trabalho, "retencao")
+    nulo = lambda *_: None
+
+    entradas = motor.escanear_origem(origem) if caso != "escanear" else None
+    if caso in ("completo_inicial", "incremental_inicial", "incremental_sem_mudancas"):
+        destino = {"completo_inicial": destino_completo, "incremental_inicial": snapshot_inicial,
+                   "incremental_sem_mudancas": snapshot_seguinte}[caso]
+        shutil.rmtree(destino, ignore_errors=True)
+        os.makedirs(destino)
+    if caso == "incremental_sem_mudancas":
+        manifesto = {entrada.rel_path: (entrada.tamanho, entrada.mtime, None) for entrada in entradas}
+    elif caso == "retencao":
+        preparar_retencao(motor, origem, destino_retencao, entradas)
+
+    if cache_frio and not descartar_cache():
+        raise SystemExit("Não foi possível descartar o cache (--cache-frio requer Linux e root).")
+    chamadas_antes = ler_contadores_io()
+    inicio = time.perf_counter()
+    if caso == "escanear":
+        entradas = motor.escanear_origem(origem)
+        motor.calcular_tamanho_total(origem, entradas)
+    elif caso in ("completo_inicial", "completo_sem_mudancas"):
+        motor.backup_completo(origem, destino_completo, nulo, entradas, workers=workers)
+    elif caso == "incremental_inicial":
+        motor.backup_incremental(origem, snapshot_inicial, nulo, entradas, workers=workers)
+    elif caso == "incremental_sem_mudancas":
+        motor.backup_incremental(origem, snapshot_seguinte, nulo, entradas, (snapshot_inicial, manifesto),
+                                 workers=workers)
+    elif caso == "retencao":
+        # Mesma decisão de remover_backups_antigos, mas síncrona para que a remoção entre na medição
+        motor.aplicar_retencao(destino_retencao, motor.politica_retencao(0, {}), em_segundo_plano=False)
+    duracao = time.perf_counter() - inicio
+    chamadas_depois = ler_contadores_io()
+
+    arquivos = len(entradas)
+    if caso == "retencao":
+        arquivos *= SNAPSHOTS_RETENCAO
+    megabytes = sum(entrada.tamanho for entrada in entradas) / (1024 * 1024)
+    return {
+        "duracao": duracao,
+        "arquivos": arquivos,
+        "arquivos_s": arquivos / duracao if duracao > 0 else 0,
+        "mb_s": megabytes / duracao if duracao > 0 and caso != "retencao" else None,
+        "leituras_escritas_por_arquivo": (chamadas_depois - chamadas_antes) / arquivos
+        if chamadas_antes is not None and arquivos else None,
+        "pico_rss_mb": pico_rss_mb(),
+    }
+
+def medir_em_processo(caso, origem, trabalho, workers, cache_frio=False):
+    comando = [sys.executable, os.path.abspath(__file__), "--caso-interno", caso, origem, trabalho, str(workers or 0),
+               str(int(cache_frio))]
+    ambiente = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                                         os.environ.get("PYTHONPATH")])))
+    saida = subprocess.run(comando, check=True, capture_output=True, text=True, env=ambiente)
+    return json.loads(saida.stdout)
+
+def executar_forma(forma, diretorio, escala, repeticoes, casos, workers, cache_frio=False):
+    origem = gerar_arvore(os.path.join(diretorio, f"origem_{forma}"), forma, escala)
+    trabalho = os.path.join(diretorio, f"trabalho_{forma}")
+    shutil.rmtree(trabalho, ignore_errors=True)
+    os.makedirs(trabalho)
+    resultados = {}
+    try:
+        for caso in casos:
+            amostras = []
+            for _ in range(repeticoes):
+                if caso.endswith("_sem_mudancas"):
+                    # Cada repetição parte do estado deixado pelo caso inicial correspondente
+                    medir_em_processo(caso.replace("_sem_mudancas", "_inicial"), origem, trabalho, workers)
+                amostras.append(medir_em_processo(caso, origem, trabalho, workers, cache_frio))
+            # Mediana das repetições; as amostras ficam no resultado para avaliar a dispersão
+            resultado = {chave: statistics.median(amostra[chave] for amostra in amostras)
+                         if amostras[0][chave] is not None else None for chave in amostras[0]}
+            resultado["duracoes"] = [amostra["duracao"] for amostra in amostras]
+            resultados[caso] = resultado
+            print(f"{forma:>9} {caso:<25} {resultado['duracao']:8.3f}s {resultado['arquivos_s']:12.0f} arq/s", file=sys.stderr)
+    finally:
+        shutil.rmtree(trabalho, ignore_errors=True)
+    return resultados
+
+def comparar_baseline(resultado, baseline, limite):
+    # Regressão: vazão abaixo de (1 - limite) da baseline na mesma forma e caso
+    regressoes = []
+    for forma, casos in resultado["formas"].items():
+        for caso, atual in casos.items():
+            referencia = baseline.get("formas", {}).get(forma, {}).get(caso)
+            if not referencia:
+                continue
+            for metrica in METRICAS_VAZAO:
+                if atual.get(metrica) and referencia.get(metrica):
+                    variacao = atual[metrica] / referencia[metrica] - 1
+                    if variacao < -limite:
+                        regressoes.append({"forma": forma, "caso": caso, "metrica": metrica,
+                                           "baseline": referencia[metrica], "atual": atual[metrica],
+                                           "variacao": variacao})
+    return regressoes
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmarks do motor de backup")
+    parser.add_argument("--formas", nargs="+", choices=sorted(FORMAS), default=sorted(FORMAS))
+    parser.add_argument("--casos", nargs="+", choices=CASOS, default=CASOS)
+    parser.add_argument("--escala", type=float, default=1.0, help="Fração do número de arquivos e tamanhos (ex.: 0.01)")
+    parser.add_argument("--diretorio", default=os.path.join(os.getcwd(), "benchmark_dados"),
+                        help="Onde as árvores são geradas (tmpfs ou disco)")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--workers", type=int, help="Fixa o número de workers de cópia")
+    parser.add_argument("--salvar", help="Arquivo JSON para gravar o resultado")
+    parser.add_argument("--baseline", help="Resultado anterior para detectar regressões")
+    parser.add_argument("--limite-regressao", type=float, default=LIMITE_REGRESSAO_PADRAO, dest="limite_regressao")
+    parser.add_argument("--cache-frio", action="store_true", dest="cache_frio",
+                        help="Descarta o cache de páginas antes de cada medição (Linux, requer root)")
+    parser.add_argument("--caso-interno", nargs=5, help=argparse.SUPPRESS, dest="caso_interno")
+    args = parser.parse_args(argv)
+
+    if args.caso_interno:
+        caso, origem, trabalho, workers, cache_frio = args.caso_interno
+        print(json.dumps(executar_caso(caso, origem, trabalho, int(workers) or None, cache_frio == "1")))
+        return 0
+    if args.cache_frio and not descartar_cache():
+        print("Não foi possível descartar o cache: --cache-frio requer Linux e permissão de root.", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.diretorio, exist_ok=True)
+    resultado = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "ambiente": {
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "sistema_arquivos": tipo_sistema_arquivos(args.diretorio),
+        },
+        "parametros": {"escala": args.escala, "repeticoes": args.repeticoes, "workers": args.workers,
+                       "cache": "frio" if args.cache_frio else "quente"},
+        "formas": {forma: executar_forma(forma, args.diretorio, args.escala, args.repeticoes, args.casos, args.workers,
+                                         args.cache_frio)
+                   for forma in args.formas},
+    }
+    codigo = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("parametros", {}).get("escala") != args.escala:
+            print("Aviso: baseline gerada com outra escala; a comparação pode não ser significativa.", file=sys.stderr)
+        if baseline.get("parametros", {}).get("cache", "quente") != resultado["parametros"]["cache"]:
+            print("Aviso: baseline medida com outro modo de cache (quente/frio); a comparação pode não ser significativa.",
+                  file=sys.stderr)
+        resultado["regressoes"] = comparar_baseline(resultado, baseline, args.limite_regressao)
+        for regressao in resultado["regressoes"]:
+            print(f"Regressão: {regressao['forma']}/{regressao['caso']} {regressao['metrica']} "
+                  f"{regressao['variacao']:+.1%}", file=sys.stderr)
+        codigo = 1 if resultado["regressoes"] else 0
+    saida = json.dumps(resultado, ensure_ascii=False, indent=2)
+    if args.salvar:
+        with open(args.salvar, "w") as f:
+            f.write(saida)
+    print(saida)
+    return codigo
+
+if __name__ == "__main__":
+    raise SystemExit(main())